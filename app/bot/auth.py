@@ -1,141 +1,183 @@
 from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from pyrogram.errors import SessionPasswordNeeded, PhoneCodeInvalid, PasswordHashInvalid, PhoneCodeExpired
-from app.bot.states import user_login_states, LoginStep, user_profile_states, ProfileStep
-from app.database.db import save_user_session, get_user_session, save_user_profile, get_user_profile
+from pyrogram.types import Message, InlineKeyboardButton, CallbackQuery
+from pyrogram.errors import SessionPasswordNeeded, PhoneCodeInvalid, PasswordHashInvalid, PhoneCodeExpired, MessageNotModified
+from app.bot.states import (
+    LoginStep, ProfileStep, user_states, get_login_state, get_profile_state,
+    begin_profile_setup, end_profile_setup, disconnect_in_background,
+)
+from app.utils.message import CachedInlineKeyboardMarkup
+from app.database.db import (
+    save_user_session, save_user_profile,
+    get_cached_user_session, get_user_auth_state, invalidate_user_session,
+)
 import asyncio
+import logging
 
-# We need a way to keep track of the temporary client for each user during login
-# user_id -> Client
-temp_clients = {}
+logger = logging.getLogger(__name__)
+
+# Characters stripped from phone numbers before sending the login code
+_PHONE_STRIP = str.maketrans("", "", " -()")
+
+# Static keyboards are built once at import time. Pyrogram only reads the
+# markup when serializing the request, so sharing the instances is safe, and
+# CachedInlineKeyboardMarkup also reuses the raw markup after the first send.
+_CANCEL_KB = CachedInlineKeyboardMarkup([
+    [InlineKeyboardButton("❌ Cancel", callback_data="cancel_login")]
+])
+
+_GENDER_KB = CachedInlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("👨 Lelaki", callback_data="profile_gender_lelaki"),
+        InlineKeyboardButton("👩 Perempuan", callback_data="profile_gender_perempuan"),
+    ]
+])
+
+_LOGIN_KB = CachedInlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("1", callback_data="login_1"),
+        InlineKeyboardButton("2", callback_data="login_2"),
+        InlineKeyboardButton("3", callback_data="login_3"),
+    ],
+    [
+        InlineKeyboardButton("4", callback_data="login_4"),
+        InlineKeyboardButton("5", callback_data="login_5"),
+        InlineKeyboardButton("6", callback_data="login_6"),
+    ],
+    [
+        InlineKeyboardButton("7", callback_data="login_7"),
+        InlineKeyboardButton("8", callback_data="login_8"),
+        InlineKeyboardButton("9", callback_data="login_9"),
+    ],
+    [
+        InlineKeyboardButton("DEL", callback_data="login_del"),
+        InlineKeyboardButton("0", callback_data="login_0"),
+        InlineKeyboardButton("✅ Done", callback_data="login_done"),
+    ],
+    [
+        InlineKeyboardButton("❌ Cancel", callback_data="cancel_login"),
+    ],
+])
+
+_MAIN_KB_LOGGED_IN = CachedInlineKeyboardMarkup([
+    [InlineKeyboardButton("📤 Cara Guna", callback_data="menu_help")],
+    [InlineKeyboardButton("🔄 Re-Login", callback_data="menu_login")],
+])
+
+_MAIN_KB_LOGGED_OUT = CachedInlineKeyboardMarkup([
+    [InlineKeyboardButton("🔐 Login", callback_data="menu_login")],
+    [InlineKeyboardButton("📖 Help", callback_data="menu_help")],
+])
 
 def get_cancel_keyboard():
     """Get keyboard with just a cancel button."""
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("❌ Cancel", callback_data="cancel_login")]
-    ])
+    return _CANCEL_KB
 
 def get_gender_keyboard():
     """Get keyboard for gender selection."""
-    return InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton("👨 Lelaki", callback_data="profile_gender_lelaki"),
-            InlineKeyboardButton("👩 Perempuan", callback_data="profile_gender_perempuan"),
-        ]
-    ])
+    return _GENDER_KB
 
 def get_login_keyboard():
-    keyboard = [
-        [
-            InlineKeyboardButton("1", callback_data="login_1"),
-            InlineKeyboardButton("2", callback_data="login_2"),
-            InlineKeyboardButton("3", callback_data="login_3"),
-        ],
-        [
-            InlineKeyboardButton("4", callback_data="login_4"),
-            InlineKeyboardButton("5", callback_data="login_5"),
-            InlineKeyboardButton("6", callback_data="login_6"),
-        ],
-        [
-            InlineKeyboardButton("7", callback_data="login_7"),
-            InlineKeyboardButton("8", callback_data="login_8"),
-            InlineKeyboardButton("9", callback_data="login_9"),
-        ],
-        [
-            InlineKeyboardButton("DEL", callback_data="login_del"),
-            InlineKeyboardButton("0", callback_data="login_0"),
-            InlineKeyboardButton("✅ Done", callback_data="login_done"),
-        ],
-        [
-            InlineKeyboardButton("❌ Cancel", callback_data="cancel_login"),
-        ],
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _LOGIN_KB
 
 def get_main_menu_keyboard(is_logged_in=False):
-    """Generate main menu keyboard based on login status."""
-    if is_logged_in:
-        keyboard = [
-            [InlineKeyboardButton("📤 Cara Guna", callback_data="menu_help")],
-            [InlineKeyboardButton("🔄 Re-Login", callback_data="menu_login")],
-        ]
-    else:
-        keyboard = [
-            [InlineKeyboardButton("🔐 Login", callback_data="menu_login")],
-            [InlineKeyboardButton("📖 Help", callback_data="menu_help")],
-        ]
-    return InlineKeyboardMarkup(keyboard)
+    """Return the main menu keyboard for the given login status."""
+    return _MAIN_KB_LOGGED_IN if is_logged_in else _MAIN_KB_LOGGED_OUT
+
+# Static menu texts, keyed where needed by login status
+HELP_TEXT = (
+    "📖 **Cara guna bot ni**\n\n"
+    "1️⃣ **Login** - Mula-mula korang kena login account Telegram dalam bot ni dulu\n\n"
+    "2️⃣ **Dapatkan Link** - Copy mesej link dari private channel/group. Contohnya:\n"
+    "`https://t.me/c/1234567890/123`\n\n"
+    "3️⃣ **Send Link** - Paste link yang korang copy kat sini. Nanti bot akan forward contentnya\n\n"
+    "📦 **MediaFire** - Boleh juga hantar link MediaFire:\n"
+    "`https://www.mediafire.com/file/abc123/file.zip/file`\n"
+    "Bot akan muat turun dan hantar media (foto/video). "
+    "Kalau fail ZIP/RAR, bot akan extract dan hantar media sahaja.\n\n"
+)
+
+WELCOME_LOGGED_IN = (
+    "👋 **Hye!**\n\n"
+    "✅ Dah login.\n\n"
+    "**Cara guna:**\n"
+    "Copy dan paste mesej link dari private channel/group. Contohnya:\n"
+    "`https://t.me/c/1234567890/123`\n\n"
+    "Nanti bot akan forward contentnya."
+)
+
+WELCOME_LOGGED_OUT = (
+    "👋 **Hye!**\n\n"
+    "Bot ni boleh forward restricted content dari private channels/group untuk korang.\n\n"
+    "**Untuk mula:**\n"
+    "Korang perlu login dengan akaun Telegram dalam bot ni.\n\n"
+    "👇 **Klik butang kat bawah untuk login:**"
+)
+
+CANCELLED_LOGGED_IN = (
+    "❌ **Login dibatalkan.**\n\n"
+    "✅ Session lama masih aktif.\n\n"
+    "**Cara guna:**\n"
+    "Copy dan paste mesej link dari private channel/group. Contohnya:\n"
+    "`https://t.me/c/1234567890/123`"
+)
+
+CANCELLED_LOGGED_OUT = (
+    "❌ **Login dibatalkan.**\n\n"
+    "Anda perlu login untuk menggunakan bot ini.\n\n"
+    "👇 **Tekan butang dibawah untuk login:**"
+)
+
+BACK_KB = CachedInlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Menu", callback_data="menu_back")]
+])
+
+# Shown whenever the login flow has to be aborted
+_ERROR_KB = CachedInlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Try Again", callback_data="menu_login")],
+    [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_back")]
+])
+
+# is_logged_in -> (text, keyboard)
+_WELCOME_SCREENS = {
+    True: (WELCOME_LOGGED_IN, _MAIN_KB_LOGGED_IN),
+    False: (WELCOME_LOGGED_OUT, _MAIN_KB_LOGGED_OUT),
+}
+
+async def _menu_login(client: Client, callback_query: CallbackQuery):
+    # Start login process
+    await start_login_process(client, callback_query.message, callback_query.from_user.id)
+
+async def _menu_help(client: Client, callback_query: CallbackQuery):
+    await callback_query.message.edit_text(HELP_TEXT, reply_markup=BACK_KB)
+
+async def _menu_back(client: Client, callback_query: CallbackQuery):
+    auth_state = await get_user_auth_state(callback_query.from_user.id)
+    text, keyboard = _WELCOME_SCREENS[auth_state["session"] is not None]
+    await callback_query.message.edit_text(text, reply_markup=keyboard)
+
+# callback_data -> handler
+_MENU_ACTIONS = {
+    "menu_login": _menu_login,
+    "menu_help": _menu_help,
+    "menu_back": _menu_back,
+}
 
 async def handle_main_menu_callback(client: Client, callback_query: CallbackQuery):
     """Handle main menu button callbacks."""
-    user_id = callback_query.from_user.id
-    action = callback_query.data.split("_")[1]
-    
-    if action == "login":
-        await callback_query.answer()
-        # Start login process
-        await start_login_process(client, callback_query.message, user_id)
-    
-    elif action == "help":
-        await callback_query.answer()
-        help_text = (
-            "📖 **Cara guna bot ni**\n\n"
-            "1️⃣ **Login** - Mula-mula korang kena login account Telegram dalam bot ni dulu\n\n"
-            "2️⃣ **Dapatkan Link** - Copy mesej link dari private channel/group. Contohnya:\n"
-            "`https://t.me/c/1234567890/123`\n\n"
-            "3️⃣ **Send Link** - Paste link yang korang copy kat sini. Nanti bot akan forward contentnya\n\n"
-            "📦 **MediaFire** - Boleh juga hantar link MediaFire:\n"
-            "`https://www.mediafire.com/file/abc123/file.zip/file`\n"
-            "Bot akan muat turun dan hantar media (foto/video). "
-            "Kalau fail ZIP/RAR, bot akan extract dan hantar media sahaja.\n\n"
-        )
-        existing_session = await get_user_session(user_id)
-        is_logged_in = existing_session is not None
-        
-        await callback_query.message.edit_text(
-            help_text,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Menu", callback_data="menu_back")]
-            ])
-        )
-    
-    elif action == "back":
-        await callback_query.answer()
-        existing_session = await get_user_session(user_id)
-        is_logged_in = existing_session is not None
-        
-        if is_logged_in:
-            welcome_text = (
-                "👋 **Hye!**\n\n"
-                "✅ Dah login.\n\n"
-                "**Cara guna:**\n"
-                "Copy dan paste mesej link dari private channel/group. Contohnya:\n"
-                "`https://t.me/c/1234567890/123`\n\n"
-                "Nanti bot akan forward contentnya."
-            )
-        else:
-            welcome_text = (
-                "👋 **Hye!**\n\n"
-                "Bot ni boleh forward restricted content dari private channels/group untuk korang.\n\n"
-                "**Untuk mula:**\n"
-                "Korang perlu login dengan akaun Telegram dalam bot ni.\n\n"
-                "👇 **Klik butang kat bawah untuk login:**"
-            )
-        
-        await callback_query.message.edit_text(
-            welcome_text,
-            reply_markup=get_main_menu_keyboard(is_logged_in)
-        )
+    handler = _MENU_ACTIONS.get(callback_query.data)
+    if handler is None:
+        return
+    await callback_query.answer()
+    await handler(client, callback_query)
 
 async def start_login_process(client: Client, message: Message, user_id: int):
     """Start the login process (can be called from button or command)."""
     # Check if already logged in
-    existing_session = await get_user_session(user_id)
+    existing_session = await get_cached_user_session(user_id)
     
-    user_login_states[user_id] = {
-        "step": LoginStep.ASK_API_ID,
-        "data": {}
-    }
+    state = user_states.get_or_create(user_id)
+    state.step = LoginStep.ASK_API_ID
+    state.data = {}
     
     if existing_session:
         await message.reply_text(
@@ -160,79 +202,56 @@ async def handle_login_command(client: Client, message: Message):
 
 async def cancel_login(client: Client, message: Message):
     user_id = message.from_user.id
-    if user_id in user_login_states:
-        if user_id in temp_clients:
-            await temp_clients[user_id].disconnect()
-            del temp_clients[user_id]
-        del user_login_states[user_id]
-        
-        existing_session = await get_user_session(user_id)
-        is_logged_in = existing_session is not None
-        
-        await message.reply_text(
-            "❌ Login proses dibatalkan.",
-            reply_markup=get_main_menu_keyboard(is_logged_in)
-        )
+    if get_login_state(user_id):
+        temp_client = cleanup_login_sync(user_id)
+        text = "❌ Login proses dibatalkan."
     else:
-        existing_session = await get_user_session(user_id)
-        is_logged_in = existing_session is not None
-        
-        await message.reply_text(
-            "ℹ️ Tidak di dalam proses login.",
-            reply_markup=get_main_menu_keyboard(is_logged_in)
-        )
+        temp_client = None
+        text = "ℹ️ Tidak di dalam proses login."
+
+    if temp_client:
+        disconnect_in_background(temp_client)
+
+    existing_session = await get_cached_user_session(user_id)
+    is_logged_in = existing_session is not None
+    await message.reply_text(
+        text,
+        reply_markup=get_main_menu_keyboard(is_logged_in)
+    )
 
 async def cancel_login_callback(client: Client, callback_query: CallbackQuery):
     """Handle cancel button callback."""
     user_id = callback_query.from_user.id
     await callback_query.answer("Login dibatalkan")
     
-    if user_id in user_login_states:
-        if user_id in temp_clients:
-            await temp_clients[user_id].disconnect()
-            del temp_clients[user_id]
-        del user_login_states[user_id]
+    temp_client = cleanup_login_sync(user_id) if get_login_state(user_id) else None
+    if temp_client:
+        disconnect_in_background(temp_client)
     
-    existing_session = await get_user_session(user_id)
+    existing_session = await get_cached_user_session(user_id)
     is_logged_in = existing_session is not None
     
-    if is_logged_in:
-        welcome_text = (
-            "❌ **Login dibatalkan.**\n\n"
-            "✅ Session lama masih aktif.\n\n"
-            "**Cara guna:**\n"
-            "Copy dan paste mesej link dari private channel/group. Contohnya:\n"
-            "`https://t.me/c/1234567890/123`"
-        )
-    else:
-        welcome_text = (
-            "❌ **Login dibatalkan.**\n\n"
-            "Anda perlu login untuk menggunakan bot ini.\n\n"
-            "👇 **Tekan butang dibawah untuk login:**"
-        )
-    
     await callback_query.message.edit_text(
-        welcome_text,
+        CANCELLED_LOGGED_IN if is_logged_in else CANCELLED_LOGGED_OUT,
         reply_markup=get_main_menu_keyboard(is_logged_in)
     )
 
 async def handle_auth_message(client: Client, message: Message):
     user_id = message.from_user.id
-    state = user_login_states.get(user_id)
+    state = get_login_state(user_id)
     
     if not state:
         return False # Not handling auth
 
-    step = state["step"]
+    step = state.step
     text = message.text.strip()
 
     if text == "/cancel":
-        if user_id in temp_clients:
-            await temp_clients[user_id].disconnect()
-            del temp_clients[user_id]
-        del user_login_states[user_id]
+        temp_client = cleanup_login_sync(user_id)
+        if temp_client:
+            disconnect_in_background(temp_client)
         
-        existing_session = await get_user_session(user_id)
+        existing_session = await get_cached_user_session(user_id)
         is_logged_in = existing_session is not None
         
         await message.reply_text(
@@ -243,29 +262,33 @@ async def handle_auth_message(client: Client, message: Message):
 
     try:
         if step == LoginStep.ASK_API_ID:
-            if not text.isdigit():
+            try:
+                api_id = int(text)
+            except ValueError:
+                api_id = 0
+            if api_id <= 0:
                 await message.reply_text(
                     "⚠️ API ID mesti nombor. Sila cuba lagi.",
                     reply_markup=get_cancel_keyboard()
                 )
                 return True
-            state["data"]["api_id"] = int(text)
-            state["step"] = LoginStep.ASK_API_HASH
+            state.data["api_id"] = api_id
+            state.step = LoginStep.ASK_API_HASH
             await message.reply_text(
                 "2️⃣ Bagus! Sekarang hantar **API HASH**.",
                 reply_markup=get_cancel_keyboard()
             )
         elif step == LoginStep.ASK_API_HASH:
-            state["data"]["api_hash"] = text
-            state["step"] = LoginStep.ASK_PHONE
+            state.data["api_hash"] = text
+            state.step = LoginStep.ASK_PHONE
             await message.reply_text(
                 "3️⃣ Hantar **Nombor Telefon**",
                 reply_markup=get_cancel_keyboard()
             )
         elif step == LoginStep.ASK_PHONE:
             # Sanitize phone number
-            phone_number = text.replace(" ", "").replace("-", "").replace("(", "").replace(")", "")
-            state["data"]["phone"] = phone_number
+            phone_number = text.translate(_PHONE_STRIP)
+            state.data["phone"] = phone_number
             
             await message.reply_text(
                 f"🔄 Menghubungkan ke server Telegram dengan {phone_number}...",
@@ -275,20 +298,20 @@ async def handle_auth_message(client: Client, message: Message):
             # Initialize Temp Client
             temp_client = Client(
                 name=f"login_{user_id}",
-                api_id=state["data"]["api_id"],
-                api_hash=state["data"]["api_hash"],
+                api_id=state.data["api_id"],
+                api_hash=state.data["api_hash"],
                 in_memory=True
             )
             await temp_client.connect()
-            temp_clients[user_id] = temp_client
+            state.temp_client = temp_client
 
             try:
                 sent_code = await temp_client.send_code(phone_number)
-                state["data"]["phone_code_hash"] = sent_code.phone_code_hash
-                state["step"] = LoginStep.ASK_CODE
-                state["data"]["temp_code"] = "" # Initialize temp code
+                state.data["phone_code_hash"] = sent_code.phone_code_hash
+                state.step = LoginStep.ASK_CODE
+                state.data["temp_code"] = "" # Initialize temp code
                 
-                await message.reply_text(
+                keypad_msg = await message.reply_text(
                     "4️⃣ **Last Part**\n"
                     "Masukkan kod yang Telegram bagi.\n\n"
                     "⚠️ **JANGAN HANTAR KOD SEBAGAI TEKS** (Nanti Error).\n"
@@ -296,42 +319,37 @@ async def handle_auth_message(client: Client, message: Message):
                     "Kod: `_ _ _ _ _`",
                     reply_markup=get_login_keyboard()
                 )
+                state.data["last_display"] = (keypad_msg.id, format_code_display(""))
             except Exception as e:
-                await message.reply_text(
-                    f"❌ Error hantar kod: {e}",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🔄 Try Again", callback_data="menu_login")],
-                        [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_back")]
-                    ])
+                await _handle_login_exception(
+                    message, user_id, e, "send_code", text="❌ Error hantar kod. Sila cuba lagi."
                 )
-                await temp_client.disconnect()
-                del temp_clients[user_id]
-                del user_login_states[user_id]
 
         elif step == LoginStep.ASK_CODE:
-            # Delete the user's message to prevent code from being sent as text
-            try:
-                await message.delete()
-            except:
-                pass  # In case bot doesn't have delete permission
-            
             # Update the display with a warning
-            current_code = state["data"].get("temp_code", "")
-            display = " ".join(list(current_code)) + " _" * (5 - len(current_code)) if current_code else "_ _ _ _ _"
+            current_code = state.data.get("temp_code", "")
+            display = format_code_display(current_code)
             
-            await message.reply_text(
-                "4️⃣ **Last Part**\n"
-                "Masukkan kod yang Telegram bagi.\n\n"
-                "⚠️ **JANGAN HANTAR KOD SEBAGAI TEKS** (Nanti Error).\n"
-                "👇 **Guna butang bawah ni untuk masukkan kod:**\n"
-                f"Kod: `{display}`\n\n"
-                "🚫 **Mesej anda telah dipadam.**\n"
-                "Sila guna butang sahaja!",
-                reply_markup=get_login_keyboard()
+            # Delete the user's message (so the code isn't left as text) and
+            # re-send the keypad concurrently. Delete may fail if the bot
+            # doesn't have permission, which is fine.
+            await asyncio.gather(
+                message.delete(),
+                message.reply_text(
+                    "4️⃣ **Last Part**\n"
+                    "Masukkan kod yang Telegram bagi.\n\n"
+                    "⚠️ **JANGAN HANTAR KOD SEBAGAI TEKS** (Nanti Error).\n"
+                    "👇 **Guna butang bawah ni untuk masukkan kod:**\n"
+                    f"Kod: `{display}`\n\n"
+                    "🚫 **Mesej anda telah dipadam.**\n"
+                    "Sila guna butang sahaja!",
+                    reply_markup=get_login_keyboard()
+                ),
+                return_exceptions=True,
             )
 
         elif step == LoginStep.ASK_PASSWORD:
-            temp_client = temp_clients.get(user_id)
+            temp_client = state.temp_client
             try:
                 await temp_client.check_password(password=text)
                 await finalize_login(user_id, message, temp_client, state)
@@ -341,62 +359,94 @@ async def handle_auth_message(client: Client, message: Message):
                     reply_markup=get_cancel_keyboard()
                 )
             except Exception as e:
-                await message.reply_text(
-                    f"❌ Error: {e}",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🔄 Try Again", callback_data="menu_login")],
-                        [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_back")]
-                    ])
-                )
-                await cleanup_login(user_id)
+                await _handle_login_exception(message, user_id, e, "check_password")
 
     except Exception as e:
-        await message.reply_text(
-            f"❌ Error: {e}",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Try Again", callback_data="menu_login")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_back")]
-            ])
-        )
-        await cleanup_login(user_id)
+        await _handle_login_exception(message, user_id, e, step)
 
     return True
 
+async def _handle_login_exception(message, user_id, exc, context, text="❌ Error. Sila cuba lagi."):
+    """Log a login failure, tell the user with a generic message, and reset the flow."""
+    logger.error("Login failed for user %s at %s", user_id, context, exc_info=exc)
+    await message.reply_text(text, reply_markup=_ERROR_KB)
+    await cleanup_login(user_id)
+
 async def handle_login_callback(client: Client, callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
-    state = user_login_states.get(user_id)
+    state = get_login_state(user_id)
     
-    if not state or state["step"] != LoginStep.ASK_CODE:
+    if not state or state.step != LoginStep.ASK_CODE:
         await callback_query.answer("Sesi tamat atau keadaan tidak sah.", show_alert=True)
         return
 
-    data = callback_query.data
-    action = data.split("_")[1]
+    action = callback_query.data.partition("_")[2]
     
-    current_code = state["data"].get("temp_code", "")
+    current_code = state.data.get("temp_code", "")
     
     if action.isdigit():
+        await callback_query.answer()
+        # A press on an already-full code changes nothing — don't redraw
         if len(current_code) < 5:
             current_code += action
-            state["data"]["temp_code"] = current_code
-            await update_code_display(callback_query, current_code)
+            state.data["temp_code"] = current_code
+            schedule_code_display(callback_query, state)
     
     elif action == "del":
-        current_code = current_code[:-1]
-        state["data"]["temp_code"] = current_code
-        await update_code_display(callback_query, current_code)
+        await callback_query.answer()
+        if current_code:
+            current_code = current_code[:-1]
+            state.data["temp_code"] = current_code
+            schedule_code_display(callback_query, state)
         
     elif action == "done":
         if len(current_code) != 5:
              await callback_query.answer("Kod mesti 5 digit.", show_alert=True)
              return
         
+        # Make sure a pending keypad redraw can't overwrite the status below
+        cancel_code_display(state)
+
         # Proceed with login
         await callback_query.message.edit_text("🔄 Memeriksa kod...")
         await process_login_code(client, callback_query.message, user_id, current_code)
 
-async def update_code_display(callback_query, code):
-    display = " ".join(list(code)) + " _" * (5 - len(code))
+def format_code_display(code):
+    """Render the entered digits padded to 5 slots, e.g. ``1 2 _ _ _``."""
+    return " ".join(code.ljust(5, "_"))
+
+# Rapid keypad presses are coalesced into one edit per burst
+CODE_EDIT_DEBOUNCE = 0.15  # seconds
+
+def cancel_code_display(state):
+    """Cancel any keypad redraw that is still waiting to be sent."""
+    task = state.data.pop("edit_task", None)
+    if task and not task.done():
+        task.cancel()
+
+def schedule_code_display(callback_query, state):
+    """Schedule a debounced redraw of the code display for the latest code."""
+    cancel_code_display(state)
+    state.data["pending_code"] = state.data.get("temp_code", "")
+    state.data["edit_task"] = asyncio.create_task(
+        _debounced_code_display(callback_query, state)
+    )
+
+async def _debounced_code_display(callback_query, state):
+    code = state.data.get("pending_code", "")
+    await asyncio.sleep(CODE_EDIT_DEBOUNCE)
+    # A newer press superseded this one; its own task will do the edit
+    if state.data.get("temp_code", "") != code:
+        return
+    await update_code_display(callback_query, state)
+
+async def update_code_display(callback_query, state):
+    display = format_code_display(state.data.get("temp_code", ""))
+    # Telegram rejects edits that don't change the text (MESSAGE_NOT_MODIFIED),
+    # so skip the round-trip when this message already shows this code.
+    shown = (callback_query.message.id, display)
+    if state.data.get("last_display") == shown:
+        return
     try:
         await callback_query.message.edit_text(
             "4️⃣ **Last Part**\n"
@@ -406,30 +456,33 @@ async def update_code_display(callback_query, code):
             f"Kod: `{display}`",
             reply_markup=get_login_keyboard()
         )
-    except:
-        pass # Message not modified
+        state.data["last_display"] = shown
+    except MessageNotModified:
+        pass
+    except Exception as e:
+        logger.debug("Code display edit failed for message %s: %s", callback_query.message.id, e)
 
 async def process_login_code(client, message, user_id, code):
-    state = user_login_states.get(user_id)
-    temp_client = temp_clients.get(user_id)
+    state = get_login_state(user_id)
     
     try:
+        temp_client = state.temp_client
         await temp_client.sign_in(
-            phone_number=state["data"]["phone"],
-            phone_code_hash=state["data"]["phone_code_hash"],
+            phone_number=state.data["phone"],
+            phone_code_hash=state.data["phone_code_hash"],
             phone_code=code
         )
         await finalize_login(user_id, message, temp_client, state)
         
     except SessionPasswordNeeded:
-        state["step"] = LoginStep.ASK_PASSWORD
+        state.step = LoginStep.ASK_PASSWORD
         await message.reply_text(
             "🔐 Two-Step Verification. Masukkan **Password**",
             reply_markup=get_cancel_keyboard()
         )
     
     except PhoneCodeInvalid:
-        state["data"]["temp_code"] = "" # Reset
+        state.data["temp_code"] = "" # Reset
         await message.reply_text(
             "❌ Kod tidak sah. Sila cuba lagi menggunakan butang.", 
             reply_markup=get_login_keyboard()
@@ -437,53 +490,74 @@ async def process_login_code(client, message, user_id, code):
     except PhoneCodeExpired:
         await message.reply_text(
             "❌ Kod dah expired.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Try Again", callback_data="menu_login")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_back")]
-            ])
+            reply_markup=_ERROR_KB
         )
         await cleanup_login(user_id)
     
     except Exception as e:
-        await message.reply_text(
-            f"❌ Error: {e}",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Try Again", callback_data="menu_login")],
-                [InlineKeyboardButton("� Back to Menu", callback_data="menu_back")]
-            ])
-        )
-        await cleanup_login(user_id)
+        await _handle_login_exception(message, user_id, e, "sign_in")
 
 async def finalize_login(user_id, message, temp_client, state):
     session_string = await temp_client.export_session_string()
     
-    await save_user_session(
+    # Write the session while the temp client is torn down, but only report
+    # success once it is actually stored.
+    save_task = asyncio.create_task(save_user_session(
         user_id, 
         session_string, 
-        state["data"]["api_id"], 
-        state["data"]["api_hash"]
-    )
+        state.data["api_id"], 
+        state.data["api_hash"]
+    ))
     
     await cleanup_login(user_id)
     
-    # Start profile setup
+    try:
+        await save_task
+    except Exception as e:
+        logger.error("Failed to save session for user %s", user_id, exc_info=e)
+        await message.reply_text(
+            "❌ **Login tidak dapat disimpan.**\n\nSila /start dan login semula.",
+            reply_markup=_ERROR_KB
+        )
+        return
+    
     await start_profile_setup(user_id, message)
 
+def cleanup_login_sync(user_id):
+    """Clear the user's login flow and return its temp client (if any).
+
+    Does not disconnect the client; that is left to the caller.
+    """
+    state = user_states.get(user_id)
+    if state is None:
+        return None
+    cancel_code_display(state)
+    temp_client = state.temp_client
+    state.step = None
+    state.data = {}
+    state.temp_client = None
+    if state.is_idle:
+        user_states.pop(user_id)
+    return temp_client
+
 async def cleanup_login(user_id):
-    if user_id in temp_clients:
-        await temp_clients[user_id].disconnect()
-        del temp_clients[user_id]
-    if user_id in user_login_states:
-        del user_login_states[user_id]
+    """
+    Reset the login flow and disconnect its temp client in the background.
+
+    Returns the disconnect task (or None) for callers that need the client
+    fully closed before continuing.
+    """
+    invalidate_user_session(user_id)
+    temp_client = cleanup_login_sync(user_id)
+    if temp_client:
+        return disconnect_in_background(temp_client)
+    return None
 
 # ========== Profile Setup Functions ==========
 
 async def start_profile_setup(user_id, message):
     """Start the profile setup process (gender, then age)."""
-    user_profile_states[user_id] = {
-        "step": ProfileStep.ASK_GENDER,
-        "data": {}
-    }
+    begin_profile_setup(user_id)
     
     await message.reply_text(
         "✅ **Login Berjaya!**\n\n"
@@ -492,10 +566,12 @@ async def start_profile_setup(user_id, message):
         reply_markup=get_gender_keyboard()
     )
 
+_GENDER_PREFIX = "profile_gender_"
+
 async def handle_profile_callback(client: Client, callback_query: CallbackQuery):
     """Handle profile setup callbacks (gender selection)."""
     user_id = callback_query.from_user.id
-    state = user_profile_states.get(user_id)
+    state = get_profile_state(user_id)
     
     if not state:
         await callback_query.answer("Sesi tamat. Sila login semula.", show_alert=True)
@@ -503,10 +579,10 @@ async def handle_profile_callback(client: Client, callback_query: CallbackQuery)
     
     data = callback_query.data
     
-    if data.startswith("profile_gender_"):
-        gender = data.replace("profile_gender_", "")
-        state["data"]["gender"] = gender
-        state["step"] = ProfileStep.ASK_AGE
+    if data.startswith(_GENDER_PREFIX):
+        gender = data[len(_GENDER_PREFIX):]
+        state.profile_data["gender"] = gender
+        state.profile_step = ProfileStep.ASK_AGE
         
         await callback_query.answer(f"Jantina: {gender.capitalize()}")
         await callback_query.message.edit_text(
@@ -518,22 +594,23 @@ async def handle_profile_callback(client: Client, callback_query: CallbackQuery)
 async def handle_profile_age_message(client: Client, message: Message):
     """Handle age input from user during profile setup."""
     user_id = message.from_user.id
-    state = user_profile_states.get(user_id)
+    state = get_profile_state(user_id)
     
-    if not state or state["step"] != ProfileStep.ASK_AGE:
+    if not state or state.profile_step != ProfileStep.ASK_AGE:
         return False  # Not handling profile age
     
     text = message.text.strip()
     
     # Validate age
-    if not text.isdigit():
+    try:
+        age = int(text)
+    except ValueError:
         await message.reply_text(
             "⚠️ **Umur mesti nombor!**\n\n"
             "Sila masukkan nombor antara 10-100."
         )
         return True
     
-    age = int(text)
     if age < 10 or age > 100:
         await message.reply_text(
             "⚠️ **Umur tidak sah!**\n\n"
@@ -542,11 +619,11 @@ async def handle_profile_age_message(client: Client, message: Message):
         return True
     
     # Save profile
-    gender = state["data"]["gender"]
+    gender = state.profile_data["gender"]
     await save_user_profile(user_id, gender, age)
     
     # Cleanup state
-    del user_profile_states[user_id]
+    end_profile_setup(user_id)
     
     await message.reply_text(
         "Dah boleh start guna bot ni.\n\n"
@@ -560,5 +637,5 @@ async def handle_profile_age_message(client: Client, message: Message):
 
 async def check_user_profile_complete(user_id):
     """Check if user has completed profile setup (gender and age)."""
-    profile = await get_user_profile(user_id)
-    return profile is not None
+    auth_state = await get_user_auth_state(user_id)
+    return auth_state["profile"] is not None
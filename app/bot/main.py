@@ -1,10 +1,18 @@
 import re
-import random
+import logging
+import json
 import math
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import aclosing
+from functools import lru_cache
 from io import BytesIO
 from pyrogram import Client, filters
 from pyrogram.errors import FloodWait
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, ChatPrivileges
+from pyrogram.types import (
+    Message, ChatPrivileges,
+    InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio,
+)
 from pyrogram.raw.functions.messages import SendMedia
 from pyrogram.raw.functions.upload import SaveFilePart
 from pyrogram.raw.types import (
@@ -19,13 +27,14 @@ from pyrogram.raw.types import (
     InputPeerChannel,
     InputFile
 )
-from app.config import API_ID, API_HASH, BOT_TOKEN, BACKUP_GROUP_ID
-from app.database.db import add_user, save_user_session, log_forward, get_user_session, save_backup_group_cache, get_backup_group_cache, get_user_profile
+from app.config import API_ID, API_HASH, BOT_TOKEN, BACKUP_GROUP_ID, BACKUP_CHANNEL_ID_STR, STATE_DIR
+from app.database.db import add_user, save_user_session, log_forward, get_cached_user_session, save_backup_group_cache, get_backup_group_cache, get_cached_user_profile, save_user_peer_cache, get_user_peer_cache, get_user_auth_state
 from app.bot.session_manager import manager
-from app.utils.streamer import MediaStreamer, upload_stream
-from app.bot.auth import handle_login_command, handle_auth_message, handle_login_callback, cancel_login, handle_main_menu_callback, handle_profile_callback, handle_profile_age_message, start_profile_setup
-from app.bot.states import user_profile_states, ProfileStep
-from app.utils.message import safe_edit
+from app.utils.streamer import MediaStreamer, upload_stream, rand63
+from app.bot.auth import get_main_menu_keyboard, get_gender_keyboard, handle_login_command, handle_auth_message, handle_login_callback, cancel_login, handle_main_menu_callback, handle_profile_callback, handle_profile_age_message, start_profile_setup
+from app.bot.states import begin_profile_setup
+from app.utils.message import safe_edit, StatusThrottler
+from app.utils.ratelimit import rate_limiter, flood_wait_seconds
 from app.terabox.handler import terabox_link_handler, handle_tb_folder_callback, TERABOX_LINK_PATTERN
 from app.mediafire.handler import mediafire_link_handler, MEDIAFIRE_LINK_PATTERN
 from app.torrent.handler import (
@@ -34,7 +43,7 @@ from app.torrent.handler import (
 )
 from app.direct.handler import direct_link_handler, DIRECT_LINK_PATTERN
 from app.utils.media import is_torrent, is_archive, classify, mime, PHOTO_EXTS, VIDEO_EXTS
-from app.mediafire.archive import iter_extract_media, count_media_in_archive
+from app.mediafire.archive import scan_and_extract
 from app.mediafire.streamer import FileStreamer
 import asyncio
 import tempfile
@@ -42,7 +51,11 @@ import shutil
 import os
 import gc
 
-# Track active processes per user (user_id: True if processing)
+logger = logging.getLogger(__name__)
+
+# Track active processes per user (user_id: the handler's asyncio.Task, which
+# /cancel cancels). Under Pyrogram that task is a long-lived dispatcher worker,
+# so every claim must be released by an explicit pop in the handler's finally.
 active_user_processes = {}
 
 # Cancellation events per user (user_id: asyncio.Event)
@@ -61,6 +74,18 @@ def reset_cancel(user_id: int):
     if user_id in cancel_events:
         cancel_events[user_id].clear()
 
+def claim_process(user_id: int) -> bool:
+    """Register the current task as the user's active process.
+
+    Returns False if another process is already running. The check and the
+    claim happen without yielding to the event loop, so two messages can't
+    both get through.
+    """
+    if active_user_processes.get(user_id):
+        return False
+    active_user_processes[user_id] = asyncio.current_task()
+    return True
+
 def request_cancel(user_id: int):
     """Request cancellation for a user's running process."""
     if user_id not in cancel_events:
@@ -74,6 +99,7 @@ def request_cancel(user_id: int):
 # File size limit (2GB in bytes)
 MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
 
+@lru_cache(maxsize=1024)
 def format_file_size(size_bytes):
     """Format file size in human readable format."""
     if size_bytes < 1024:
@@ -85,46 +111,116 @@ def format_file_size(size_bytes):
     else:
         return f"{size_bytes / (1024 * 1024 * 1024):.2f} GB"
 
+# Message attributes that can hold downloadable media, in lookup order
+_MEDIA_ATTRS = ("document", "video", "audio", "photo", "voice", "video_note", "animation", "sticker")
+
+def get_media(msg):
+    """Return (attribute name, media object) for the message's media, or (None, None)."""
+    for attr in _MEDIA_ATTRS:
+        media_obj = getattr(msg, attr, None)
+        if media_obj:
+            return attr, media_obj
+    return None, None
+
+def get_media_obj(msg):
+    """Return the message's media object (document, video, ...), or None."""
+    return get_media(msg)[1]
+
 def get_media_file_size(msg):
     """Get file size from a message's media object."""
-    media_obj = (msg.document or msg.video or msg.audio or 
-                 msg.photo or msg.voice or msg.video_note or
-                 msg.animation or msg.sticker)
-    return getattr(media_obj, "file_size", 0)
-
-# Main menu keyboard
-def get_main_menu_keyboard(is_logged_in=False):
-    """Generate main menu keyboard based on login status."""
-    if is_logged_in:
-        keyboard = [
-            [InlineKeyboardButton("📤 Cara Guna", callback_data="menu_help")],
-            [InlineKeyboardButton("🔄 Re-Login", callback_data="menu_login")],
-        ]
-    else:
-        keyboard = [
-            [InlineKeyboardButton("🔐 Login", callback_data="menu_login")],
-            [InlineKeyboardButton("📖 Help", callback_data="menu_help")],
-        ]
-    return InlineKeyboardMarkup(keyboard)
+    return getattr(get_media_obj(msg), "file_size", 0) or 0
 
 app = Client(
     "bot_session",
     api_id=API_ID,
     api_hash=API_HASH,
-    bot_token=BOT_TOKEN
+    bot_token=BOT_TOKEN,
+    workers=8
 )
 
 # Cache for backup group peer
 backup_group_peer = None
 backup_group_actual_id = None  # Store the actual working ID
 
+# BACKUP_GROUP_ID in -100<channel_id> form, however it was configured
+if BACKUP_GROUP_ID < -10**12:
+    BACKUP_GROUP_CANONICAL_ID = BACKUP_GROUP_ID
+else:
+    BACKUP_GROUP_CANONICAL_ID = -10**12 - abs(BACKUP_GROUP_ID)
+
+# Seconds to wait before probing the backup group with a message again
+BACKUP_PROBE_COOLDOWN = 60
+_last_probe_ts = float("-inf")
+
+# Local copy of the resolved peer, read at import so a restart can skip the
+# database lookup. The database cache stays as the fallback.
+BACKUP_PEER_FILE = os.path.join(STATE_DIR, "backup_peer.json")
+BACKUP_PEER_FILE_VERSION = 1
+
+def _load_backup_peer_file():
+    global backup_group_peer, backup_group_actual_id
+    try:
+        with open(BACKUP_PEER_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != BACKUP_PEER_FILE_VERSION:
+            return  # Written by an incompatible version
+        group_id = data["group_id"]
+        channel_id = data["channel_id"]
+        access_hash = data["access_hash"]
+        actual_id = data["actual_id"]
+        if not all(type(v) is int for v in (group_id, channel_id, access_hash, actual_id)):
+            raise ValueError("non-integer field")
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.warning("Ignoring unreadable %s: %s", BACKUP_PEER_FILE, e)
+        return
+    if group_id != BACKUP_GROUP_ID:
+        return  # Written for a different backup group
+    backup_group_peer = InputPeerChannel(channel_id=channel_id, access_hash=access_hash)
+    backup_group_actual_id = actual_id
+
+def _write_backup_peer_file(peer, actual_id):
+    data = {
+        "version": BACKUP_PEER_FILE_VERSION,
+        "group_id": BACKUP_GROUP_ID,
+        "channel_id": peer.channel_id,
+        "access_hash": peer.access_hash,
+        "actual_id": actual_id,
+    }
+    try:
+        os.makedirs(STATE_DIR, mode=0o700, exist_ok=True)
+        tmp_path = BACKUP_PEER_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, BACKUP_PEER_FILE)
+    except OSError as e:
+        logger.warning("Failed to write %s: %s", BACKUP_PEER_FILE, e)
+
+async def _save_backup_peer(peer, actual_id):
+    """Persist a resolved backup group peer to the database and the local file."""
+    if not (hasattr(peer, 'channel_id') and hasattr(peer, 'access_hash')):
+        return
+    await save_backup_group_cache(peer.channel_id, peer.access_hash)
+    _write_backup_peer_file(peer, actual_id)
+
+_load_backup_peer_file()
+
+# Serializes the slow path so concurrent uploads share one resolution
+_backup_peer_lock = asyncio.Lock()
+
 async def get_backup_group_peer(client: Client):
     """Get and cache the backup group peer."""
-    global backup_group_peer, backup_group_actual_id
-    
     if backup_group_peer:
         return backup_group_peer
-    
+    async with _backup_peer_lock:
+        if backup_group_peer:
+            return backup_group_peer
+        return await _resolve_backup_group_peer(client)
+
+async def _resolve_backup_group_peer(client: Client):
+    global backup_group_peer, backup_group_actual_id, _last_probe_ts
+
     # Try to load from database first (persistent cache)
     cached = await get_backup_group_cache()
     if cached:
@@ -135,98 +231,70 @@ async def get_backup_group_peer(client: Client):
                 access_hash=cached["access_hash"]
             )
             backup_group_actual_id = int(f"-100{cached['group_id']}")
-            print(f"✅ Backup group loaded from database cache: {backup_group_actual_id}")
+            logger.info("✅ Backup group loaded from database cache: %s", backup_group_actual_id)
+            _write_backup_peer_file(backup_group_peer, backup_group_actual_id)
             return backup_group_peer
         except Exception as e:
-            print(f"DEBUG: Failed to load from cache: {e}")
-    
-    # Prepare ID variations to try
-    raw_id = str(BACKUP_GROUP_ID)
-    if raw_id.startswith("-100"):
-        channel_id = int(raw_id[4:])
-    elif raw_id.startswith("-"):
-        channel_id = int(raw_id[1:])
-    else:
-        channel_id = int(raw_id)
-    
-    ids_to_try = [
-        BACKUP_GROUP_ID,                    # As configured
-        int(f"-100{channel_id}"),           # Supergroup format
-        -channel_id,                         # Basic group format
-    ]
-    # Remove duplicates while preserving order
-    ids_to_try = list(dict.fromkeys(ids_to_try))
+            logger.warning("Failed to load from cache: %s", e)
     
-    print(f"DEBUG: Will try these IDs: {ids_to_try}")
-    
-    for test_id in ids_to_try:
-        # Method 1: Try get_chat first (this can work if bot received updates from the group)
-        try:
-            chat = await client.get_chat(test_id)
-            backup_group_peer = await client.resolve_peer(test_id)
-            backup_group_actual_id = test_id
-            # Save to database for persistence
-            if hasattr(backup_group_peer, 'channel_id') and hasattr(backup_group_peer, 'access_hash'):
-                await save_backup_group_cache(backup_group_peer.channel_id, backup_group_peer.access_hash)
-            print(f"✅ Backup group resolved via get_chat: {test_id} ({chat.title})")
-            return backup_group_peer
-        except Exception as e:
-            print(f"DEBUG: get_chat({test_id}) failed: {e}")
-        
-        # Method 2: Try resolve_peer directly
-        try:
-            backup_group_peer = await client.resolve_peer(test_id)
-            backup_group_actual_id = test_id
-            # Save to database for persistence
-            if hasattr(backup_group_peer, 'channel_id') and hasattr(backup_group_peer, 'access_hash'):
-                await save_backup_group_cache(backup_group_peer.channel_id, backup_group_peer.access_hash)
-            print(f"✅ Backup group resolved via resolve_peer: {test_id}")
-            return backup_group_peer
-        except Exception as e:
-            print(f"DEBUG: resolve_peer({test_id}) failed: {e}")
-        
-        # Method 3: Try sending a test message
-        try:
-            test_msg = await client.send_message(test_id, "🤖 Bot initialized - this message can be deleted.")
-            await test_msg.delete()
-            backup_group_peer = await client.resolve_peer(test_id)
-            backup_group_actual_id = test_id
-            # Save to database for persistence
-            if hasattr(backup_group_peer, 'channel_id') and hasattr(backup_group_peer, 'access_hash'):
-                await save_backup_group_cache(backup_group_peer.channel_id, backup_group_peer.access_hash)
-            print(f"✅ Backup group resolved after send_message: {test_id}")
-            return backup_group_peer
-        except Exception as e:
-            print(f"DEBUG: send_message({test_id}) failed: {e}")
-    
-    print("Error")
+    # Pyrogram normalizes IDs itself, so the canonical supergroup form is enough
+    canonical_id = BACKUP_GROUP_CANONICAL_ID
+
+    try:
+        backup_group_peer = await client.resolve_peer(canonical_id)
+        backup_group_actual_id = canonical_id
+        # Save to database for persistence
+        await _save_backup_peer(backup_group_peer, backup_group_actual_id)
+        logger.info("✅ Backup group resolved via resolve_peer: %s", canonical_id)
+        return backup_group_peer
+    except Exception as e:
+        logger.debug("resolve_peer(%s) failed: %s", canonical_id, e)
+
+    # Last resort: sending a message makes Telegram hand us the peer. Don't
+    # spam the group with probes while it keeps failing.
+    now = time.monotonic()
+    if now - _last_probe_ts < BACKUP_PROBE_COOLDOWN:
+        return None
+    _last_probe_ts = now
+
+    try:
+        test_msg = await client.send_message(BACKUP_GROUP_ID, "🤖 Bot initialized - this message can be deleted.")
+        await test_msg.delete()
+        backup_group_peer = await client.resolve_peer(BACKUP_GROUP_ID)
+        backup_group_actual_id = BACKUP_GROUP_ID
+        # Save to database for persistence
+        await _save_backup_peer(backup_group_peer, backup_group_actual_id)
+        logger.info("✅ Backup group resolved after send_message: %s", BACKUP_GROUP_ID)
+        return backup_group_peer
+    except Exception as e:
+        backup_group_peer = None
+        logger.debug("send_message(%s) failed: %s", BACKUP_GROUP_ID, e)
+
+    logger.warning("Could not resolve backup group %s", BACKUP_GROUP_ID)
 
     return None
 
 # Regex to extract chat_id and message_id from Telegram links
 # Private: https://t.me/c/1234567890/123
 # Public:  https://t.me/username/123
-LINK_PATTERN = re.compile(r"https://t\.me/(?:c/(\d+)|([a-zA-Z][a-zA-Z0-9_]{3,}))/(\d+)")
+LINK_PATTERN = re.compile(r"https://t\.me/(?:c/(\d+)|([a-zA-Z][a-zA-Z0-9_]{3,}))/(\d+)", re.ASCII)
 
-# Handler to cache any group the bot is in (runs on ANY message in groups)
-@app.on_message(filters.group, group=-1)
+# The dispatcher filters on the chat, so other groups never reach this handler
+@app.on_message(filters.chat(BACKUP_GROUP_ID), group=-1)
 async def cache_group_handler(client: Client, message: Message):
-    """This handler runs on every group message to cache the peer."""
+    """This handler runs on backup group messages to cache the peer."""
     global backup_group_peer, backup_group_actual_id
+    if backup_group_peer:
+        return
     chat_id = message.chat.id
-    
-    # Check if this is our backup group
-    if chat_id == BACKUP_GROUP_ID or str(chat_id) == str(BACKUP_GROUP_ID):
-        if not backup_group_peer:
-            try:
-                backup_group_peer = await client.resolve_peer(chat_id)
-                backup_group_actual_id = chat_id
-                # Save to database for persistence across restarts
-                if hasattr(backup_group_peer, 'channel_id') and hasattr(backup_group_peer, 'access_hash'):
-                    await save_backup_group_cache(backup_group_peer.channel_id, backup_group_peer.access_hash)
-                print(f"✅ Backup group auto-cached from message: {chat_id} ({message.chat.title})")
-            except Exception as e:
-                print(f"DEBUG: Failed to cache group {chat_id}: {e}")
+    try:
+        backup_group_peer = await client.resolve_peer(chat_id)
+        backup_group_actual_id = chat_id
+        # Save to database for persistence across restarts
+        await _save_backup_peer(backup_group_peer, backup_group_actual_id)
+        logger.info("✅ Backup group auto-cached from message: %s (%s)", chat_id, message.chat.title)
+    except Exception as e:
+        logger.warning("Failed to cache group %s: %s", chat_id, e)
 
 @app.on_message(filters.command("checkgroup") & filters.group)
 async def check_group_handler(client: Client, message: Message):
@@ -252,8 +320,7 @@ async def check_group_handler(client: Client, message: Message):
         backup_group_peer = await client.resolve_peer(message.chat.id)
         backup_group_actual_id = message.chat.id
         # Save to database for persistence across restarts
-        if hasattr(backup_group_peer, 'channel_id') and hasattr(backup_group_peer, 'access_hash'):
-            await save_backup_group_cache(backup_group_peer.channel_id, backup_group_peer.access_hash)
+        await _save_backup_peer(backup_group_peer, backup_group_actual_id)
         response += "✅ **Backup group peer cached and saved to database.**"
     except Exception as e:
         response += f"❌ Failed to cache: {e}"
@@ -346,33 +413,26 @@ async def promote_to_admin_handler(client: Client, message: Message):
 
 @app.on_message(filters.command("start"))
 async def start_handler(client: Client, message: Message):
-    await add_user(message.from_user.id, message.from_user.username)
-    
-    # Check if user is already logged in
-    existing_session = await get_user_session(message.from_user.id)
-    is_logged_in = existing_session is not None
+    user = message.from_user
+    # Register the user and look up login/profile state in parallel
+    _, auth_state = await asyncio.gather(
+        add_user(user.id, user.username),
+        get_user_auth_state(user.id),
+    )
+    is_logged_in = auth_state["session"] is not None
     
     if is_logged_in:
         # Check if profile is complete
-        user_profile = await get_user_profile(message.from_user.id)
-        if not user_profile:
+        if not auth_state["profile"]:
             # Prompt for profile setup
             await message.reply_text(
                 "👋 **Hye!**\n\n"
                 "✅ Dah login, tapi profile belum lengkap.\n\n"
                 "Sila set profile anda terlebih dahulu.\n\n"
                 "👇 **Pilih jantina anda:**",
-                reply_markup=InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton("👨 Lelaki", callback_data="profile_gender_lelaki"),
-                        InlineKeyboardButton("👩 Perempuan", callback_data="profile_gender_perempuan"),
-                    ]
-                ])
+                reply_markup=get_gender_keyboard()
             )
-            user_profile_states[message.from_user.id] = {
-                "step": ProfileStep.ASK_GENDER,
-                "data": {}
-            }
+            begin_profile_setup(user.id)
             return
         
         welcome_text = (
@@ -455,22 +515,22 @@ async def auth_message_handler(client: Client, message: Message):
     if await handle_auth_message(client, message):
         message.stop_propagation()
 
-@app.on_message(filters.regex(TERABOX_LINK_PATTERN) & filters.private)
+@app.on_message(filters.private & filters.regex(TERABOX_LINK_PATTERN))
 async def terabox_handler(client: Client, message: Message):
     await terabox_link_handler(client, message)
 
 
-@app.on_message(filters.regex(MEDIAFIRE_LINK_PATTERN) & filters.private)
+@app.on_message(filters.private & filters.regex(MEDIAFIRE_LINK_PATTERN))
 async def mediafire_handler(client: Client, message: Message):
     await mediafire_link_handler(client, message)
 
 
-@app.on_message(filters.regex(MAGNET_LINK_PATTERN) & filters.private)
+@app.on_message(filters.private & filters.regex(MAGNET_LINK_PATTERN))
 async def torrent_magnet_handler(client: Client, message: Message):
     await torrent_link_handler(client, message)
 
 
-@app.on_message(filters.regex(TORRENT_URL_PATTERN) & filters.private)
+@app.on_message(filters.private & filters.regex(TORRENT_URL_PATTERN))
 async def torrent_url_handler(client: Client, message: Message):
     await torrent_link_handler(client, message)
 
@@ -515,7 +575,7 @@ async def torrent_file_upload_handler(client: Client, message: Message):
         await torrent_file_handler(client, message)
 
 
-@app.on_message(filters.regex(DIRECT_LINK_PATTERN) & filters.private)
+@app.on_message(filters.private & filters.regex(DIRECT_LINK_PATTERN))
 async def direct_link_message_handler(client: Client, message: Message):
     await direct_link_handler(client, message)
 
@@ -565,7 +625,7 @@ async def _archive_get_video_metadata(video_path: str) -> dict:
                     except (ValueError, TypeError):
                         pass
     except Exception as e:
-        print(f"[Archive] _archive_get_video_metadata error: {e}")
+        logger.warning("[Archive] _archive_get_video_metadata error: %s", e)
     return meta
 
 
@@ -577,8 +637,6 @@ async def _archive_generate_video_thumb(video_path: str, duration: int = 0) -> b
     2. 1 second
     3. 0.1 second (for very short videos)
     """
-    thumb_path = video_path + ".thumb.jpg"
-
     # Calculate seek positions to try
     seek_positions = []
     if duration > 0:
@@ -589,43 +647,31 @@ async def _archive_generate_video_thumb(video_path: str, duration: int = 0) -> b
 
     for seek_time in seek_positions:
         try:
-            # Clean up any previous attempt
-            if os.path.exists(thumb_path):
-                os.remove(thumb_path)
-
+            # JPEG straight to stdout: no temp file to read back and remove
             proc = await asyncio.create_subprocess_exec(
-                "ffmpeg", "-y",
+                "ffmpeg", "-nostdin",
                 "-ss", seek_time,
                 "-i", video_path,
                 "-frames:v", "1",
                 "-q:v", "5",
                 "-vf", "scale='min(320,iw)':-2",
-                thumb_path,
-                stdout=asyncio.subprocess.DEVNULL,
+                "-f", "image2pipe", "-c:v", "mjpeg",
+                "pipe:1",
+                stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.DEVNULL,
             )
-            await proc.wait()
-
-            if proc.returncode == 0 and os.path.exists(thumb_path):
-                with open(thumb_path, "rb") as f:
-                    data = f.read()
+            data, _ = await proc.communicate()
 
+            if proc.returncode == 0:
                 # Check if thumbnail is valid (not too small, indicating black/empty frame)
                 if len(data) > 500:  # Good thumbnails are usually > 500 bytes
-                    os.remove(thumb_path)
                     return data
                 # If thumbnail is very small, it might be a black frame - try next position
-                print(f"[Archive] Thumbnail at {seek_time}s too small ({len(data)} bytes), trying next position")
+                logger.info("[Archive] Thumbnail at %ss too small (%s bytes), trying next position", seek_time, len(data))
 
         except Exception as e:
-            print(f"[Archive] Thumbnail generation error at {seek_time}s: {e}")
+            logger.warning("[Archive] Thumbnail generation error at %ss: %s", seek_time, e)
 
-    # Clean up
-    if os.path.exists(thumb_path):
-        try:
-            os.remove(thumb_path)
-        except Exception:
-            pass
     return None
 
 
@@ -646,8 +692,6 @@ async def _process_archive_from_message(
 
     If skip_non_videos is True, only videos will be extracted (photos skipped).
     """
-    from pyrogram.types import InputMediaPhoto, InputMediaVideo
-
     doc = target_msg.document
     file_name = getattr(doc, "file_name", "archive.zip")
     file_size = getattr(doc, "file_size", 0)
@@ -682,164 +726,161 @@ async def _process_archive_from_message(
         media_type_msg = "video" if skip_non_videos else "media"
         await safe_edit(status_msg, f"📂 Mengimbas fail {media_type_msg} dalam arkib...")
 
-        loop = asyncio.get_running_loop()
-        total_files = await loop.run_in_executor(
-            None, count_media_in_archive, archive_path, skip_non_videos
+        # One directory scan serves both the count and the extraction below
+        total_files, media_files = await scan_and_extract(
+            archive_path, extract_dir, skip_non_videos
         )
 
-        if total_files == 0:
-            if skip_non_videos:
-                await safe_edit(status_msg, "❌ Tiada fail video dijumpai dalam arkib.")
-            else:
-                await safe_edit(status_msg, "❌ Tiada fail media (foto/video) dijumpai dalam arkib.")
-            return
+        async with aclosing(media_files):
+            if total_files == 0:
+                if skip_non_videos:
+                    await safe_edit(status_msg, "❌ Tiada fail video dijumpai dalam arkib.")
+                else:
+                    await safe_edit(status_msg, "❌ Tiada fail media (foto/video) dijumpai dalam arkib.")
+                return
 
-        await safe_edit(status_msg, f"📤 Memuat naik {total_files} fail {media_type_msg} ke Telegram...")
+            await safe_edit(status_msg, f"📤 Memuat naik {total_files} fail {media_type_msg} ke Telegram...")
 
-        # Extract and upload each media file
-        uploaded = []  # List of (backup_msg_id, kind, name, size)
-        idx = 0
+            # Extract and upload each media file
+            limiter = rate_limiter(bot)
+            uploaded = []  # List of (backup_msg_id, kind, name, size)
+            idx = 0
 
-        async for mf in iter_extract_media(archive_path, extract_dir, skip_non_videos):
-            idx += 1
+            async for mf in media_files:
+                idx += 1
 
-            if is_cancelled(user_id):
-                await safe_edit(status_msg, "🚫 **Proses dibatalkan!**\n\n💾 Folder sementara sedang dibersihkan...")
-                return
+                if is_cancelled(user_id):
+                    await safe_edit(status_msg, "🚫 **Proses dibatalkan!**\n\n💾 Folder sementara sedang dibersihkan...")
+                    return
 
-            file_path = mf["path"]
-            name = mf["name"]
-            size = mf["size"]
-            kind = mf["kind"]
+                file_path = mf.path
+                name = mf.name
+                size = mf.size
+                kind = mf.kind
 
-            # Skip files > 2GB
-            if size > MAX_FILE_SIZE:
-                print(f"[Archive] Skipping {name}: {size} bytes exceeds limit")
-                try:
-                    os.remove(file_path)
-                except Exception:
-                    pass
-                continue
+                # Skip files > 2GB
+                if size > MAX_FILE_SIZE:
+                    logger.info("[Archive] Skipping %s: %s bytes exceeds limit", name, size)
+                    try:
+                        os.remove(file_path)
+                    except Exception:
+                        pass
+                    continue
 
-            await safe_edit(status_msg, f"⬆️ Memuat naik {idx}/{total_files}: {name}...")
+                await safe_edit(status_msg, f"⬆️ Memuat naik {idx}/{total_files}: {name}...")
 
-            try:
-                # For videos, get metadata and thumbnail BEFORE streaming
-                video_meta = None
-                thumb_input_file = None
-                if kind == "video":
-                    video_meta = await _archive_get_video_metadata(file_path)
-                    duration = video_meta.get("duration", 0) if video_meta else 0
-                    thumb_raw = await _archive_generate_video_thumb(file_path, duration)
-                    if thumb_raw and len(thumb_raw) > 100:
-                        # Upload thumbnail using raw API
-                        try:
-                            from pyrogram.raw.functions.upload import SaveFilePart
-                            thumb_file_id = random.randint(0, 2**63 - 1)
-                            await bot.invoke(
-                                SaveFilePart(
-                                    file_id=thumb_file_id,
-                                    file_part=0,
-                                    bytes=thumb_raw,
+                try:
+                    # For videos, get metadata and thumbnail BEFORE streaming
+                    video_meta = None
+                    thumb_input_file = None
+                    if kind == "video":
+                        video_meta = await _archive_get_video_metadata(file_path)
+                        duration = video_meta.get("duration", 0) if video_meta else 0
+                        thumb_raw = await _archive_generate_video_thumb(file_path, duration)
+                        if thumb_raw and len(thumb_raw) > 100:
+                            # Upload thumbnail using raw API
+                            try:
+                                from pyrogram.raw.functions.upload import SaveFilePart
+                                thumb_file_id = rand63()
+                                await bot.invoke(
+                                    SaveFilePart(
+                                        file_id=thumb_file_id,
+                                        file_part=0,
+                                        bytes=thumb_raw,
+                                    )
                                 )
-                            )
-                            thumb_input_file = InputFile(
-                                id=thumb_file_id,
-                                parts=1,
-                                name="thumb.jpg",
-                                md5_checksum=""
-                            )
-                        except Exception as e:
-                            print(f"[Archive] Failed to upload thumbnail: {e}")
-
-                # Create FileStreamer for the extracted file
-                streamer = FileStreamer(file_path, name)
-                input_file = await upload_stream(bot, streamer, name)
-
-                # Determine media type and upload to backup group
-                if kind == "photo":
-                    media = InputMediaUploadedPhoto(file=input_file)
-                elif kind == "video":
-                    # Use actual video metadata
-                    duration = video_meta.get("duration", 0) if video_meta else 0
-                    width = video_meta.get("width", 0) if video_meta else 0
-                    height = video_meta.get("height", 0) if video_meta else 0
-
-                    video_attrs = [
-                        DocumentAttributeVideo(
-                            duration=duration,
-                            w=width,
-                            h=height,
-                            supports_streaming=True,
-                        ),
-                        DocumentAttributeFilename(file_name=name),
-                    ]
-                    media = InputMediaUploadedDocument(
-                        file=input_file,
-                        mime_type=mime(name),
-                        attributes=video_attrs,
-                        thumb=thumb_input_file,
-                    )
-                else:
-                    # Document
-                    media = InputMediaUploadedDocument(
-                        file=input_file,
-                        mime_type=mime(name),
-                        attributes=[DocumentAttributeFilename(file_name=name)],
-                    )
+                                thumb_input_file = InputFile(
+                                    id=thumb_file_id,
+                                    parts=1,
+                                    name="thumb.jpg",
+                                    md5_checksum=""
+                                )
+                            except Exception as e:
+                                logger.warning("[Archive] Failed to upload thumbnail: %s", e)
+
+                    # Create FileStreamer for the extracted file
+                    streamer = FileStreamer(file_path, name)
+                    input_file = await upload_stream(bot, streamer, name)
+
+                    # Determine media type and upload to backup group
+                    if kind == "photo":
+                        media = InputMediaUploadedPhoto(file=input_file)
+                    elif kind == "video":
+                        # Use actual video metadata
+                        duration = video_meta.get("duration", 0) if video_meta else 0
+                        width = video_meta.get("width", 0) if video_meta else 0
+                        height = video_meta.get("height", 0) if video_meta else 0
+
+                        video_attrs = [
+                            DocumentAttributeVideo(
+                                duration=duration,
+                                w=width,
+                                h=height,
+                                supports_streaming=True,
+                            ),
+                            DocumentAttributeFilename(file_name=name),
+                        ]
+                        media = InputMediaUploadedDocument(
+                            file=input_file,
+                            mime_type=mime(name),
+                            attributes=video_attrs,
+                            thumb=thumb_input_file,
+                        )
+                    else:
+                        # Document
+                        media = InputMediaUploadedDocument(
+                            file=input_file,
+                            mime_type=mime(name),
+                            attributes=[DocumentAttributeFilename(file_name=name)],
+                        )
 
-                # Send to backup group with retry logic
-                result = None
-                for attempt in range(3):
-                    try:
-                        result = await bot.invoke(
-                            SendMedia(
-                                peer=backup_peer,
-                                media=media,
-                                message="",
-                                random_id=random.randint(0, 2**63 - 1),
+                    # Send to backup group with retry logic
+                    result = None
+                    for attempt in range(3):
+                        try:
+                            await limiter.wait(chat_id=BACKUP_GROUP_ID)
+                            result = await bot.invoke(
+                                SendMedia(
+                                    peer=backup_peer,
+                                    media=media,
+                                    message="",
+                                    random_id=rand63(),
+                                )
                             )
-                        )
-                        break
-                    except FloodWait as fw:
-                        wait = getattr(fw, "value", getattr(fw, "x", 10))
-                        if wait > 120:
-                            print(f"FloodWait {wait}s too long, skipping file")
-                            break
-                        print(f"FloodWait {wait}s on archive upload (attempt {attempt+1}/3)")
-                        await asyncio.sleep(wait + 1)
-
-                if result:
-                    # Extract message ID from result
-                    backup_msg_id = None
-                    for upd in getattr(result, "updates", []):
-                        if isinstance(upd, (UpdateNewMessage, UpdateNewChannelMessage)):
-                            backup_msg_id = upd.message.id
                             break
+                        except FloodWait as fw:
+                            wait = flood_wait_seconds(fw)
+                            if not limiter.backoff(fw, retry=attempt < 2):
+                                logger.warning("FloodWait %ss on archive upload, skipping file", wait)
+                                break
+                            logger.warning("FloodWait %ss on archive upload (attempt %s/3)", wait, attempt+1)
+
+                    if result:
+                        # Extract message ID from result
+                        backup_msg_id = None
+                        for upd in getattr(result, "updates", []):
+                            if isinstance(upd, (UpdateNewMessage, UpdateNewChannelMessage)):
+                                backup_msg_id = upd.message.id
+                                break
 
-                    if backup_msg_id:
-                        uploaded.append((backup_msg_id, kind, name, size))
-
-                        # Log to database
-                        channel_id = str(BACKUP_GROUP_ID).replace("-100", "")
-                        link = f"https://t.me/c/{channel_id}/{backup_msg_id}"
-                        await log_forward(
-                            message.from_user.username, backup_msg_id, size,
-                            f"Archive/{file_name}/{name}", link
-                        )
+                        if backup_msg_id:
+                            uploaded.append((backup_msg_id, kind, name, size))
 
-            except Exception as e:
-                print(f"[Archive] Error uploading {name}: {e}")
-                import traceback
-                traceback.print_exc()
-            finally:
-                # Clean up extracted file immediately
-                try:
-                    os.remove(file_path)
-                except Exception:
-                    pass
+                            # Log to database
+                            link = f"https://t.me/c/{BACKUP_CHANNEL_ID_STR}/{backup_msg_id}"
+                            await log_forward(
+                                message.from_user.username, backup_msg_id, size,
+                                f"Archive/{file_name}/{name}", link
+                            )
 
-            gc.collect()
+                except Exception as e:
+                    logger.exception("[Archive] Error uploading %s: %s", name, e)
+                finally:
+                    # Clean up extracted file immediately
+                    try:
+                        os.remove(file_path)
+                    except Exception:
+                        pass
 
         if not uploaded:
             await safe_edit(status_msg, "❌ Gagal memuat naik fail media dari arkib.")
@@ -868,6 +909,7 @@ async def _process_archive_from_message(
                         # Single file - use copy_message
                         for attempt in range(3):
                             try:
+                                await limiter.wait()
                                 await bot.copy_message(
                                     chat_id=user_id,
                                     from_chat_id=BACKUP_GROUP_ID,
@@ -875,10 +917,8 @@ async def _process_archive_from_message(
                                 )
                                 break
                             except FloodWait as fw:
-                                wait = getattr(fw, "value", getattr(fw, "x", 10))
-                                if wait > 60:
+                                if not limiter.backoff(fw, retry=attempt < 2, cap=60):
                                     break
-                                await asyncio.sleep(wait + 1)
                     else:
                         # Multiple files - build album
                         media_list = []
@@ -894,15 +934,14 @@ async def _process_archive_from_message(
                         if media_list:
                             for attempt in range(3):
                                 try:
+                                    await limiter.wait()
                                     await bot.send_media_group(chat_id=user_id, media=media_list)
                                     break
                                 except FloodWait as fw:
-                                    wait = getattr(fw, "value", getattr(fw, "x", 10))
-                                    if wait > 60:
+                                    if not limiter.backoff(fw, retry=attempt < 2, cap=60):
                                         break
-                                    await asyncio.sleep(wait + 1)
                 except Exception as e:
-                    print(f"[Archive] Error sending album: {e}")
+                    logger.warning("[Archive] Error sending album: %s", e)
 
         # Send photos as album(s)
         if photos:
@@ -917,6 +956,7 @@ async def _process_archive_from_message(
             try:
                 for attempt in range(3):
                     try:
+                        await limiter.wait()
                         await bot.copy_message(
                             chat_id=user_id,
                             from_chat_id=BACKUP_GROUP_ID,
@@ -924,12 +964,10 @@ async def _process_archive_from_message(
                         )
                         break
                     except FloodWait as fw:
-                        wait = getattr(fw, "value", getattr(fw, "x", 10))
-                        if wait > 60:
+                        if not limiter.backoff(fw, retry=attempt < 2, cap=60):
                             break
-                        await asyncio.sleep(wait + 1)
             except Exception as e:
-                print(f"[Archive] Error sending {name}: {e}")
+                logger.warning("[Archive] Error sending %s: %s", name, e)
 
         total_size = sum(s for _, _, _, s in uploaded)
         await safe_edit(
@@ -941,9 +979,7 @@ async def _process_archive_from_message(
         )
 
     except Exception as e:
-        print(f"[Archive] Error processing archive: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[Archive] Error processing archive: %s", e)
         await safe_edit(status_msg, f"❌ Gagal memproses arkib: {e}")
 
     finally:
@@ -956,18 +992,89 @@ async def _process_archive_from_message(
         gc.collect()
 
 
+BUSY_TEXT = (
+    "⚠️ **Ada proses yang sedang berjalan!**\n\n"
+    "Sila tunggu proses sebelumnya selesai sebelum menghantar link baru."
+)
+
 # Maximum number of telegram links a user can send in a single message
 MAX_LINKS_PER_MESSAGE = 50
 # Telegram media group (album) hard limit
 ALBUM_CHUNK_SIZE = 10
+# Number of media files uploaded in parallel for one batch of links
+UPLOAD_CONCURRENCY = 4
+
+
+# Per-user LRU of private chat_id -> (resolved_chat_id, channel_id, access_hash),
+# so a chat the user's client couldn't resolve is only looked up in dialogs once.
+PEER_CACHE_MAXSIZE = 512
+# Upper bound on dialogs walked when a private chat is not in the peer cache
+DIALOG_SCAN_LIMIT = 200
+
+_user_peer_cache = defaultdict(OrderedDict)
+
+
+def _peer_cache_get(user_id, chat_id):
+    cache = _user_peer_cache[user_id]
+    entry = cache.get(chat_id)
+    if entry is not None:
+        cache.move_to_end(chat_id)
+    return entry
+
+
+def _peer_cache_put(user_id, chat_id, entry):
+    cache = _user_peer_cache[user_id]
+    cache[chat_id] = entry
+    cache.move_to_end(chat_id)
+    if len(cache) > PEER_CACHE_MAXSIZE:
+        cache.popitem(last=False)
+
+
+async def _load_cached_peer(user_client, user_id, chat_id):
+    """Feed a remembered peer into the user's client storage.
+
+    Returns the chat id to query with, or None if nothing is cached for chat_id.
+    """
+    entry = _peer_cache_get(user_id, chat_id)
+    if entry is None:
+        try:
+            doc = await get_user_peer_cache(user_id, chat_id)
+        except Exception as e:
+            logger.warning("Failed to load peer cache for %s: %s", chat_id, e)
+            doc = None
+        if not doc:
+            return None
+        entry = (int(f"-100{doc['channel_id']}"), doc["channel_id"], doc["access_hash"])
+        _peer_cache_put(user_id, chat_id, entry)
+
+    resolved_chat_id, channel_id, access_hash = entry
+    # Pyrogram resolves peers from its local storage, so seeding it is enough
+    await user_client.storage.update_peers([(resolved_chat_id, access_hash, "channel", None, None)])
+    return resolved_chat_id
+
+
+async def _remember_peer(user_client, user_id, chat_id, resolved_chat_id):
+    """Cache how chat_id was resolved, in memory and in the database."""
+    try:
+        peer = await user_client.resolve_peer(resolved_chat_id)
+    except Exception as e:
+        logger.debug("resolve_peer(%s) failed after dialog scan: %s", resolved_chat_id, e)
+        return
+    if not isinstance(peer, InputPeerChannel):
+        return
+    _peer_cache_put(user_id, chat_id, (resolved_chat_id, peer.channel_id, peer.access_hash))
+    try:
+        await save_user_peer_cache(user_id, chat_id, peer.channel_id, peer.access_hash)
+    except Exception as e:
+        logger.warning("Failed to save peer cache for %s: %s", chat_id, e)
 
 
-async def fetch_target_msg(user_client, chat_id, msg_id, is_public_link, status_msg):
+async def fetch_target_msg(user_client, user_id, chat_id, msg_id, is_public_link, status_msg):
     """Fetch a single message from a source chat, with fallbacks for public/private links.
 
     Returns (target_msg, resolved_chat_id) on success, or (None, chat_id) on failure.
     Updates status_msg with progress. Resolved chat_id may differ from input for private
-    links resolved via dialog scan.
+    links resolved via the peer cache or a dialog scan.
     """
     try:
         target_msg = await user_client.get_messages(chat_id, msg_id)
@@ -979,33 +1086,39 @@ async def fetch_target_msg(user_client, chat_id, msg_id, is_public_link, status_
                 target_msg = await user_client.get_messages(f"@{chat_id}", msg_id)
                 return target_msg, chat_id
             except Exception as e2:
-                print(f"DEBUG: Failed to resolve @{chat_id}: {e2}")
+                logger.debug("Failed to resolve @%s: %s", chat_id, e2)
                 return None, chat_id
-        else:
-            await safe_edit(status_msg, f"🔄 Scanning... ({e})")
-            found_chat = None
-            debug_ids = []
-            try:
-                async for dialog in user_client.get_dialogs():
-                    d_id = dialog.chat.id
-                    if len(debug_ids) < 5:
-                        debug_ids.append(str(d_id))
-                    if d_id == chat_id:
-                        found_chat = dialog.chat
-                        break
-                    raw_id = int(str(chat_id).replace("-100", ""))
-                    if str(d_id).endswith(str(raw_id)):
-                        found_chat = dialog.chat
-                        chat_id = d_id
-                        break
-                if not found_chat:
-                    print(f"DEBUG: Chat {chat_id} not found in dialogs. First 5 IDs: {', '.join(debug_ids)}")
-                    return None, chat_id
-                target_msg = await user_client.get_messages(chat_id, msg_id)
-                return target_msg, chat_id
-            except Exception as e2:
-                print(f"DEBUG: Dialog scan failed: {e2}")
+
+        # Private link: try the peer cache before walking the user's dialogs
+        try:
+            cached_chat_id = await _load_cached_peer(user_client, user_id, chat_id)
+            if cached_chat_id is not None:
+                target_msg = await user_client.get_messages(cached_chat_id, msg_id)
+                return target_msg, cached_chat_id
+        except Exception as e2:
+            logger.debug("Cached peer for %s failed: %s", chat_id, e2)
+
+        await safe_edit(status_msg, f"🔄 Scanning... ({e})")
+        found_chat_id = None
+        debug_ids = []
+        raw_id = str(chat_id).replace("-100", "")
+        try:
+            async for dialog in user_client.get_dialogs(limit=DIALOG_SCAN_LIMIT):
+                d_id = dialog.chat.id
+                if len(debug_ids) < 5:
+                    debug_ids.append(str(d_id))
+                if d_id == chat_id or str(d_id).endswith(raw_id):
+                    found_chat_id = d_id
+                    break
+            if found_chat_id is None:
+                logger.warning("Chat %s not found in dialogs. First 5 IDs: %s", chat_id, ', '.join(debug_ids))
                 return None, chat_id
+            await _remember_peer(user_client, user_id, chat_id, found_chat_id)
+            target_msg = await user_client.get_messages(found_chat_id, msg_id)
+            return target_msg, found_chat_id
+        except Exception as e2:
+            logger.warning("Dialog scan failed: %s", e2)
+            return None, chat_id
 
 
 def _media_type_of(target_msg):
@@ -1014,23 +1127,46 @@ def _media_type_of(target_msg):
     Returns one of: 'photo', 'video', 'animation', 'audio', 'document',
     'voice', 'video_note', 'sticker', or None if no media.
     """
-    if target_msg.photo:
-        return "photo"
-    if target_msg.video:
-        return "video"
-    if target_msg.animation:
-        return "animation"
-    if target_msg.audio:
-        return "audio"
-    if target_msg.voice:
-        return "voice"
-    if target_msg.video_note:
-        return "video_note"
-    if target_msg.sticker:
-        return "sticker"
-    if target_msg.document:
-        return "document"
-    return None
+    return get_media(target_msg)[0]
+
+
+# Album InputMedia builders keyed by media type, each taking (file_id, metadata)
+def _album_photo(file_id, metadata):
+    return InputMediaPhoto(file_id)
+
+def _album_video(file_id, metadata):
+    return InputMediaVideo(
+        file_id,
+        duration=metadata.get("duration", 0),
+        width=metadata.get("width", 0),
+        height=metadata.get("height", 0),
+    )
+
+def _album_audio(file_id, metadata):
+    return InputMediaAudio(
+        file_id,
+        duration=metadata.get("duration", 0),
+        title=metadata.get("title", ""),
+        performer=metadata.get("performer", ""),
+    )
+
+def _album_document(file_id, metadata):
+    return InputMediaDocument(file_id)
+
+_ALBUM_BUILDERS = {
+    "photo": _album_photo,
+    "video": _album_video,
+    "animation": _album_video,
+    "audio": _album_audio,
+}
+
+# Backup album messages of these types are re-sent to the user
+_ALBUM_FORWARD_BUILDERS = {
+    "photo": _album_photo,
+    "video": _album_video,
+    "audio": _album_audio,
+    "document": _album_document,
+}
 
 
 async def send_album_to_user(client, user_id, items, source_name, username, status_msg):
@@ -1044,15 +1180,12 @@ async def send_album_to_user(client, user_id, items, source_name, username, stat
 
     Returns the list of backup message ids created.
     """
-    from pyrogram.types import (
-        InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio,
-    )
-
     backup_msg_ids = []
     if not items:
         return backup_msg_ids
 
     total_chunks = math.ceil(len(items) / ALBUM_CHUNK_SIZE)
+    limiter = rate_limiter(client)
 
     for chunk_idx in range(total_chunks):
         chunk = items[chunk_idx * ALBUM_CHUNK_SIZE:(chunk_idx + 1) * ALBUM_CHUNK_SIZE]
@@ -1060,24 +1193,8 @@ async def send_album_to_user(client, user_id, items, source_name, username, stat
         # Build InputMedia list using file_ids for backup group
         backup_media_list = []
         for file_id, media_type, _file_size, metadata in chunk:
-            if media_type == "photo":
-                backup_media_list.append(InputMediaPhoto(file_id))
-            elif media_type in ("video", "animation"):
-                backup_media_list.append(InputMediaVideo(
-                    file_id,
-                    duration=metadata.get("duration", 0),
-                    width=metadata.get("width", 0),
-                    height=metadata.get("height", 0),
-                ))
-            elif media_type == "audio":
-                backup_media_list.append(InputMediaAudio(
-                    file_id,
-                    duration=metadata.get("duration", 0),
-                    title=metadata.get("title", ""),
-                    performer=metadata.get("performer", ""),
-                ))
-            else:
-                backup_media_list.append(InputMediaDocument(file_id))
+            build = _ALBUM_BUILDERS.get(media_type, _album_document)
+            backup_media_list.append(build(file_id, metadata))
 
         await safe_edit(
             status_msg,
@@ -1089,24 +1206,22 @@ async def send_album_to_user(client, user_id, items, source_name, username, stat
         try:
             for attempt in range(3):
                 try:
+                    await limiter.wait(chat_id=BACKUP_GROUP_ID)
                     backup_msgs = await client.send_media_group(
                         chat_id=BACKUP_GROUP_ID,
                         media=backup_media_list,
                     )
                     break
                 except FloodWait as fw:
-                    wait = getattr(fw, "value", getattr(fw, "x", 10))
-                    if wait > 300:
-                        print(f"FloodWait too long ({wait}s) for backup send, skipping chunk...")
+                    wait = flood_wait_seconds(fw)
+                    if not limiter.backoff(fw, retry=attempt < 2, cap=300):
+                        logger.warning("FloodWait %ss on backup send, skipping chunk...", wait)
                         raise
-                    print(f"FloodWait {wait}s on backup send (attempt {attempt+1}/3)")
-                    await asyncio.sleep(wait + 1)
+                    logger.warning("FloodWait %ss on backup send (attempt %s/3)", wait, attempt+1)
             if not backup_msgs:
                 raise Exception("Failed to send media group after retries")
         except Exception as e:
-            print(f"DEBUG: Failed to send media group to backup (chunk {chunk_idx + 1}): {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Failed to send media group to backup (chunk %s): %s", chunk_idx + 1, e)
             continue  # skip this chunk, try the next
 
         for backup_msg in backup_msgs:
@@ -1115,34 +1230,25 @@ async def send_album_to_user(client, user_id, items, source_name, username, stat
         # Log the album (first message id represents it)
         total_album_size = sum(item[2] for item in chunk)
         first_msg_id = backup_msgs[0].id
-        channel_id = str(BACKUP_GROUP_ID).replace("-100", "")
-        backup_message_link = f"https://t.me/c/{channel_id}/{first_msg_id}"
+        backup_message_link = f"https://t.me/c/{BACKUP_CHANNEL_ID_STR}/{first_msg_id}"
         try:
             await log_forward(username, first_msg_id, total_album_size, source_name, backup_message_link)
         except Exception as e:
-            print(f"DEBUG: log_forward failed: {e}")
+            logger.warning("log_forward failed: %s", e)
 
         # Build media list using file_ids from backup messages (no re-upload).
         # Preserve video duration/dimensions so Telegram renders the album
         # preview (including thumbnail) correctly.
         user_media_list = []
         for backup_msg in backup_msgs:
-            if backup_msg.photo:
-                user_media_list.append(InputMediaPhoto(backup_msg.photo.file_id))
-            elif backup_msg.video:
-                user_media_list.append(InputMediaVideo(
-                    backup_msg.video.file_id,
-                    duration=backup_msg.video.duration or 0,
-                    width=backup_msg.video.width or 0,
-                    height=backup_msg.video.height or 0,
-                ))
-            elif backup_msg.audio:
-                user_media_list.append(InputMediaAudio(
-                    backup_msg.audio.file_id,
-                    duration=backup_msg.audio.duration or 0,
-                ))
-            elif backup_msg.document:
-                user_media_list.append(InputMediaDocument(backup_msg.document.file_id))
+            media_type, media_obj = get_media(backup_msg)
+            build = _ALBUM_FORWARD_BUILDERS.get(media_type)
+            if build:
+                user_media_list.append(build(media_obj.file_id, {
+                    "duration": getattr(media_obj, "duration", 0) or 0,
+                    "width": getattr(media_obj, "width", 0) or 0,
+                    "height": getattr(media_obj, "height", 0) or 0,
+                }))
 
         await safe_edit(status_msg, f"⬆️ Menghantar album {chunk_idx + 1}/{total_chunks} ke anda...")
 
@@ -1150,22 +1256,23 @@ async def send_album_to_user(client, user_id, items, source_name, username, stat
             album_sent = False
             for attempt in range(3):
                 try:
+                    await limiter.wait()
                     await client.send_media_group(chat_id=user_id, media=user_media_list)
                     album_sent = True
                     break
                 except FloodWait as fw:
-                    wait = getattr(fw, "value", getattr(fw, "x", 10))
-                    if wait > 60:
-                        print(f"FloodWait {wait}s too long for album, using copy_message fallback...")
+                    wait = flood_wait_seconds(fw)
+                    if not limiter.backoff(fw, retry=attempt < 2, cap=60):
+                        logger.warning("FloodWait %ss on user album, using copy_message fallback...", wait)
                         break
-                    print(f"FloodWait {wait}s on user album (attempt {attempt+1}/3)")
-                    await asyncio.sleep(wait + 1)
+                    logger.warning("FloodWait %ss on user album (attempt %s/3)", wait, attempt+1)
 
             # Fallback: copy messages individually if album send failed
             if not album_sent:
                 for backup_msg in backup_msgs:
                     for copy_attempt in range(3):
                         try:
+                            await limiter.wait()
                             await client.copy_message(
                                 chat_id=user_id,
                                 from_chat_id=BACKUP_GROUP_ID,
@@ -1173,53 +1280,42 @@ async def send_album_to_user(client, user_id, items, source_name, username, stat
                             )
                             break
                         except FloodWait as fw:
-                            wait = getattr(fw, "value", getattr(fw, "x", 10))
-                            if wait > 300:
-                                print(f"FloodWait {wait}s too long for copy, skipping...")
+                            if not limiter.backoff(fw, retry=copy_attempt < 2, cap=300):
+                                logger.warning("FloodWait %ss on copy, skipping...", flood_wait_seconds(fw))
                                 break
-                            await asyncio.sleep(wait + 1)
                     await asyncio.sleep(0.5)
 
     return backup_msg_ids
 
 
-@app.on_message(filters.regex(LINK_PATTERN) & filters.private)
+# filters.private first so group messages never reach the regex
+@app.on_message(filters.private & filters.regex(LINK_PATTERN))
 async def link_handler(client: Client, message: Message):
-    user_id = message.from_user.id
+    user = message.from_user
+    user_id = user.id
     
     # Check if user already has an active process
     if active_user_processes.get(user_id):
-        await message.reply_text(
-            "⚠️ **Ada proses yang sedang berjalan!**\n\n"
-            "Sila tunggu proses sebelumnya selesai sebelum menghantar link baru."
-        )
+        await message.reply_text(BUSY_TEXT)
         return
     
     # Check if user is logged in
-    user_session = await get_user_session(user_id)
+    user_session = await get_cached_user_session(user_id)
     if not user_session:
         await message.reply_text("❌ Belum login. Sila /start untuk login.")
         return
     
     # Check if user has completed profile setup
-    user_profile = await get_user_profile(user_id)
+    user_profile = await get_cached_user_profile(user_id)
     if not user_profile:
         # Start profile setup
         await message.reply_text(
             "⚠️ **Profile belum lengkap!**\n\n"
             "Sila set profile anda terlebih dahulu.\n\n"
             "👇 **Pilih jantina anda:**",
-            reply_markup=InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("👨 Lelaki", callback_data="profile_gender_lelaki"),
-                    InlineKeyboardButton("👩 Perempuan", callback_data="profile_gender_perempuan"),
-                ]
-            ])
+            reply_markup=get_gender_keyboard()
         )
-        user_profile_states[user_id] = {
-            "step": ProfileStep.ASK_GENDER,
-            "data": {}
-        }
+        begin_profile_setup(user_id)
         return
     
     # --- Phase 1: Parse all telegram links in the message (one per line supported) ---
@@ -1245,30 +1341,85 @@ async def link_handler(client: Client, message: Message):
         )
         return
 
-    # Mark user as having an active process (one lock for the whole batch)
-    active_user_processes[user_id] = asyncio.current_task()
+    # Mark user as having an active process (one lock for the whole batch).
+    # Checked again here since another link may have started during the awaits above.
+    if not claim_process(user_id):
+        await message.reply_text(BUSY_TEXT)
+        return
     reset_cancel(user_id)
 
     status_msg = await message.reply_text(f"🔄 Sedang Diproses..")
+    status = StatusThrottler(status_msg)
 
     # 1. Get User Client
     user_client = await manager.get_client(user_id)
     if not user_client:
         active_user_processes.pop(user_id, None)
-        await safe_edit(status_msg, "❌ Belum login.")
+        await status.flush("❌ Belum login.")
         return
 
+    upload_tasks = []  # one task per collected message, in source order
     try:
         # --- Phase 2: Fetch & collect media from all links ---
         collected_messages = []   # list of source Message objects to upload
         skipped_archives = []      # list of file names skipped because they are archives
         fetch_errors = []          # list of human-readable error strings
         seen_msg_ids = set()       # dedup by (chat_id, msg_id) to avoid double-counting album media
+        oversized_files = []       # (file_name, file_size) of media over MAX_FILE_SIZE
+
+        # Uploads start as soon as a message is collected so they overlap the
+        # remaining link fetches. One oversized file rejects the whole batch,
+        # cancelling whatever was already started.
+        upload_sem = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+        done_count = 0
+        final_total = None  # known once collection finishes
+
+        async def _upload_one(idx, msg_to_process):
+            nonlocal done_count
+            async with upload_sem:
+                if is_cancelled(user_id):
+                    return None
+                media_type = _media_type_of(msg_to_process)
+                total_files = final_total
+
+                # "Others" types don't have a clean InputMedia* album wrapper in the
+                # existing code path; route them through process_single_media which
+                # keeps the backup message, then copy_message to the user.
+                if media_type in ("voice", "video_note", "sticker"):
+                    backup_msg_id, _file_name, file_size = await process_single_media(
+                        client, user_client, msg_to_process, message, status_msg, idx, total_files
+                    )
+                    result = ("other", backup_msg_id, file_size)
+                else:
+                    # Album-able types: upload and keep only the file_id
+                    result = ("album", await upload_single_media_for_group(
+                        client, user_client, msg_to_process, idx, total_files
+                    ), None)
+
+            done_count += 1
+            if final_total is None:
+                # Still collecting: the total isn't known yet
+                await status.set(f"⬇️ Memuat naik {done_count}...")
+            else:
+                await status.set(f"⬇️ Memuat naik {done_count}/{final_total}...")
+            return result
+
+        def _collect(msg):
+            collected_messages.append(msg)
+            media_obj = get_media_obj(msg)
+            file_size = getattr(media_obj, "file_size", 0) or 0
+            if file_size > MAX_FILE_SIZE:
+                file_name = getattr(media_obj, "file_name", None) or "file"
+                oversized_files.append((file_name, file_size))
+                for task in upload_tasks:
+                    task.cancel()
+            elif not oversized_files:
+                upload_tasks.append(asyncio.create_task(_upload_one(len(collected_messages), msg)))
 
         total_links = len(unique_links)
         for link_idx, match in enumerate(unique_links, 1):
             if is_cancelled(user_id):
-                await safe_edit(status_msg, "🚫 **Proses dibatalkan!**")
+                await status.flush("🚫 **Proses dibatalkan!**")
                 return
 
             # Determine chat_id based on link type
@@ -1282,10 +1433,10 @@ async def link_handler(client: Client, message: Message):
                 is_public_link = True
             msg_id = int(match[2])
 
-            await safe_edit(status_msg, f"🔄 Memproses link {link_idx}/{total_links}...")
+            await status.set(f"🔄 Memproses link {link_idx}/{total_links}...")
 
             target_msg, resolved_chat_id = await fetch_target_msg(
-                user_client, chat_id, msg_id, is_public_link, status_msg
+                user_client, user_id, chat_id, msg_id, is_public_link, status
             )
 
             if not target_msg or not target_msg.media:
@@ -1304,19 +1455,23 @@ async def link_handler(client: Client, message: Message):
                 try:
                     media_group_msgs = await user_client.get_media_group(resolved_chat_id, msg_id)
                 except Exception as e:
-                    print(f"DEBUG: get_media_group failed for link {link_idx}: {e}")
+                    logger.warning("get_media_group failed for link %s: %s", link_idx, e)
                     fetch_errors.append(f"Link {link_idx}: gagal dapat media group ({e})")
                     continue
                 for mg_msg in media_group_msgs:
                     key = (resolved_chat_id, mg_msg.id)
                     if key not in seen_msg_ids:
                         seen_msg_ids.add(key)
-                        collected_messages.append(mg_msg)
+                        _collect(mg_msg)
             else:
                 key = (resolved_chat_id, target_msg.id)
                 if key not in seen_msg_ids:
                     seen_msg_ids.add(key)
-                    collected_messages.append(target_msg)
+                    _collect(target_msg)
+
+            # The batch will be rejected; don't spend round-trips on the remaining links
+            if oversized_files:
+                break
 
         # If nothing collectable, summarize and stop
         if not collected_messages:
@@ -1327,79 +1482,70 @@ async def link_handler(client: Client, message: Message):
             if fetch_errors:
                 summary += "\n\n⚠️ **Ralat:**\n"
                 summary += "\n".join(f"  • {e}" for e in fetch_errors)
-            await safe_edit(status_msg, summary)
+            await status.flush(summary)
             return
 
-        # --- Phase 3: Validate file sizes (batch) ---
-        oversized_files = []
-        for msg in collected_messages:
-            file_size = get_media_file_size(msg)
-            if file_size > MAX_FILE_SIZE:
-                media_obj = (msg.document or msg.video or msg.audio or
-                             msg.photo or msg.voice or msg.video_note or
-                             msg.animation or msg.sticker)
-                file_name = getattr(media_obj, "file_name", None) or "file"
-                oversized_files.append((file_name, file_size))
-
+        # --- Phase 3: Reject the batch if a file is too large ---
         if oversized_files:
+            # Let the cancelled uploads settle, then drop the backup messages
+            # of any that had already finished
+            results = await asyncio.gather(*upload_tasks, return_exceptions=True)
+            stray_ids = [
+                r[1] for r in results
+                if isinstance(r, tuple) and r[0] == "other" and r[1]
+            ]
+            if stray_ids:
+                try:
+                    await client.delete_messages(BACKUP_GROUP_ID, stray_ids)
+                except Exception as e:
+                    logger.warning("Failed to delete backup messages of rejected batch: %s", e)
             error_msg = "❌ **File melebihi had saiz!**\n\n"
             for fname, fsize in oversized_files:
                 error_msg += f"📁 `{fname}`: {format_file_size(fsize)}\n"
             error_msg += f"\n⚠️ Had maksimum: {format_file_size(MAX_FILE_SIZE)}"
-            await safe_edit(status_msg, error_msg)
+            await status.flush(error_msg)
             return
 
         # Use the first collected message's chat title as the source name for logging
-        first_msg = collected_messages[0]
-        source_name = (first_msg.chat.title if first_msg.chat and first_msg.chat.title
-                       else "Unknown")
-        username = message.from_user.username
+        chat = collected_messages[0].chat
+        source_name = (chat.title if chat else None) or "Unknown"
+        username = user.username
 
-        # --- Phase 4: Upload all media ---
+        # --- Phase 4: Wait for the uploads started during collection ---
+        final_total = len(collected_messages)
+        await status.set(f"⬇️ Memuat naik {done_count}/{final_total}...")
         # uploaded_media: list of (file_id, media_type, file_size, metadata) for album-able types
         uploaded_media = []
         # others_backup_ids: list of backup message ids for non-album-able types
         # (voice/video_note/sticker) sent via process_single_media + copy_message
         others_backup_ids = []
-        total_files = len(collected_messages)
-
-        for idx, msg_to_process in enumerate(collected_messages, 1):
-            if is_cancelled(user_id):
-                await safe_edit(status_msg, "🚫 **Proses dibatalkan!**")
-                return
 
-            # Throttle status edits to avoid FloodWait on large batches
-            if idx == 1 or idx == total_files or idx % 5 == 0:
-                await safe_edit(status_msg, f"⬇️ Memuat naik {idx}/{total_files}...")
+        results = await asyncio.gather(*upload_tasks)
 
-            media_type = _media_type_of(msg_to_process)
+        if is_cancelled(user_id):
+            await status.flush("🚫 **Proses dibatalkan!**")
+            return
 
-            # "Others" types don't have a clean InputMedia* album wrapper in the
-            # existing code path; route them through process_single_media which
-            # keeps the backup message, then copy_message to the user.
-            if media_type in ("voice", "video_note", "sticker"):
-                backup_msg_id, file_name, file_size = await process_single_media(
-                    client, user_client, msg_to_process, message, status_msg, idx, total_files
-                )
-                if backup_msg_id:
-                    others_backup_ids.append(backup_msg_id)
-                    channel_id = str(BACKUP_GROUP_ID).replace("-100", "")
-                    backup_message_link = f"https://t.me/c/{channel_id}/{backup_msg_id}"
-                    try:
-                        await log_forward(username, backup_msg_id, file_size, source_name, backup_message_link)
-                    except Exception as e:
-                        print(f"DEBUG: log_forward failed: {e}")
+        # Collect results in source order
+        for result in results:
+            if not result:
                 continue
-
-            # Album-able types: upload and keep only the file_id
-            result = await upload_single_media_for_group(
-                client, user_client, msg_to_process, idx, total_files
-            )
-            if result:
-                uploaded_media.append(result)
+            kind, value, file_size = result
+            if kind == "album":
+                if value:
+                    uploaded_media.append(value)
+                continue
+            backup_msg_id = value
+            if backup_msg_id:
+                others_backup_ids.append(backup_msg_id)
+                backup_message_link = f"https://t.me/c/{BACKUP_CHANNEL_ID_STR}/{backup_msg_id}"
+                try:
+                    await log_forward(username, backup_msg_id, file_size, source_name, backup_message_link)
+                except Exception as e:
+                    logger.warning("log_forward failed: %s", e)
 
         if not uploaded_media and not others_backup_ids:
-            await safe_edit(status_msg, "❌ Gagal memproses media/file.")
+            await status.flush("❌ Gagal memproses media/file.")
             return
 
         # --- Phase 5: Group by type & send as chunked albums ---
@@ -1410,17 +1556,19 @@ async def link_handler(client: Client, message: Message):
         document_items = [m for m in uploaded_media if m[1] == "document"]
 
         if visual_items:
-            await send_album_to_user(client, user_id, visual_items, source_name, username, status_msg)
+            await send_album_to_user(client, user_id, visual_items, source_name, username, status)
         if audio_items:
-            await send_album_to_user(client, user_id, audio_items, source_name, username, status_msg)
+            await send_album_to_user(client, user_id, audio_items, source_name, username, status)
         if document_items:
-            await send_album_to_user(client, user_id, document_items, source_name, username, status_msg)
+            await send_album_to_user(client, user_id, document_items, source_name, username, status)
 
         # Send "others" (voice/video_note/sticker) individually via copy_message
         if others_backup_ids:
-            await safe_edit(status_msg, f"⬆️ Mengirim {len(others_backup_ids)} file(s) ke Anda...")
+            await status.set(f"⬆️ Mengirim {len(others_backup_ids)} file(s) ke Anda...")
+            limiter = rate_limiter(client)
             for backup_msg_id in others_backup_ids:
                 try:
+                    await limiter.wait()
                     await client.copy_message(
                         chat_id=user_id,
                         from_chat_id=BACKUP_GROUP_ID,
@@ -1428,7 +1576,7 @@ async def link_handler(client: Client, message: Message):
                         caption="",
                     )
                 except Exception as e:
-                    print(f"DEBUG: Failed to copy message {backup_msg_id}: {e}")
+                    logger.warning("Failed to copy message %s: %s", backup_msg_id, e)
 
         # --- Phase 6: Finalize ---
         total_media = len(uploaded_media) + len(others_backup_ids)
@@ -1438,18 +1586,26 @@ async def link_handler(client: Client, message: Message):
             summary += f"\n\n📂 Arkib dilangkau: {len(skipped_archives)}"
         if fetch_errors:
             summary += f"\n⚠️ Ralat: {len(fetch_errors)}"
-        await safe_edit(status_msg, summary)
+        await status.flush(summary)
 
     except asyncio.CancelledError:
-        print(f"[Main] Process cancelled by user {user_id}")
+        logger.info("[Main] Process cancelled by user %s", user_id)
     except Exception as e:
-        await safe_edit(status_msg, f"❌ {e}")
-        import traceback
-        traceback.print_exc()
+        await status.flush(f"❌ {e}")
+        logger.exception("Link processing failed for user %s", user_id)
     finally:
-        # Always clear the active process flag when done
-        active_user_processes.pop(user_id, None)
-        reset_cancel(user_id)
+        try:
+            # Don't leave uploads running after an early return or error
+            pending = [task for task in upload_tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        finally:
+            # Always clear the active process flag, even if the wait above
+            # is interrupted by another cancel
+            active_user_processes.pop(user_id, None)
+            reset_cancel(user_id)
 
 
 async def _generate_video_thumbnail(media_source):
@@ -1519,7 +1675,7 @@ async def _generate_video_thumbnail(media_source):
         buf.seek(0)
         return buf
     except Exception as e:
-        print(f"DEBUG: _generate_video_thumbnail error: {e}")
+        logger.debug("_generate_video_thumbnail error: %s", e)
         return None
     finally:
         if temp_dir and _os.path.exists(temp_dir) and not is_path:
@@ -1531,7 +1687,7 @@ async def _generate_video_thumbnail(media_source):
 
 
 async def upload_single_media_for_group(client: Client, user_client: Client, target_msg: Message,
-                                         current_idx: int, total_count: int):
+                                         current_idx: int, total_count: int | None):
     """Upload a single media file to Telegram and return file_id with media type info.
     Returns (file_id, media_type, file_size, metadata) or None if failed."""
     try:
@@ -1540,9 +1696,7 @@ async def upload_single_media_for_group(client: Client, user_client: Client, tar
         import os
         
         # Get media object and file info
-        media_obj = (target_msg.document or target_msg.video or target_msg.audio or 
-                     target_msg.photo or target_msg.voice or target_msg.video_note or
-                     target_msg.animation or target_msg.sticker)
+        media_obj = get_media_obj(target_msg)
         file_size = getattr(media_obj, "file_size", 0)
         file_name = getattr(media_obj, "file_name", None) or "file"
         
@@ -1570,6 +1724,8 @@ async def upload_single_media_for_group(client: Client, user_client: Client, tar
         sent_msg = None
         
         try:
+            # Count this send against the backup group's bucket too
+            await rate_limiter(client).wait(chat_id=BACKUP_GROUP_ID)
             if target_msg.photo:
                 sent_msg = await client.send_photo(BACKUP_GROUP_ID, photo=media_source)
                 media_type = "photo"
@@ -1590,7 +1746,7 @@ async def upload_single_media_for_group(client: Client, user_client: Client, tar
                         if thumb_data is not None and hasattr(thumb_data, "seek"):
                             thumb_data.seek(0)
                 except Exception as e:
-                    print(f"DEBUG: Failed to download video thumbnail: {e}")
+                    logger.debug("Failed to download video thumbnail: %s", e)
                     thumb_data = None
 
                 # If the source video has no thumbnail, try to generate one from
@@ -1600,7 +1756,7 @@ async def upload_single_media_for_group(client: Client, user_client: Client, tar
                     try:
                         thumb_data = await _generate_video_thumbnail(media_source)
                     except Exception as e:
-                        print(f"DEBUG: Failed to generate video thumbnail: {e}")
+                        logger.debug("Failed to generate video thumbnail: %s", e)
                         thumb_data = None
 
                 sent_msg = await client.send_video(
@@ -1649,186 +1805,180 @@ async def upload_single_media_for_group(client: Client, user_client: Client, tar
                 os.remove(temp_file_path)
             
     except Exception as e:
-        print(f"DEBUG: Error uploading media {current_idx}/{total_count}: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error uploading media %s/%s: %s", current_idx, total_count or "?", e)
         return None
 
 
+async def _upload_video_thumb(client: Client, user_client: Client, video):
+    """Re-upload the source video's thumbnail for the raw API. Returns an InputFile or None."""
+    try:
+        if not video.thumbs:
+            return None
+        thumb_bytes_io = await user_client.download_media(
+            video.thumbs[0].file_id, in_memory=True
+        )
+        if not thumb_bytes_io:
+            return None
+        if isinstance(thumb_bytes_io, BytesIO):
+            thumb_bytes_io.seek(0)
+            thumb_raw = thumb_bytes_io.read()
+        else:
+            thumb_raw = thumb_bytes_io
+
+        if not thumb_raw:
+            return None
+        # Upload thumbnail using raw API SaveFilePart
+        thumb_file_id_raw = rand63()
+        await client.invoke(
+            SaveFilePart(
+                file_id=thumb_file_id_raw,
+                file_part=0,
+                bytes=thumb_raw
+            )
+        )
+        return InputFile(
+            id=thumb_file_id_raw,
+            parts=1,
+            name="thumb.jpg",
+            md5_checksum=""
+        )
+    except Exception as e:
+        logger.exception("Failed to download/upload thumbnail for raw API: %s", e)
+        return None
+
+
+# Builders for the raw InputMedia sent to the backup group, keyed by media attribute.
+# Each takes (media_obj, file_name, input_file, thumb).
+
+def _photo_media(photo, file_name, input_file, thumb):
+    return InputMediaUploadedPhoto(file=input_file)
+
+def _video_media(video, file_name, input_file, thumb):
+    return InputMediaUploadedDocument(
+        file=input_file,
+        mime_type=video.mime_type or "video/mp4",
+        attributes=[
+            DocumentAttributeVideo(
+                duration=video.duration or 0,
+                w=video.width or 0,
+                h=video.height or 0,
+                supports_streaming=True
+            ),
+            DocumentAttributeFilename(file_name=file_name)
+        ],
+        thumb=thumb
+    )
+
+def _audio_media(audio, file_name, input_file, thumb):
+    return InputMediaUploadedDocument(
+        file=input_file,
+        mime_type=audio.mime_type or "audio/mpeg",
+        attributes=[
+            DocumentAttributeAudio(
+                duration=audio.duration or 0,
+                title=audio.title or "",
+                performer=audio.performer or ""
+            ),
+            DocumentAttributeFilename(file_name=file_name)
+        ]
+    )
+
+def _voice_media(voice, file_name, input_file, thumb):
+    return InputMediaUploadedDocument(
+        file=input_file,
+        mime_type=voice.mime_type or "audio/ogg",
+        attributes=[
+            DocumentAttributeAudio(
+                duration=voice.duration or 0,
+                voice=True
+            )
+        ]
+    )
+
+def _video_note_media(video_note, file_name, input_file, thumb):
+    # Round video
+    return InputMediaUploadedDocument(
+        file=input_file,
+        mime_type="video/mp4",
+        attributes=[
+            DocumentAttributeVideo(
+                duration=video_note.duration or 0,
+                w=video_note.length or 240,
+                h=video_note.length or 240,
+                round_message=True
+            )
+        ]
+    )
+
+def _animation_media(animation, file_name, input_file, thumb):
+    # GIF/animation
+    return InputMediaUploadedDocument(
+        file=input_file,
+        mime_type=animation.mime_type or "video/mp4",
+        attributes=[
+            DocumentAttributeVideo(
+                duration=animation.duration or 0,
+                w=animation.width or 0,
+                h=animation.height or 0
+            ),
+            DocumentAttributeAnimated(),
+            DocumentAttributeFilename(file_name=file_name or "animation.gif")
+        ]
+    )
+
+def _sticker_media(sticker, file_name, input_file, thumb):
+    return InputMediaUploadedDocument(
+        file=input_file,
+        mime_type=sticker.mime_type or "image/webp",
+        attributes=[DocumentAttributeFilename(file_name=file_name or "sticker.webp")]
+    )
+
+def _document_media(document, file_name, input_file, thumb):
+    return InputMediaUploadedDocument(
+        file=input_file,
+        mime_type=getattr(document, "mime_type", None) or "application/octet-stream",
+        attributes=[DocumentAttributeFilename(file_name=file_name)]
+    )
+
+_MEDIA_BUILDERS = {
+    "photo": _photo_media,
+    "video": _video_media,
+    "audio": _audio_media,
+    "voice": _voice_media,
+    "video_note": _video_note_media,
+    "animation": _animation_media,
+    "sticker": _sticker_media,
+    "document": _document_media,
+}
+
+
 async def process_single_media(client: Client, user_client: Client, target_msg: Message, 
                                 original_message: Message, status_msg: Message, 
-                                current_idx: int, total_count: int):
+                                current_idx: int, total_count: int | None):
     """Process a single media file and upload to backup group. Returns (backup_msg_id, file_name, file_size)."""
     try:
-        user_id = original_message.from_user.id
-        
-        # Create the streamer object
-        media_obj = (target_msg.document or target_msg.video or target_msg.audio or 
-                     target_msg.photo or target_msg.voice or target_msg.video_note or
-                     target_msg.animation or target_msg.sticker)
+        media_type, media_obj = get_media(target_msg)
         file_size = getattr(media_obj, "file_size", 0)
         file_name = getattr(media_obj, "file_name", None) or "file"
 
+        # Create the streamer object
         streamer = MediaStreamer(user_client, target_msg, file_size)
 
         # Determine file name based on media type BEFORE uploading
         # Photos need a proper extension for Telegram to accept them
-        if target_msg.photo:
+        if media_type == "photo":
             file_name = "photo.jpg"
         
         # Use manual upload to support async streaming
         input_file = await upload_stream(client, streamer, file_name)
-        
-        # Determine media type and create appropriate InputMedia
-        if target_msg.photo:
-            # Upload as photo
-            media = InputMediaUploadedPhoto(
-                file=input_file
-            )
-        elif target_msg.video:
-            # Upload as video with proper attributes
-            video = target_msg.video
-            attributes = [
-                DocumentAttributeVideo(
-                    duration=video.duration or 0,
-                    w=video.width or 0,
-                    h=video.height or 0,
-                    supports_streaming=True
-                ),
-                DocumentAttributeFilename(file_name=file_name)
-            ]
-            mime_type = video.mime_type or "video/mp4"
-            
-            # Download and upload thumbnail for video
-            thumb_input_file = None
-            try:
-                if video.thumbs:
-                    thumb_bytes_io = await user_client.download_media(
-                        video.thumbs[0].file_id, in_memory=True
-                    )
-                    if thumb_bytes_io:
-                        if isinstance(thumb_bytes_io, BytesIO):
-                            thumb_bytes_io.seek(0)
-                            thumb_raw = thumb_bytes_io.read()
-                        else:
-                            thumb_raw = thumb_bytes_io
-                        
-                        if thumb_raw and len(thumb_raw) > 0:
-                            # Upload thumbnail using raw API SaveFilePart
-                            thumb_file_id_raw = random.randint(0, 2**63 - 1)
-                            await client.invoke(
-                                SaveFilePart(
-                                    file_id=thumb_file_id_raw,
-                                    file_part=0,
-                                    bytes=thumb_raw
-                                )
-                            )
-                            thumb_input_file = InputFile(
-                                id=thumb_file_id_raw,
-                                parts=1,
-                                name="thumb.jpg",
-                                md5_checksum=""
-                            )
-            except Exception as e:
-                print(f"DEBUG: Failed to download/upload thumbnail for raw API: {e}")
-                import traceback
-                traceback.print_exc()
-                thumb_input_file = None
-            
-            media = InputMediaUploadedDocument(
-                file=input_file,
-                mime_type=mime_type,
-                attributes=attributes,
-                thumb=thumb_input_file
-            )
-        elif target_msg.audio:
-            # Upload as audio with proper attributes
-            audio = target_msg.audio
-            attributes = [
-                DocumentAttributeAudio(
-                    duration=audio.duration or 0,
-                    title=audio.title or "",
-                    performer=audio.performer or ""
-                ),
-                DocumentAttributeFilename(file_name=file_name)
-            ]
-            mime_type = audio.mime_type or "audio/mpeg"
-            media = InputMediaUploadedDocument(
-                file=input_file,
-                mime_type=mime_type,
-                attributes=attributes
-            )
-        elif target_msg.voice:
-            # Upload as voice message
-            voice = target_msg.voice
-            attributes = [
-                DocumentAttributeAudio(
-                    duration=voice.duration or 0,
-                    voice=True
-                )
-            ]
-            mime_type = voice.mime_type or "audio/ogg"
-            media = InputMediaUploadedDocument(
-                file=input_file,
-                mime_type=mime_type,
-                attributes=attributes
-            )
-        elif target_msg.video_note:
-            # Upload as video note (round video)
-            video_note = target_msg.video_note
-            attributes = [
-                DocumentAttributeVideo(
-                    duration=video_note.duration or 0,
-                    w=video_note.length or 240,
-                    h=video_note.length or 240,
-                    round_message=True
-                )
-            ]
-            mime_type = "video/mp4"
-            media = InputMediaUploadedDocument(
-                file=input_file,
-                mime_type=mime_type,
-                attributes=attributes
-            )
-        elif target_msg.animation:
-            # Upload as GIF/animation
-            animation = target_msg.animation
-            attributes = [
-                DocumentAttributeVideo(
-                    duration=animation.duration or 0,
-                    w=animation.width or 0,
-                    h=animation.height or 0
-                ),
-                DocumentAttributeAnimated(),
-                DocumentAttributeFilename(file_name=file_name or "animation.gif")
-            ]
-            mime_type = animation.mime_type or "video/mp4"
-            media = InputMediaUploadedDocument(
-                file=input_file,
-                mime_type=mime_type,
-                attributes=attributes
-            )
-        elif target_msg.sticker:
-            # Upload as sticker
-            sticker = target_msg.sticker
-            attributes = [
-                DocumentAttributeFilename(file_name=file_name or "sticker.webp")
-            ]
-            mime_type = sticker.mime_type or "image/webp"
-            media = InputMediaUploadedDocument(
-                file=input_file,
-                mime_type=mime_type,
-                attributes=attributes
-            )
-        else:
-            # Upload as regular document
-            attributes = [DocumentAttributeFilename(file_name=file_name)]
-            mime_type = getattr(media_obj, "mime_type", "application/octet-stream")
-            media = InputMediaUploadedDocument(
-                file=input_file,
-                mime_type=mime_type,
-                attributes=attributes
-            )
+
+        thumb = None
+        if media_type == "video":
+            thumb = await _upload_video_thumb(client, user_client, media_obj)
+
+        # Create the InputMedia matching the media type
+        build = _MEDIA_BUILDERS.get(media_type, _document_media)
+        media = build(media_obj, file_name, input_file, thumb)
 
         # Resolve peer using helper function
         peer = await get_backup_group_peer(client)
@@ -1836,15 +1986,26 @@ async def process_single_media(client: Client, user_client: Client, target_msg:
         if not peer:
             return None, file_name, file_size
 
-        # Send using raw API
-        updates = await client.invoke(
-            SendMedia(
-                peer=peer,
-                media=media,
-                message="",
-                random_id=random.randint(0, 2**63 - 1)
-            )
-        )
+        # Send using raw API, paced by the bot's limiter
+        limiter = rate_limiter(client)
+        for attempt in range(3):
+            try:
+                await limiter.wait(chat_id=BACKUP_GROUP_ID)
+                updates = await client.invoke(
+                    SendMedia(
+                        peer=peer,
+                        media=media,
+                        message="",
+                        random_id=rand63()
+                    )
+                )
+                break
+            except FloodWait as fw:
+                wait = flood_wait_seconds(fw)
+                if not limiter.backoff(fw, retry=attempt < 2):
+                    logger.warning("FloodWait %ss on backup send, skipping file", wait)
+                    return None, file_name, file_size
+                logger.warning("FloodWait %ss on backup send (attempt %s/3)", wait, attempt+1)
 
         # Extract message ID from updates
         backup_msg_id = None
@@ -1856,7 +2017,5 @@ async def process_single_media(client: Client, user_client: Client, target_msg:
         return backup_msg_id, file_name, file_size
 
     except Exception as e:
-        print(f"DEBUG: Error processing media {current_idx}/{total_count}: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing media %s/%s: %s", current_idx, total_count or "?", e)
         return None, "unknown", 0
@@ -1,4 +1,7 @@
 import asyncio
+import logging
+import time
+from collections import OrderedDict
 from pyrogram import Client
 from pyrogram.errors.exceptions.unauthorized_401 import (
     AuthKeyUnregistered,
@@ -8,7 +11,9 @@ from pyrogram.errors.exceptions.unauthorized_401 import (
     UserDeactivated,
     UserDeactivatedBan,
 )
-from app.database.db import get_user_session, delete_user_session
+from app.database.db import get_cached_user_session, delete_user_session
+
+logger = logging.getLogger(__name__)
 
 # Some Pyrogram versions expose UserDeactivatedSanitized under forbidden_403.
 # Import it defensively so we don't crash on older/newer versions.
@@ -40,9 +45,25 @@ def is_session_invalid_error(exc: BaseException) -> bool:
     return isinstance(exc, _SESSION_INVALID_ERRORS)
 
 
+# Bounds on the cached user clients. Each one holds a socket and auth keys,
+# so idle clients are stopped instead of being kept for every user ever seen.
+MAX_CLIENTS = 128
+CLIENT_IDLE_TTL = 600  # seconds
+CLIENT_SWEEP_INTERVAL = 60  # seconds
+
+
+def _is_busy(user_id: int) -> bool:
+    """True while the user has a transfer running (its client must stay up)."""
+    # Imported lazily to avoid a circular import with app.bot.main
+    from app.bot.main import active_user_processes
+    return user_id in active_user_processes
+
+
 class UserClientManager:
     def __init__(self):
-        self.clients = {} # Cache active clients: user_id -> Client
+        self.clients = OrderedDict() # Cache active clients: user_id -> Client, least recently used first
+        self._last_used = {}  # user_id -> time.monotonic() of the last get_client()
+        self._sweeper = None
 
     async def get_client(self, user_id: int):
         """
@@ -58,14 +79,16 @@ class UserClientManager:
                 # Verify the session is still alive server-side.
                 try:
                     await client.get_me()
+                    self._touch(user_id)
                     return client
                 except Exception as e:
                     if is_session_invalid_error(e):
-                        print(f"[SessionManager] Cached session for user {user_id} is invalid: {e}")
+                        logger.warning(f"[SessionManager] Cached session for user {user_id} is invalid: {e}")
                         await self.invalidate(user_id)
                         return None
                     # Transient error — keep the cached client, let caller retry.
-                    print(f"[SessionManager] get_me() failed for user {user_id} (transient): {e}")
+                    logger.warning(f"[SessionManager] get_me() failed for user {user_id} (transient): {e}")
+                    self._touch(user_id)
                     return client
             else:
                 # If disconnected, try to reconnect
@@ -73,14 +96,14 @@ class UserClientManager:
                     await client.start()
                 except Exception as e:
                     if is_session_invalid_error(e):
-                        print(f"[SessionManager] Reconnect failed (session invalid) for user {user_id}: {e}")
+                        logger.warning(f"[SessionManager] Reconnect failed (session invalid) for user {user_id}: {e}")
                         await self.invalidate(user_id)
                         return None
-                    del self.clients[user_id]
+                    self._drop(user_id)
                     # Fall through to DB lookup below.
 
         # Fetch from DB
-        session_data = await get_user_session(user_id)
+        session_data = await get_cached_user_session(user_id)
         if not session_data:
             return None
 
@@ -92,17 +115,19 @@ class UserClientManager:
             api_hash=session_data['api_hash'],
             session_string=session_data['session_string'],
             in_memory=True, # Don't create .session files
-            no_updates=True # We don't need to receive updates for the user, just make requests
+            no_updates=True, # We don't need to receive updates for the user, just make requests
+            max_concurrent_transmissions=4, # Parallel file transfers over the one authorized connection
+            sleep_threshold=60 # Ride out short FloodWaits inside invoke() instead of failing the transfer
         )
 
         try:
             await client.start()
         except Exception as e:
             if is_session_invalid_error(e):
-                print(f"[SessionManager] Start failed (session invalid) for user {user_id}: {e}")
+                logger.warning(f"[SessionManager] Start failed (session invalid) for user {user_id}: {e}")
                 await self.invalidate(user_id)
                 return None
-            print(f"Failed to start client for user {user_id}: {e}")
+            logger.warning(f"Failed to start client for user {user_id}: {e}")
             return None
 
         # Pre-flight: confirm the session is actually alive server-side.
@@ -110,32 +135,64 @@ class UserClientManager:
             await client.get_me()
         except Exception as e:
             if is_session_invalid_error(e):
-                print(f"[SessionManager] Pre-flight get_me() failed (session invalid) for user {user_id}: {e}")
+                logger.warning(f"[SessionManager] Pre-flight get_me() failed (session invalid) for user {user_id}: {e}")
                 await self.invalidate(user_id)
                 return None
             # Transient error — return the client anyway; caller will retry on real failure.
-            print(f"[SessionManager] Pre-flight get_me() failed (transient) for user {user_id}: {e}")
+            logger.warning(f"[SessionManager] Pre-flight get_me() failed (transient) for user {user_id}: {e}")
 
         self.clients[user_id] = client
+        self._touch(user_id)
+        await self._evict_overflow()
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_idle())
         return client
 
+    def _touch(self, user_id: int):
+        self.clients.move_to_end(user_id)
+        self._last_used[user_id] = time.monotonic()
+
+    def _drop(self, user_id: int):
+        self._last_used.pop(user_id, None)
+        return self.clients.pop(user_id, None)
+
+    async def _evict_overflow(self):
+        """Stop least recently used idle clients until at most MAX_CLIENTS remain."""
+        for uid in list(self.clients):
+            if len(self.clients) <= MAX_CLIENTS:
+                break
+            if not _is_busy(uid):
+                await self.stop_client(uid)
+
+    async def _sweep_idle(self):
+        """Periodically stop clients unused for CLIENT_IDLE_TTL seconds."""
+        while self.clients:
+            await asyncio.sleep(CLIENT_SWEEP_INTERVAL)
+            now = time.monotonic()
+            for uid in list(self.clients):
+                if now - self._last_used.get(uid, now) > CLIENT_IDLE_TTL and not _is_busy(uid):
+                    await self.stop_client(uid)
+
     async def invalidate(self, user_id: int):
         """Stop and evict the cached client, and delete the dead session from DB."""
-        client = self.clients.pop(user_id, None)
+        client = self._drop(user_id)
         if client is not None:
             try:
                 await client.stop()
             except Exception as e:
-                print(f"[SessionManager] Error stopping client for user {user_id}: {e}")
+                logger.warning(f"[SessionManager] Error stopping client for user {user_id}: {e}")
         try:
             await delete_user_session(user_id)
-            print(f"[SessionManager] Deleted dead session for user {user_id}")
+            logger.info(f"[SessionManager] Deleted dead session for user {user_id}")
         except Exception as e:
-            print(f"[SessionManager] Failed to delete session for user {user_id}: {e}")
+            logger.warning(f"[SessionManager] Failed to delete session for user {user_id}: {e}")
 
     async def stop_client(self, user_id: int):
-        if user_id in self.clients:
-            await self.clients[user_id].stop()
-            del self.clients[user_id]
+        client = self._drop(user_id)
+        if client is not None:
+            try:
+                await client.stop()
+            except Exception as e:
+                logger.warning(f"[SessionManager] Error stopping client for user {user_id}: {e}")
 
 manager = UserClientManager()
@@ -1,10 +1,13 @@
-# Simple in-memory state management
-# user_id -> { "step": str, "data": dict }
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional
 
-user_login_states = {}
+logger = logging.getLogger(__name__)
 
-# Profile setup states (separate from login states)
-user_profile_states = {}
+# Simple in-memory state management
+# user_id -> UserState (login + profile setup), expired after a period of inactivity
 
 class LoginStep:
     ASK_API_ID = "ASK_API_ID"
@@ -16,3 +19,128 @@ class LoginStep:
 class ProfileStep:
     ASK_GENDER = "ASK_GENDER"
     ASK_AGE = "ASK_AGE"
+
+
+@dataclass
+class UserState:
+    """Everything the bot remembers about a user's in-progress login/profile flow."""
+    step: Optional[str] = None          # LoginStep, None when not logging in
+    data: dict = field(default_factory=dict)
+    temp_client: Any = None             # Pyrogram Client used during login
+    profile_step: Optional[str] = None  # ProfileStep, None when not setting up profile
+    profile_data: dict = field(default_factory=dict)
+
+    @property
+    def is_idle(self) -> bool:
+        return self.step is None and self.profile_step is None
+
+
+# Strong refs so fire-and-forget disconnect tasks aren't garbage collected
+_background_tasks = set()
+
+
+async def _disconnect_quietly(client):
+    try:
+        await client.disconnect()
+    except Exception as e:
+        logger.warning(f"[States] Error disconnecting temp client: {e}")
+
+
+def disconnect_in_background(client) -> Optional[asyncio.Task]:
+    """Disconnect *client* without making the caller wait. Returns the task."""
+    try:
+        task = asyncio.get_running_loop().create_task(_disconnect_quietly(client))
+    except RuntimeError:
+        return None  # No running loop (e.g. interpreter shutdown)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def _on_evict(state: UserState):
+    """Release the temp login client of an abandoned flow."""
+    client = state.temp_client
+    state.temp_client = None
+    if client is not None:
+        disconnect_in_background(client)
+
+
+class UserStateCache:
+    """
+    user_id -> UserState with idle expiry and a size bound.
+
+    Entries are kept oldest-first; every access moves the entry to the back
+    and pushes its deadline out by *ttl* seconds.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = {}  # user_id -> (expires_at, UserState)
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._entries:
+            user_id = next(iter(self._entries))
+            expires_at, state = self._entries[user_id]
+            if expires_at > now and len(self._entries) <= self.maxsize:
+                break
+            del self._entries[user_id]
+            _on_evict(state)
+
+    def get(self, user_id: int) -> Optional[UserState]:
+        self._expire()
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return None
+        state = entry[1]
+        self._entries[user_id] = (time.monotonic() + self.ttl, state)
+        return state
+
+    def get_or_create(self, user_id: int) -> UserState:
+        state = self.get(user_id)
+        if state is None:
+            state = UserState()
+            self._entries[user_id] = (time.monotonic() + self.ttl, state)
+            self._expire()
+        return state
+
+    def pop(self, user_id: int) -> Optional[UserState]:
+        entry = self._entries.pop(user_id, None)
+        return entry[1] if entry else None
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+
+user_states = UserStateCache()
+
+
+def get_login_state(user_id: int) -> Optional[UserState]:
+    """Return the user's state if a login flow is in progress."""
+    state = user_states.get(user_id)
+    return state if state and state.step else None
+
+
+def get_profile_state(user_id: int) -> Optional[UserState]:
+    """Return the user's state if profile setup is in progress."""
+    state = user_states.get(user_id)
+    return state if state and state.profile_step else None
+
+
+def begin_profile_setup(user_id: int) -> UserState:
+    """(Re)start profile setup at the gender question."""
+    state = user_states.get_or_create(user_id)
+    state.profile_step = ProfileStep.ASK_GENDER
+    state.profile_data = {}
+    return state
+
+
+def end_profile_setup(user_id: int):
+    state = user_states.get(user_id)
+    if state is None:
+        return
+    state.profile_step = None
+    state.profile_data = {}
+    if state.is_idle:
+        user_states.pop(user_id)
@@ -12,9 +12,18 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 MONGO_URI = os.getenv("MONGO_URI", "")
 
 # Configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 BACKUP_GROUP_ID = int(os.getenv("BACKUP_GROUP_ID", "0")) # The private group for storage
+# Channel id as used in t.me/c/<id>/<msg> links to the backup group
+BACKUP_CHANNEL_ID_STR = str(BACKUP_GROUP_ID).removeprefix("-100")
 OWNER_ID = int(os.getenv("OWNER_ID", "0"))
 
+# Small runtime state the bot keeps between restarts (owned by the app, not /tmp)
+STATE_DIR = os.getenv("STATE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "tmp", "state"))
+
+# Archives: inflate giant (512 MB+) ZIP members across all cores with rapidgzip
+PARALLEL_DEFLATE = os.getenv("PARALLEL_DEFLATE", "").lower() in ("1", "true", "yes")
+
 # TeraBox
 TERABOX_NDUS = os.getenv("TERABOX_NDUS", "")
 
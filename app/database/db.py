@@ -1,6 +1,8 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from app.config import MONGO_URI
+import asyncio
 import datetime
+import time
 
 client = AsyncIOMotorClient(MONGO_URI)
 db = client.telegram_forwarder
@@ -9,6 +11,71 @@ users_collection = db.users
 logs_collection = db.logs
 sessions_collection = db.sessions
 settings_collection = db.settings
+peers_collection = db.peers
+
+# Short-lived read cache for the per-user lookups done on every button press and link.
+# user_id -> (expires_at, value). Writes below invalidate the entry.
+USER_CACHE_TTL = 180  # seconds
+USER_CACHE_MAXSIZE = 4096
+
+_session_cache = {}
+_profile_cache = {}
+# user_id -> pending lookup, so concurrent misses share one query
+_session_inflight = {}
+_profile_inflight = {}
+# user_id -> generation, bumped on every invalidation. A lookup only caches
+# its result if no invalidation happened while it was running.
+_cache_epoch = {}
+
+def _cache_get(cache, user_id):
+    entry = cache.get(user_id)
+    if entry is None:
+        return False, None
+    expires_at, value = entry
+    if expires_at < time.monotonic():
+        cache.pop(user_id, None)
+        return False, None
+    return True, value
+
+def _cache_put(cache, user_id, value, epoch):
+    if _cache_epoch.get(user_id, 0) != epoch:
+        return  # Invalidated while the lookup ran; the value may be stale
+    if len(cache) >= USER_CACHE_MAXSIZE:
+        # Drop the oldest entry (dicts keep insertion order)
+        cache.pop(next(iter(cache)), None)
+    cache[user_id] = (time.monotonic() + USER_CACHE_TTL, value)
+
+async def ensure_indexes():
+    """Create the indexes the queries below rely on. Safe to call on every startup."""
+    await sessions_collection.create_index("user_id", unique=True)
+    await logs_collection.create_index([("timestamp", -1)])
+
+async def _cached_lookup(cache, inflight, user_id, fetch):
+    """Serve *fetch(user_id)* from *cache*, sharing one query between concurrent misses."""
+    hit, value = _cache_get(cache, user_id)
+    if hit:
+        return value
+    epoch = _cache_epoch.get(user_id, 0)
+    task = inflight.get(user_id)
+    if task is None:
+        task = asyncio.ensure_future(fetch(user_id))
+        inflight[user_id] = task
+        task.add_done_callback(
+            lambda t: inflight.pop(user_id, None) if inflight.get(user_id) is t else None
+        )
+    # Shielded so one cancelled waiter doesn't cancel the lookup for the others
+    value = await asyncio.shield(task)
+    _cache_put(cache, user_id, value, epoch)
+    return value
+
+def invalidate_user_session(user_id):
+    """Drop any cached session/profile lookups for *user_id*."""
+    _cache_epoch[user_id] = _cache_epoch.get(user_id, 0) + 1
+    _session_cache.pop(user_id, None)
+    _profile_cache.pop(user_id, None)
+    # Later callers must not join a lookup that started before this write
+    _session_inflight.pop(user_id, None)
+    _profile_inflight.pop(user_id, None)
 
 async def add_user(user_id, username):
     await users_collection.update_one(
@@ -31,6 +98,7 @@ async def save_user_profile(user_id, gender, age):
         }},
         upsert=True
     )
+    invalidate_user_session(user_id)
 
 async def get_user_profile(user_id):
     """Get user's profile (gender and age)."""
@@ -39,6 +107,10 @@ async def get_user_profile(user_id):
         return {"gender": user["gender"], "age": user["age"]}
     return None
 
+async def get_cached_user_profile(user_id):
+    """Like get_user_profile, but served from a short TTL cache when possible."""
+    return await _cached_lookup(_profile_cache, _profile_inflight, user_id, get_user_profile)
+
 async def save_backup_group_cache(group_id, access_hash):
     """Save the backup group cache to database for persistence across restarts."""
     await settings_collection.update_one(
@@ -55,6 +127,22 @@ async def get_backup_group_cache():
     """Get the cached backup group info from database."""
     return await settings_collection.find_one({"_id": "backup_group_cache"})
 
+async def save_user_peer_cache(user_id, chat_id, channel_id, access_hash):
+    """Remember how a user's client resolved a private chat, so restarts don't force a dialog scan."""
+    await peers_collection.update_one(
+        {"_id": f"{user_id}:{chat_id}"},
+        {"$set": {
+            "channel_id": channel_id,
+            "access_hash": access_hash,
+            "updated_at": datetime.datetime.utcnow()
+        }},
+        upsert=True
+    )
+
+async def get_user_peer_cache(user_id, chat_id):
+    """Get a user's cached peer for chat_id, or None."""
+    return await peers_collection.find_one({"_id": f"{user_id}:{chat_id}"})
+
 async def save_user_session(user_id, session_string, api_id, api_hash):
     """Save the user's custom session for accessing their private chats."""
     await sessions_collection.update_one(
@@ -66,19 +154,118 @@ async def save_user_session(user_id, session_string, api_id, api_hash):
         }},
         upsert=True
     )
+    invalidate_user_session(user_id)
 
 async def get_user_session(user_id):
     return await sessions_collection.find_one({"user_id": user_id})
 
+async def get_cached_user_session(user_id):
+    """Like get_user_session, but served from a short TTL cache when possible."""
+    return await _cached_lookup(_session_cache, _session_inflight, user_id, get_user_session)
+
+async def get_user_auth_state(user_id):
+    """
+    Fetch the user's session and profile in a single round-trip.
+
+    Returns {"session": dict | None, "profile": dict | None}. Served from the
+    short TTL cache when both halves are already cached.
+    """
+    session_hit, session = _cache_get(_session_cache, user_id)
+    profile_hit, profile = _cache_get(_profile_cache, user_id)
+    if session_hit and profile_hit:
+        return {"session": session, "profile": profile}
+    epoch = _cache_epoch.get(user_id, 0)
+
+    # UNION ALL of the user document and the session document
+    pipeline = [
+        {"$match": {"_id": user_id}},
+        {"$project": {"_kind": "user", "gender": 1, "age": 1}},
+        {"$unionWith": {
+            "coll": sessions_collection.name,
+            "pipeline": [
+                {"$match": {"user_id": user_id}},
+                {"$addFields": {"_kind": "session"}},
+            ],
+        }},
+    ]
+    session = None
+    profile = None
+    async for doc in users_collection.aggregate(pipeline):
+        kind = doc.pop("_kind", None)
+        if kind == "session":
+            session = doc
+        elif kind == "user" and doc.get("gender") and doc.get("age"):
+            profile = {"gender": doc["gender"], "age": doc["age"]}
+
+    _cache_put(_session_cache, user_id, session, epoch)
+    _cache_put(_profile_cache, user_id, profile, epoch)
+    return {"session": session, "profile": profile}
+
 async def delete_user_session(user_id):
     """Delete a user's session (used when the session is revoked/dead)."""
     await sessions_collection.delete_one({"user_id": user_id})
+    invalidate_user_session(user_id)
+
+# log_forward() only enqueues; a background writer inserts the logs in batches
+LOG_BATCH_SIZE = 50
+LOG_FLUSH_INTERVAL = 0.5  # seconds
+
+_log_queue = asyncio.Queue()
+_log_writer_task = None
+
+async def _insert_logs(batch):
+    try:
+        # Unordered, so one bad document doesn't drop the rest of the batch
+        await logs_collection.insert_many(batch, ordered=False)
+    except Exception as e:
+        print(f"[DB] Failed to write {len(batch)} log(s): {e}")
+
+async def _log_writer():
+    loop = asyncio.get_running_loop()
+    batch = []
+    try:
+        while True:
+            batch = [await _log_queue.get()]
+            deadline = loop.time() + LOG_FLUSH_INTERVAL
+            while len(batch) < LOG_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(_log_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await _insert_logs(batch)
+            batch = []
+    except asyncio.CancelledError:
+        # insert_many sets _id on the documents, so a retried half-written
+        # batch only fails on the duplicates
+        if batch:
+            await _insert_logs(batch)
+        raise
+
+async def flush_logs():
+    """Stop the background writer and write out anything still queued."""
+    global _log_writer_task
+    task, _log_writer_task = _log_writer_task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    batch = []
+    while not _log_queue.empty():
+        batch.append(_log_queue.get_nowait())
+    if batch:
+        await _insert_logs(batch)
 
 async def log_forward(username, backup_msg_id, file_size, source_name, backup_message_link):
+    global _log_writer_task
     # Convert file_size to MB format
     file_size_mb = round(file_size / (1024 * 1024), 2) if file_size else 0
-    
-    await logs_collection.insert_one({
+
+    _log_queue.put_nowait({
         "username": username,
         "backup_message_id": backup_msg_id,
         "file_size": f"{file_size_mb} MB",
@@ -86,7 +273,27 @@ async def log_forward(username, backup_msg_id, file_size, source_name, backup_me
         "backup_message_link": backup_message_link,
         "timestamp": datetime.datetime.utcnow()
     })
+    if _log_writer_task is None or _log_writer_task.done():
+        _log_writer_task = asyncio.create_task(_log_writer())
+
+# Fields shown when listing logs; the rest of each document is never read
+LOG_LIST_PROJECTION = {
+    "username": 1,
+    "file_size": 1,
+    "source_name": 1,
+    "backup_message_link": 1,
+    "timestamp": 1,
+}
+
+async def iter_logs(limit=1000):
+    """Yield the newest logs one by one instead of buffering them all."""
+    cursor = (
+        logs_collection.find({}, projection=LOG_LIST_PROJECTION)
+        .sort("timestamp", -1)
+        .limit(limit)
+    )
+    async for doc in cursor:
+        yield doc
 
-async def get_all_logs():
-    cursor = logs_collection.find({}).sort("timestamp", -1)
-    return await cursor.to_list(length=1000)
+async def get_all_logs(limit=1000):
+    return [doc async for doc in iter_logs(limit)]
@@ -7,15 +7,18 @@ and upload pipeline as other handlers (mediafire, terabox, torrent).
 from __future__ import annotations
 
 import asyncio
+import logging
 import os
 import random
 import re
 import shutil
 import tempfile
+from contextlib import aclosing
 from typing import Dict, List, Optional, Tuple
 
 from pyrogram import Client
 from app.utils.message import safe_edit
+from app.utils.ratelimit import rate_limiter, flood_wait_seconds
 from pyrogram.types import (
     Message,
     InputMediaPhoto,
@@ -37,17 +40,18 @@ from pyrogram.raw.types import (
 )
 from pyrogram.errors import FloodWait
 
-from app.config import BACKUP_GROUP_ID
+from app.config import BACKUP_GROUP_ID, BACKUP_CHANNEL_ID_STR
 from app.database.db import (
     save_backup_group_cache,
     get_backup_group_cache,
-    get_user_session,
-    get_user_profile,
+    get_cached_user_session,
+    get_cached_user_profile,
     log_forward,
 )
 from app.bot.session_manager import manager
-from app.utils.streamer import upload_stream, SessionInvalidError
+from app.utils.streamer import upload_stream, rand63, SessionInvalidError
 from app.utils.media import (
+    probe_and_thumb,
     classify as _classify,
     mime as _mime,
     ext as _ext,
@@ -62,10 +66,9 @@ from app.direct.client import DirectLinkClient
 from app.direct.streamer import DirectLinkStreamer
 from app.terabox.progress import ProgressTracker
 from app.mediafire.streamer import FileStreamer
-from app.mediafire.archive import (
-    count_media_in_archive,
-    iter_extract_media,
-)
+from app.mediafire.archive import ExtractedMedia, prefetch_media, scan_and_extract
+
+logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
 # Pattern matching for direct links
@@ -116,7 +119,7 @@ async def _get_backup_group_peer():
 
     # Fallback to direct ID
     from pyrogram.raw.types import InputPeerChannel
-    channel_id = int(str(BACKUP_GROUP_ID).replace("-100", ""))
+    channel_id = int(BACKUP_CHANNEL_ID_STR)
     return InputPeerChannel(channel_id=channel_id, access_hash=0)
 
 
@@ -126,31 +129,26 @@ async def _generate_video_thumb(video_path: str, duration_sec: int = 0) -> Optio
     Seeks to 10% of video duration (or 1 second if duration unknown).
     """
     try:
-        thumb_path = video_path + ".thumb.jpg"
         # If duration is known, seek to 10% of the video
         seek_time = max(1, int(duration_sec * 0.1)) if duration_sec > 0 else 1
-        
+
+        # JPEG straight to stdout: no temp file to read back and remove
         proc = await asyncio.create_subprocess_exec(
-            "ffmpeg", "-y",
+            "ffmpeg", "-nostdin",
             "-ss", str(seek_time),
             "-i", video_path,
             "-frames:v", "1",
             "-q:v", "2",
             "-vf", "scale='min(320,iw)':-2",
-            thumb_path,
-            stdout=asyncio.subprocess.DEVNULL,
+            "-f", "image2pipe", "-c:v", "mjpeg",
+            "pipe:1",
+            stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.DEVNULL,
         )
-        await proc.wait()
-
-        if proc.returncode == 0 and os.path.exists(thumb_path):
-            with open(thumb_path, "rb") as f:
-                data = f.read()
-            os.remove(thumb_path)
-            if len(data) > 100:
-                return data
-        if os.path.exists(thumb_path):
-            os.remove(thumb_path)
+        data, _ = await proc.communicate()
+
+        if proc.returncode == 0 and len(data) > 100:
+            return data
     except Exception as e:
         print(f"[DirectLink] Error generating thumbnail: {e}")
     return None
@@ -225,7 +223,7 @@ async def _get_video_metadata(video_path: str) -> Dict[str, int]:
 async def _upload_thumb_to_telegram(bot: Client, thumb_raw: bytes) -> Optional[InputFile]:
     """Upload thumbnail bytes and return InputFile."""
     try:
-        thumb_file_id = random.randint(0, 2 ** 63 - 1)
+        thumb_file_id = rand63()
         await bot.invoke(
             SaveFilePart(
                 file_id=thumb_file_id,
@@ -240,7 +238,7 @@ async def _upload_thumb_to_telegram(bot: Client, thumb_raw: bytes) -> Optional[I
             md5_checksum="",
         )
     except Exception as e:
-        print(f"[DirectLink] Error uploading thumbnail: {e}")
+        logger.warning(f"[DirectLink] Error uploading thumbnail: {e}")
     return None
 
 
@@ -392,7 +390,7 @@ async def _upload_file_to_backup(
             if thumb_raw:
                 thumb_input_file = await _upload_thumb_to_telegram(upload_client, thumb_raw)
                 if thumb_input_file:
-                    print(f"[DirectLink] Thumbnail uploaded for {file_name} ({len(thumb_raw)} bytes)")
+                    logger.info(f"[DirectLink] Thumbnail uploaded for {file_name} ({len(thumb_raw)} bytes)")
 
             media = InputMediaUploadedDocument(
                 file=input_file,
@@ -427,8 +425,10 @@ async def _upload_file_to_backup(
             pending_bot_uploads[uid].append((file_name, fut))
 
         # Send to target peer with FloodWait handling
+        limiter = rate_limiter(upload_client)
         for attempt in range(1, 4):
             try:
+                await limiter.wait(chat_id=None if is_sent_to_bot else BACKUP_GROUP_ID)
                 # Use resolve_peer ONLY if upload_peer is a string or int (username, chat_id).
                 # If it's already an InputPeer (from backup group), use it directly.
                 target_peer = (
@@ -442,17 +442,16 @@ async def _upload_file_to_backup(
                         peer=target_peer,
                         media=media,
                         message="",
-                        random_id=random.randint(0, 2 ** 63 - 1),
+                        random_id=rand63(),
                     )
                 )
                 break
             except FloodWait as fw:
-                wait = fw.value if hasattr(fw, "value") else getattr(fw, "x", 10)
-                print(f"[DirectLink] FloodWait {wait}s (attempt {attempt}/3)")
-                await asyncio.sleep(wait + 1)
-        else:
-            print(f"[DirectLink] SendMedia failed after retries: {file_name}")
-            return None
+                wait = flood_wait_seconds(fw)
+                logger.warning(f"[DirectLink] FloodWait {wait}s (attempt {attempt}/3)")
+                if not limiter.backoff(fw, retry=attempt < 3):
+                    logger.warning(f"[DirectLink] SendMedia gave up on FloodWait: {file_name}")
+                    return None
 
         # Extract message_id
         msg_id = _extract_msg_id(updates)
@@ -470,15 +469,15 @@ async def _upload_file_to_backup(
                     if fw_msg:
                         backup_msg_id = fw_msg.id
                 except Exception as e:
-                    print(f"[DirectLink] Failed to forward bot message {bot_msg.id}: {e}")
+                    logger.warning(f"[DirectLink] Failed to forward bot message {bot_msg.id}: {e}")
                 
                 if backup_msg_id:
                     return backup_msg_id, True
                 else:
-                    print("[DirectLink] Failed to forward message to backup group")
+                    logger.warning("[DirectLink] Failed to forward message to backup group")
                     return None, True
             except asyncio.TimeoutError:
-                print("[DirectLink] Timeout waiting for bot to receive the message")
+                logger.warning("[DirectLink] Timeout waiting for bot to receive the message")
                 if uid in pending_bot_uploads:
                     pending_bot_uploads[uid] = [p for p in pending_bot_uploads[uid] if p[1] != fut]
                 return None, True
@@ -487,7 +486,7 @@ async def _upload_file_to_backup(
             return msg_id, False
 
         # Fallback for BACKUP_GROUP_ID directly
-        print(f"[DirectLink] WARNING: Could not extract msg_id, searching recent messages")
+        logger.warning(f"[DirectLink] Could not extract msg_id, searching recent messages")
         try:
             recent = await bot.get_messages(BACKUP_GROUP_ID, list(range(-1, -4, -1)))
             if not isinstance(recent, list):
@@ -498,7 +497,7 @@ async def _upload_file_to_backup(
                     if fname == file_name:
                         return msg.id, False
         except Exception as e:
-            print(f"[DirectLink] Fallback search failed: {e}")
+            logger.warning(f"[DirectLink] Fallback search failed: {e}")
 
         return None, False
     except SessionInvalidError as e:
@@ -506,7 +505,7 @@ async def _upload_file_to_backup(
         # Invalidate the cached client + DB session and re-raise so the
         # outer handler can tell the user to re-login. Do NOT retry here —
         # retrying with the same dead key is pointless.
-        print(f"[DirectLink] Session invalid during upload: {e}")
+        logger.warning(f"[DirectLink] Session invalid during upload: {e}")
         # user_client may be None when this function was called for the
         # bot-client path (archive photo batches pass user_client=None).
         # In that case there is nothing to invalidate here.
@@ -517,10 +516,8 @@ async def _upload_file_to_backup(
                     await manager.invalidate(uid)
                     break
         raise
-    except Exception as e:
-        print(f"[DirectLink] Upload error: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("[DirectLink] Upload error")
         return None, False
 
 
@@ -539,17 +536,20 @@ def _extract_msg_id(updates) -> Optional[int]:
     return None
 
 
-async def _safe_send(coro_factory, retries: int = 3):
-    """Call coro_factory() with FloodWait handling."""
+async def _safe_send(bot: Client, coro_factory, retries: int = 3):
+    """Call coro_factory() (a request on *bot*) with rate limiting and FloodWait handling."""
+    limiter = rate_limiter(bot)
     for attempt in range(1, retries + 1):
         try:
+            await limiter.wait()
             return await coro_factory()
         except FloodWait as fw:
-            wait = fw.value if hasattr(fw, "value") else getattr(fw, "x", 10)
-            print(f"[DirectLink] FloodWait {wait}s (attempt {attempt}/{retries})")
-            await asyncio.sleep(wait + 1)
+            wait = flood_wait_seconds(fw)
+            logger.warning(f"[DirectLink] FloodWait {wait}s (attempt {attempt}/{retries})")
+            if not limiter.backoff(fw, retry=attempt < retries):
+                return None
         except Exception as e:
-            print(f"[DirectLink] Error (attempt {attempt}/{retries}): {e}")
+            logger.warning(f"[DirectLink] Error (attempt {attempt}/{retries}): {e}")
             if attempt < retries:
                 await asyncio.sleep(2)
     return None
@@ -573,6 +573,7 @@ async def _send_album_to_user(
 
     async def _send_single(mid: int) -> bool:
         r = await _safe_send(
+            bot,
             lambda _mid=mid: bot.copy_message(
                 chat_id=user_id,
                 from_chat_id=BACKUP_GROUP_ID,
@@ -589,6 +590,7 @@ async def _send_album_to_user(
         chunk_mids = [mid for mid, *_ in chunk]
 
         backup_msgs = await _safe_send(
+            bot,
             lambda _ids=chunk_mids: bot.get_messages(BACKUP_GROUP_ID, _ids)
         )
         if backup_msgs is None:
@@ -625,6 +627,7 @@ async def _send_album_to_user(
             await _send_single(valid_mids[0])
         else:
             r = await _safe_send(
+                bot,
                 lambda _ml=media_list: bot.send_media_group(user_id, _ml)
             )
             if r:
@@ -661,6 +664,7 @@ async def _deliver_to_user_multi(
 
     async def _send_single(mid: int) -> bool:
         r = await _safe_send(
+            bot,
             lambda _mid=mid: bot.copy_message(
                 chat_id=user_id,
                 from_chat_id=BACKUP_GROUP_ID,
@@ -688,19 +692,26 @@ async def _deliver_to_user_multi(
         await _send_single(mid)
         await asyncio.sleep(0.5)
 
-    # Safety net — resend anything not confirmed delivered
-    all_mids = {mid for mid, k, n, s in uploaded}
-    missing_mids = all_mids - delivered_mids
+    # Safety net — resend anything not confirmed delivered, in upload order.
+    # Photos/videos go back through the album path (one get_messages and
+    # one send_media_group per chunk); only the rest is copied one by one.
+    missing = [item for item in uploaded if item[0] not in delivered_mids]
 
-    if missing_mids:
+    if missing:
         print(
-            f"[DirectLink] Safety net: {len(missing_mids)} file(s) not "
-            "confirmed delivered, resending individually"
+            f"[DirectLink] Safety net: {len(missing)} file(s) not "
+            "confirmed delivered, resending"
         )
         await asyncio.sleep(2)
-        for mid in missing_mids:
-            await _send_single(mid)
-            await asyncio.sleep(1)
+        await _send_album_to_user(
+            bot, user_id,
+            [item for item in missing if item[1] in ("photo", "video")],
+            delivered_mids,
+        )
+        for mid, k, n, s in missing:
+            if k not in ("photo", "video") and mid not in delivered_mids:
+                await _send_single(mid)
+                await asyncio.sleep(1)
 
     total_to_send = len(uploaded)
     sent_count = len(delivered_mids)
@@ -736,6 +747,7 @@ async def _send_to_user(
         else:
             # File is in backup group. Copy to user.
             r = await _safe_send(
+                bot,
                 lambda: bot.copy_message(
                     chat_id=user_id,
                     from_chat_id=BACKUP_GROUP_ID,
@@ -879,239 +891,244 @@ async def _handle_archive(
         # ----- Phase 2: Count media files (metadata only, no extraction) -----
         await safe_edit(status_msg, "📂 Mengimbas fail media dalam arkib…")
 
-        loop = asyncio.get_running_loop()
-        total_files = await loop.run_in_executor(
-            None, count_media_in_archive, archive_path, skip_non_videos
-        )
-
-        if total_files == 0:
-            msg = "❌ Tiada fail video dijumpai dalam arkib." if skip_non_videos else "❌ Tiada fail media (foto/video) dijumpai dalam arkib."
-            await safe_edit(status_msg, msg)
-            return
-
         extract_dir = os.path.join(temp_dir, "extracted")
-        os.makedirs(extract_dir, exist_ok=True)
-
-        await safe_edit(status_msg, 
-            f"📤 Memuat naik {total_files} fail media ke Telegram…"
+        # One directory scan serves both the count and the extraction below
+        total_files, media_files = await scan_and_extract(
+            archive_path, extract_dir, skip_non_videos
         )
 
-        # ----- Phase 3: Extract & upload (photos parallel, videos sequential) -----
-        uploaded: List[Tuple[int, str, str, int]] = []
-        MAX_RETRIES = 3
-        idx = 0
-
-        # Batch settings for concurrent photo uploads
-        _PHOTO_BATCH = 5
-        _PHOTO_WORKERS = 3
-        _photo_batch: List[Dict[str, Any]] = []
-
-        _batch_state = {
-            "done": 0, "downloaded": 0, "uploaded": 0,
-            "_dl_samples": [], "_ul_samples": [],
-            "batch_total_size": 0, "batch_count": 0,
-        }
-        _batch_stopped = {"v": False}
-        _batch_start = _time.monotonic()
-
-        def _batch_add_dl(n: int):
-            now = _time.monotonic()
-            _batch_state["downloaded"] += n
-            _batch_state["_dl_samples"].append((now, _batch_state["downloaded"]))
-            if len(_batch_state["_dl_samples"]) > 60:
-                _batch_state["_dl_samples"] = _batch_state["_dl_samples"][-60:]
-
-        def _batch_add_ul(n: int):
-            now = _time.monotonic()
-            _batch_state["uploaded"] += n
-            _batch_state["_ul_samples"].append((now, _batch_state["uploaded"]))
-            if len(_batch_state["_ul_samples"]) > 60:
-                _batch_state["_ul_samples"] = _batch_state["_ul_samples"][-60:]
-
-        def _rolling_speed(samples, window=8.0):
-            if len(samples) < 2:
-                return 0.0
-            now = samples[-1][0]
-            cutoff = now - window
-            for i, (t, _) in enumerate(samples):
-                if t >= cutoff:
-                    t0, b0 = samples[i]
-                    t1, b1 = samples[-1]
-                    dt = t1 - t0
-                    return (b1 - b0) / dt if dt > 0 else 0.0
-            return 0.0
-
-        async def _batch_updater_loop():
-            while not _batch_stopped["v"]:
-                await asyncio.sleep(2.5)
-                if _batch_stopped["v"]:
-                    break
-                try:
-                    ts = _batch_state["batch_total_size"]
-                    if ts <= 0:
-                        continue
-                    dl_frac = _batch_state["downloaded"] / ts
-                    ul_frac = _batch_state["uploaded"] / ts
-                    dl_speed = _rolling_speed(_batch_state["_dl_samples"])
-                    ul_speed = _rolling_speed(_batch_state["_ul_samples"])
-                    dl_rem = max(0, ts - _batch_state["downloaded"])
-                    ul_rem = max(0, ts - _batch_state["uploaded"])
-                    elapsed = _time.monotonic() - _batch_start
-                    mins, secs = divmod(int(elapsed), 60)
-                    text = (
-                        f"🖼️ **Foto {_batch_state['done']}/{_batch_state['batch_count']}** "
-                        f"(📊 {total_files} jumlah fail)\n"
-                        f"📦 {_human_bytes(ts)}\n\n"
-                        f"⬇️ Muat Turun  {_bar(dl_frac)}  {dl_frac*100:.0f}%\n"
-                        f"    {_human_bytes(_batch_state['downloaded'])} • {_human_speed(dl_speed)} • ETA {_eta(dl_rem, dl_speed)}\n\n"
-                        f"⬆️ Muat Naik   {_bar(ul_frac)}  {ul_frac*100:.0f}%\n"
-                        f"    {_human_bytes(_batch_state['uploaded'])} • {_human_speed(ul_speed)} • ETA {_eta(ul_rem, ul_speed)}\n\n"
-                        f"⏱ Masa: {mins}m {secs}s"
-                    )
-                    await safe_edit(status_msg, text)
-                except Exception:
-                    pass
-
-        _batch_updater_task = asyncio.create_task(_batch_updater_loop())
-
-        async def _flush_photo_batch():
-            """Upload accumulated photos concurrently then clean up."""
-            if not _photo_batch:
+        async with aclosing(media_files):
+            if total_files == 0:
+                msg = "❌ Tiada fail video dijumpai dalam arkib." if skip_non_videos else "❌ Tiada fail media (foto/video) dijumpai dalam arkib."
+                await safe_edit(status_msg, msg)
                 return
-            batch = list(_photo_batch)
-            _photo_batch.clear()
-
-            _batch_state["batch_total_size"] += sum(e["size"] for e in batch)
-            _batch_state["batch_count"] += len(batch)
-
-            _sem = asyncio.Semaphore(_PHOTO_WORKERS)
-
-            _ul_proxy = type("_Proxy", (), {
-                "add_downloaded": staticmethod(lambda n: None),
-                "add_uploaded": staticmethod(_batch_add_ul),
-            })()
 
-            async def _upload_one_photo(entry):
-                async with _sem:
-                    if is_cancelled(user_id):
-                        return None
+            os.makedirs(extract_dir, exist_ok=True)
 
-                    # Use size limit check for extracted photos
-                    if entry["size"] > size_limit:
-                        print(f"[DirectArchive] Skipping oversized photo: {entry['name']} ({_human_bytes(entry['size'])})")
-                        return None
+            await safe_edit(status_msg, 
+                f"📤 Memuat naik {total_files} fail media ke Telegram…"
+            )
 
-                    _bmid = None
-                    for _att in range(1, MAX_RETRIES + 1):
-                        streamer = FileStreamer(
-                            entry["path"], entry["name"],
-                            on_download_chunk=_batch_add_dl,
-                        )
-                        _bmid, _is_sent_to_bot = await _upload_file_to_backup(
-                            bot, None, backup_peer, streamer,
-                            entry["name"], entry["size"],
-                            tracker=_ul_proxy,
-                        )
-                        if _bmid:
-                            break
-                        if _att < MAX_RETRIES:
-                            await asyncio.sleep(1)
+            # ----- Phase 3: Extract & upload (photos parallel, videos sequential) -----
+            uploaded: List[Tuple[int, str, str, int]] = []
+            MAX_RETRIES = 3
+            idx = 0
+
+            # Batch settings for concurrent photo uploads
+            _PHOTO_BATCH = 5
+            _PHOTO_WORKERS = 3
+            _photo_batch: List[ExtractedMedia] = []
+
+            _batch_state = {
+                "done": 0, "downloaded": 0, "uploaded": 0,
+                "_dl_samples": [], "_ul_samples": [],
+                "batch_total_size": 0, "batch_count": 0,
+            }
+            _batch_stopped = {"v": False}
+            _batch_start = _time.monotonic()
+
+            def _batch_add_dl(n: int):
+                now = _time.monotonic()
+                _batch_state["downloaded"] += n
+                _batch_state["_dl_samples"].append((now, _batch_state["downloaded"]))
+                if len(_batch_state["_dl_samples"]) > 60:
+                    _batch_state["_dl_samples"] = _batch_state["_dl_samples"][-60:]
+
+            def _batch_add_ul(n: int):
+                now = _time.monotonic()
+                _batch_state["uploaded"] += n
+                _batch_state["_ul_samples"].append((now, _batch_state["uploaded"]))
+                if len(_batch_state["_ul_samples"]) > 60:
+                    _batch_state["_ul_samples"] = _batch_state["_ul_samples"][-60:]
+
+            def _rolling_speed(samples, window=8.0):
+                if len(samples) < 2:
+                    return 0.0
+                now = samples[-1][0]
+                cutoff = now - window
+                for i, (t, _) in enumerate(samples):
+                    if t >= cutoff:
+                        t0, b0 = samples[i]
+                        t1, b1 = samples[-1]
+                        dt = t1 - t0
+                        return (b1 - b0) / dt if dt > 0 else 0.0
+                return 0.0
 
+            async def _batch_updater_loop():
+                while not _batch_stopped["v"]:
+                    await asyncio.sleep(2.5)
+                    if _batch_stopped["v"]:
+                        break
                     try:
-                        os.remove(entry["path"])
-                    except OSError:
+                        ts = _batch_state["batch_total_size"]
+                        if ts <= 0:
+                            continue
+                        dl_frac = _batch_state["downloaded"] / ts
+                        ul_frac = _batch_state["uploaded"] / ts
+                        dl_speed = _rolling_speed(_batch_state["_dl_samples"])
+                        ul_speed = _rolling_speed(_batch_state["_ul_samples"])
+                        dl_rem = max(0, ts - _batch_state["downloaded"])
+                        ul_rem = max(0, ts - _batch_state["uploaded"])
+                        elapsed = _time.monotonic() - _batch_start
+                        mins, secs = divmod(int(elapsed), 60)
+                        text = (
+                            f"🖼️ **Foto {_batch_state['done']}/{_batch_state['batch_count']}** "
+                            f"(📊 {total_files} jumlah fail)\n"
+                            f"📦 {_human_bytes(ts)}\n\n"
+                            f"⬇️ Muat Turun  {_bar(dl_frac)}  {dl_frac*100:.0f}%\n"
+                            f"    {_human_bytes(_batch_state['downloaded'])} • {_human_speed(dl_speed)} • ETA {_eta(dl_rem, dl_speed)}\n\n"
+                            f"⬆️ Muat Naik   {_bar(ul_frac)}  {ul_frac*100:.0f}%\n"
+                            f"    {_human_bytes(_batch_state['uploaded'])} • {_human_speed(ul_speed)} • ETA {_eta(ul_rem, ul_speed)}\n\n"
+                            f"⏱ Masa: {mins}m {secs}s"
+                        )
+                        await safe_edit(status_msg, text)
+                    except Exception:
                         pass
 
-                    _batch_state["done"] += 1
-                    await asyncio.sleep(0.3)
-                    if _bmid:
-                        return (_bmid, entry["kind"], entry["name"], entry["size"])
-                    return None
-
-            results = await asyncio.gather(
-                *[_upload_one_photo(e) for e in batch],
-                return_exceptions=True,
-            )
-            for r in results:
-                if isinstance(r, Exception):
-                    print(f"[DirectArchive] Photo batch exception: {r}")
-                    continue
-                if r:
-                    uploaded.append(r)
-            gc.collect()
-
-        async for mf in iter_extract_media(archive_path, extract_dir, skip_non_videos):
-            idx += 1
+            _batch_updater_task = asyncio.create_task(_batch_updater_loop())
+
+            async def _flush_photo_batch():
+                """Upload accumulated photos concurrently then clean up."""
+                if not _photo_batch:
+                    return
+                batch = list(_photo_batch)
+                _photo_batch.clear()
+
+                _batch_state["batch_total_size"] += sum(e.size for e in batch)
+                _batch_state["batch_count"] += len(batch)
+
+                _sem = asyncio.Semaphore(_PHOTO_WORKERS)
+
+                _ul_proxy = type("_Proxy", (), {
+                    "add_downloaded": staticmethod(lambda n: None),
+                    "add_uploaded": staticmethod(_batch_add_ul),
+                })()
+
+                async def _upload_one_photo(entry):
+                    async with _sem:
+                        if is_cancelled(user_id):
+                            return None
+
+                        # Use size limit check for extracted photos
+                        if entry.size > size_limit:
+                            logger.warning(f"[DirectArchive] Skipping oversized photo: {entry.name} ({_human_bytes(entry.size)})")
+                            return None
+
+                        _bmid = None
+                        for _att in range(1, MAX_RETRIES + 1):
+                            streamer = FileStreamer(
+                                entry.path, entry.name,
+                                on_download_chunk=_batch_add_dl,
+                            )
+                            _bmid, _is_sent_to_bot = await _upload_file_to_backup(
+                                bot, None, backup_peer, streamer,
+                                entry.name, entry.size,
+                                tracker=_ul_proxy,
+                            )
+                            if _bmid:
+                                break
+                            if _att < MAX_RETRIES:
+                                await asyncio.sleep(1)
 
-            if is_cancelled(user_id):
-                await safe_edit(status_msg, "🚫 **Proses dibatalkan!**\n\n💾 Folder sementara sedang dibersihkan...")
-                return
-
-            if mf["kind"] == "photo":
-                _photo_batch.append(mf)
-                if len(_photo_batch) >= _PHOTO_BATCH:
-                    await _flush_photo_batch()
-            else:
-                await _flush_photo_batch()
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
 
-                if mf["size"] > size_limit:
-                    print(f"[DirectArchive] Skipping oversized file: {mf['name']} ({_human_bytes(mf['size'])})")
-                    try:
-                        os.remove(mf["path"])
-                    except OSError:
-                        pass
-                    continue
+                        _batch_state["done"] += 1
+                        await asyncio.sleep(0.3)
+                        if _bmid:
+                            return (_bmid, entry.kind, entry.name, entry.size)
+                        return None
 
-                thumb_raw = None
-                video_meta = None
-                if mf["kind"] == "video":
-                    thumb_raw = await _generate_video_thumb(mf["path"])
-                    video_meta = await _get_video_metadata(mf["path"])
-
-                tracker = ProgressTracker(
-                    status_msg=status_msg,
-                    file_name=mf["name"],
-                    file_size=mf["size"],
-                    file_index=idx,
-                    file_total=total_files,
+                results = await asyncio.gather(
+                    *[_upload_one_photo(e) for e in batch],
+                    return_exceptions=True,
                 )
-                tracker.start()
+                for r in results:
+                    if isinstance(r, Exception):
+                        logger.error("[DirectArchive] Photo batch exception: %s", r, exc_info=r)
+                        continue
+                    if r:
+                        uploaded.append(r)
 
-                bmid = None
-                for attempt in range(1, MAX_RETRIES + 1):
-                    streamer = FileStreamer(
-                        mf["path"], mf["name"],
-                        on_download_chunk=tracker.add_downloaded,
-                    )
-                    bmid, _is_sent_to_bot = await _upload_file_to_backup(
-                        bot, None, backup_peer, streamer,
-                        mf["name"], mf["size"],
-                        tracker=tracker,
-                        thumb_raw=thumb_raw,
-                        video_meta=video_meta,
-                    )
-                    if bmid:
-                        break
-                    if attempt < MAX_RETRIES:
-                        tracker.downloaded = 0
-                        tracker.uploaded = 0
-                        tracker._dl_samples.clear()
-                        tracker._ul_samples.clear()
-                        await asyncio.sleep(3)
+            def _start_probe(mf: ExtractedMedia):
+                # Probe upcoming videos while the current file uploads
+                if mf.kind == "video" and mf.size <= size_limit:
+                    return probe_and_thumb(mf.path)
+                return None
 
-                await tracker.stop()
+            async with aclosing(prefetch_media(media_files, _start_probe)) as items:
+                async for mf, probe in items:
+                    idx += 1
 
-                if bmid:
-                    uploaded.append((bmid, mf["kind"], mf["name"], mf["size"]))
+                    if is_cancelled(user_id):
+                        await safe_edit(status_msg, "🚫 **Proses dibatalkan!**\n\n💾 Folder sementara sedang dibersihkan...")
+                        return
+
+                    if mf.kind == "photo":
+                        _photo_batch.append(mf)
+                        if len(_photo_batch) >= _PHOTO_BATCH:
+                            await _flush_photo_batch()
+                    else:
+                        await _flush_photo_batch()
+
+                        if mf.size > size_limit:
+                            logger.warning(f"[DirectArchive] Skipping oversized file: {mf.name} ({_human_bytes(mf.size)})")
+                            try:
+                                os.remove(mf.path)
+                            except OSError:
+                                pass
+                            continue
+
+                        thumb_raw = None
+                        video_meta = None
+                        if probe is not None:
+                            thumb_raw, video_meta = await probe
+
+                        tracker = ProgressTracker(
+                            status_msg=status_msg,
+                            file_name=mf.name,
+                            file_size=mf.size,
+                            file_index=idx,
+                            file_total=total_files,
+                        )
+                        tracker.start()
+
+                        bmid = None
+                        for attempt in range(1, MAX_RETRIES + 1):
+                            streamer = FileStreamer(
+                                mf.path, mf.name,
+                                on_download_chunk=tracker.add_downloaded,
+                            )
+                            bmid, _is_sent_to_bot = await _upload_file_to_backup(
+                                bot, None, backup_peer, streamer,
+                                mf.name, mf.size,
+                                tracker=tracker,
+                                thumb_raw=thumb_raw,
+                                video_meta=video_meta,
+                            )
+                            if bmid:
+                                break
+                            if attempt < MAX_RETRIES:
+                                tracker.downloaded = 0
+                                tracker.uploaded = 0
+                                tracker._dl_samples.clear()
+                                tracker._ul_samples.clear()
+                                await asyncio.sleep(3)
+
+                        await tracker.stop()
+
+                        if bmid:
+                            uploaded.append((bmid, mf.kind, mf.name, mf.size))
                 
-                try:
-                    os.remove(mf["path"])
-                except OSError:
-                    pass
-                gc.collect()
+                        try:
+                            os.remove(mf.path)
+                        except OSError:
+                            pass
 
-                if idx < total_files:
-                    await asyncio.sleep(2)
+                        if idx < total_files:
+                            await asyncio.sleep(2)
 
         await _flush_photo_batch()
 
@@ -1168,7 +1185,7 @@ async def direct_link_handler(bot: Client, message: Message) -> None:
         return
 
     # Check if user is logged in
-    user_session = await get_user_session(user_id)
+    user_session = await get_cached_user_session(user_id)
     if not user_session:
         await message.reply_text("❌ Belum login. Sila /start untuk login.")
         return
@@ -1179,7 +1196,7 @@ async def direct_link_handler(bot: Client, message: Message) -> None:
         return
 
     # Check if user has completed profile setup
-    user_profile = await get_user_profile(user_id)
+    user_profile = await get_cached_user_profile(user_id)
     if not user_profile:
         await message.reply_text(
             "⚠️ **Profile belum lengkap!**\n\n"
@@ -1369,8 +1386,7 @@ async def direct_link_handler(bot: Client, message: Message) -> None:
         if delivered:
             # Log the upload
             try:
-                channel_id_str = str(BACKUP_GROUP_ID).replace("-100", "")
-                link = f"https://t.me/c/{channel_id_str}/{msg_id}" if not is_sent_to_bot else None
+                link = f"https://t.me/c/{BACKUP_CHANNEL_ID_STR}/{msg_id}" if not is_sent_to_bot else None
                 await log_forward(
                     message.from_user.username or "Unknown",
                     msg_id,
@@ -1403,9 +1419,7 @@ async def direct_link_handler(bot: Client, message: Message) -> None:
         else:
             await safe_edit(status_msg, "❌ Sesi anda telah tamat. Sila /start dan login semula.")
     except Exception as e:
-        print(f"[DirectLink] Handler error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[DirectLink] Handler error")
         if tracker:
             await tracker.stop(f"❌ Ralat: {e}")
         else:
@@ -1,76 +1,102 @@
 """
 mediafire/archive.py — Extract media files from ZIP / RAR archives.
 
-Runs the blocking extraction in ``asyncio.run_in_executor()`` so the
-event loop is never blocked.
+Runs the blocking extraction in ``asyncio.run_in_executor()`` on a
+dedicated thread pool so the event loop is never blocked and archive work
+doesn't queue behind other blocking calls in the default executor.
 
 Only photos and videos (per ``app.utils.media.MEDIA_EXTS``) are
 extracted; everything else is skipped.
 
-Memory-efficient: supports both batch extraction (legacy) and one-at-a-time
-yielding to keep disk/memory usage minimal on low-RAM VPS instances.
+Memory-efficient: entries are extracted and yielded one at a time to keep
+disk/memory usage minimal on low-RAM VPS instances.
 """
 from __future__ import annotations
 
 import asyncio
+import io
 import os
 import re
+import struct
+import threading
 import zipfile
-from typing import AsyncIterator, Dict, List
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
 
-from app.utils.media import MEDIA_EXTS, VIDEO_EXTS, ext, classify
+from app.config import PARALLEL_DEFLATE
+from app.utils.media import MEDIA_EXTS, VIDEO_EXTS, classify
 
-# Try to import rarfile — graceful fallback if not installed
-try:
-    import rarfile
+# rarfile is imported on first RAR use, so ZIP-only work never pays for it.
+# None = not tried yet, False = not installed.
+_rarfile_mod = None
 
-    _HAS_RAR = True
-except ImportError:
-    _HAS_RAR = False
 
+def _rarfile():
+    """Return the ``rarfile`` module, or None if it isn't installed."""
+    global _rarfile_mod
+    if _rarfile_mod is None:
+        try:
+            import rarfile
+            _rarfile_mod = rarfile
+        except ImportError:
+            _rarfile_mod = False
+    return _rarfile_mod or None
 
-def _natural_sort_key(s: str) -> list:
-    """Helper to ensure natural sorting (e.g. 2.mp4 before 10.mp4)."""
-    return [int(text) if text.isdigit() else text.lower()
-            for text in re.split(r'(\d+)', s)]
 
+# libdeflate bindings (the ``deflate`` package), loaded the same way.
+_deflate_mod = None
 
-# ---------------------------------------------------------------------------
-# Public API — batch (legacy, still used for small archives)
-# ---------------------------------------------------------------------------
 
+def _deflate():
+    """Return the ``deflate`` module, or None if it isn't installed."""
+    global _deflate_mod
+    if _deflate_mod is None:
+        try:
+            import deflate
+            _deflate_mod = deflate
+        except ImportError:
+            _deflate_mod = False
+    return _deflate_mod or None
 
-async def extract_media_from_archive(
-    archive_path: str,
-    dest_dir: str,
-) -> List[Dict[str, object]]:
-    """
-    Extract only media files (photos + videos) from *archive_path* into
-    *dest_dir*.  Returns a list of dicts::
 
-        [{"name": "photo.jpg", "size": 123456, "path": "/tmp/.../photo.jpg",
-          "kind": "photo"}, ...]
+# rapidgzip (parallel DEFLATE decoder), loaded the same way.
+_rapidgzip_mod = None
 
-    The extraction is performed in a thread-pool executor.
 
-    Raises
-    ------
-    ValueError
-        If the archive format is unsupported or the archive is corrupted.
-    """
-    lower = archive_path.lower()
+def _rapidgzip():
+    """Return the ``rapidgzip`` module, or None if it isn't installed."""
+    global _rapidgzip_mod
+    if _rapidgzip_mod is None:
+        try:
+            import rapidgzip
+            _rapidgzip_mod = rapidgzip
+        except ImportError:
+            _rapidgzip_mod = False
+    return _rapidgzip_mod or None
 
-    if lower.endswith(".zip"):
-        return await _extract_zip(archive_path, dest_dir)
-    elif lower.endswith(".rar"):
-        if not _HAS_RAR:
-            raise ValueError(
-                "Sokongan RAR tidak tersedia — sila pasang `rarfile` dan "
-                "binary `unrar` pada pelayan."
-            )
-        return await _extract_rar(archive_path, dest_dir)
-    else:
-        raise ValueError(f"Format arkib tidak disokong: {os.path.basename(archive_path)}")
+
+# Decompression (zlib, unrar subprocess) runs outside the GIL, so threads
+# scale across cores here; a process pool couldn't share open archive handles.
+_ARCHIVE_POOL = ThreadPoolExecutor(
+    max_workers=max(2, os.cpu_count() or 1), thread_name_prefix="archive"
+)
+
+
+@dataclass(slots=True, frozen=True)
+class ExtractedMedia:
+    """A media file extracted from an archive to *path*."""
+    name: str
+    size: int
+    path: str
+    kind: str  # "photo" or "video", per app.utils.media.classify
+
+
+def _natural_sort_key(s: str) -> list:
+    """Helper to ensure natural sorting (e.g. 2.mp4 before 10.mp4)."""
+    return [int(text) if text.isdigit() else text.lower()
+            for text in re.split(r'(\d+)', s)]
 
 
 # ---------------------------------------------------------------------------
@@ -85,24 +111,13 @@ def count_media_in_archive(archive_path: str, skip_non_video: bool = False) -> i
     """
     lower = archive_path.lower()
     count = 0
-    filter_exts = VIDEO_EXTS if skip_non_video else MEDIA_EXTS
     try:
         if lower.endswith(".zip"):
             with zipfile.ZipFile(archive_path, "r") as zf:
-                for info in zf.infolist():
-                    if info.is_dir():
-                        continue
-                    basename = os.path.basename(info.filename)
-                    if basename and ext(basename) in filter_exts:
-                        count += 1
-        elif lower.endswith(".rar") and _HAS_RAR:
-            with rarfile.RarFile(archive_path, "r") as rf:
-                for info in rf.infolist():
-                    if info.is_dir():
-                        continue
-                    basename = os.path.basename(info.filename)
-                    if basename and ext(basename) in filter_exts:
-                        count += 1
+                count = sum(1 for _ in _iter_media_infos(zf, skip_non_video))
+        elif lower.endswith(".rar") and _rarfile() is not None:
+            with _rarfile().RarFile(archive_path, "r") as rf:
+                count = sum(1 for _ in _iter_media_infos(rf, skip_non_video))
     except Exception:
         pass
     return count
@@ -112,11 +127,11 @@ async def iter_extract_media(
     archive_path: str,
     dest_dir: str,
     skip_non_video: bool = False,
-) -> AsyncIterator[Dict[str, object]]:
+) -> AsyncIterator[ExtractedMedia]:
     """
     Async generator that extracts media files from an archive ONE AT A TIME.
 
-    Yields dicts identical to ``extract_media_from_archive`` entries.
+    Yields ``ExtractedMedia`` items (name, size, path, kind).
     The caller should delete each file after uploading to keep disk usage low.
 
     This avoids extracting all files at once, which would consume too much
@@ -128,7 +143,7 @@ async def iter_extract_media(
         async for item in _iter_extract_zip(archive_path, dest_dir, skip_non_video):
             yield item
     elif lower.endswith(".rar"):
-        if not _HAS_RAR:
+        if _rarfile() is None:
             raise ValueError(
                 "Sokongan RAR tidak tersedia — sila pasang `rarfile` dan "
                 "binary `unrar` pada pelayan."
@@ -139,236 +154,477 @@ async def iter_extract_media(
         raise ValueError(f"Format arkib tidak disokong: {os.path.basename(archive_path)}")
 
 
-# ---------------------------------------------------------------------------
-# Iterative ZIP extraction (one file at a time)
-# ---------------------------------------------------------------------------
-
+async def scan_and_extract(
+    archive_path: str,
+    dest_dir: str,
+    skip_non_video: bool = False,
+) -> Tuple[int, AsyncIterator[ExtractedMedia]]:
+    """
+    Scan the archive once and return ``(count, iterator)``.
+
+    *count* is what ``count_media_in_archive`` would return and *iterator*
+    yields the same items as ``iter_extract_media``, reusing the archive
+    handle and entry list from the scan instead of reading the directory
+    again. Like ``count_media_in_archive``, an unreadable or unsupported
+    archive counts as empty.
+
+    *iterator* holds the archive open from the moment it is returned, even
+    before iteration starts, so callers must close it, e.g. with
+    ``async with contextlib.aclosing(iterator):``, in case they return or
+    break early.
+    """
+    lower = archive_path.lower()
+    if lower.endswith(".zip"):
+        opener = zipfile.ZipFile
+    elif lower.endswith(".rar") and _rarfile() is not None:
+        opener = _rarfile().RarFile
+    else:
+        return 0, ArchiveMedia(None, [], dest_dir)
 
-async def _iter_extract_zip(
-    archive_path: str, dest_dir: str, skip_non_video: bool = False
-) -> AsyncIterator[Dict[str, object]]:
     loop = asyncio.get_running_loop()
-    # Get the list of media entries first (metadata only, no extraction)
-    entries = await loop.run_in_executor(
-        None, _list_zip_media_entries, archive_path, skip_non_video
-    )
-    seen_names: Dict[str, int] = {}
-    for entry_name in entries:
-        basename = os.path.basename(entry_name)
-        safe_name = _unique_name(basename, seen_names)
-        out_path = os.path.join(dest_dir, safe_name)
-        # Extract just this one file
-        await loop.run_in_executor(
-            None, _extract_single_zip_entry, archive_path, entry_name, out_path
+    archive = None
+    try:
+        archive = await loop.run_in_executor(_ARCHIVE_POOL, opener, archive_path, "r")
+        entries = await loop.run_in_executor(
+            _ARCHIVE_POOL, _list_media_entries, archive, skip_non_video
         )
-        file_size = os.path.getsize(out_path)
-        yield {
-            "name": safe_name,
-            "size": file_size,
-            "path": out_path,
-            "kind": classify(safe_name),
-        }
-
-
-def _list_zip_media_entries(archive_path: str, skip_non_video: bool = False) -> List[str]:
-    """Return entry names of media files inside a ZIP (no extraction)."""
-    entries = []
-    filter_exts = VIDEO_EXTS if skip_non_video else MEDIA_EXTS
-    with zipfile.ZipFile(archive_path, "r") as zf:
-        for info in zf.infolist():
-            if info.is_dir():
-                continue
-            basename = os.path.basename(info.filename)
-            if basename and ext(basename) in filter_exts:
-                entries.append(info.filename)
-    
-    # Sort files naturally by their name (e.g. 2_before_10)
-    entries.sort(key=lambda x: _natural_sort_key(os.path.basename(x)))
-    return entries
+    except Exception:
+        if archive is not None:
+            archive.close()
+        return 0, ArchiveMedia(None, [], dest_dir)
 
+    if not entries:
+        archive.close()
+        return 0, ArchiveMedia(None, [], dest_dir)
+    return len(entries), ArchiveMedia(archive, entries, dest_dir)
 
-def _extract_single_zip_entry(
-    archive_path: str, entry_name: str, out_path: str
-) -> None:
-    """Extract a single entry from a ZIP to out_path, streaming in chunks."""
-    with zipfile.ZipFile(archive_path, "r") as zf:
-        with zf.open(entry_name) as src, open(out_path, "wb") as dst:
-            while True:
-                chunk = src.read(2 * 1024 * 1024)
-                if not chunk:
-                    break
-                dst.write(chunk)
+
+async def prefetch_media(
+    media_files: AsyncIterator[ExtractedMedia],
+    prepare: Callable[[ExtractedMedia], Optional[Awaitable[Any]]],
+    ahead: int = 2,
+) -> AsyncIterator[Tuple[ExtractedMedia, Optional[asyncio.Task]]]:
+    """
+    Yield ``(media, task)`` from *media_files*, extracting up to *ahead* + 1
+    entries in advance and starting ``prepare(media)`` (e.g. an ffmpeg probe)
+    for each as a task, so that work overlaps the caller's upload of the
+    current entry. *task* is None when *prepare* returns None.
+
+    *ahead* bounds how many extracted files wait on disk at once. When
+    iteration stops, the producer and any queued tasks are cancelled and
+    awaited, so nothing is still writing under the destination directory
+    once ``aclose()`` returns. Callers should therefore iterate inside
+    ``async with contextlib.aclosing(prefetch_media(...))`` before removing
+    that directory.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=ahead)
+    done = object()
+    held: list = []  # task started but not yet queued
+
+    async def _produce() -> None:
+        try:
+            async for media in media_files:
+                work = prepare(media)
+                task = asyncio.ensure_future(work) if work is not None else None
+                if task is not None:
+                    held.append(task)
+                await queue.put((media, task))
+                held.clear()
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(done)
+
+    producer = asyncio.create_task(_produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+        pending = []
+        for task in held:
+            task.cancel()
+            pending.append(task)
+        while not queue.empty():
+            item = queue.get_nowait()
+            if isinstance(item, tuple) and item[1] is not None:
+                item[1].cancel()
+                pending.append(item[1])
+        await asyncio.gather(*pending, return_exceptions=True)
 
 
 # ---------------------------------------------------------------------------
-# Iterative RAR extraction (one file at a time)
+# Iterative extraction (one file at a time)
 # ---------------------------------------------------------------------------
 
 
+async def _iter_extract_zip(
+    archive_path: str, dest_dir: str, skip_non_video: bool = False
+) -> AsyncIterator[ExtractedMedia]:
+    loop = asyncio.get_running_loop()
+    # Parse the central directory once and keep the archive open for every entry
+    zf = await loop.run_in_executor(_ARCHIVE_POOL, zipfile.ZipFile, archive_path, "r")
+    try:
+        async for item in _iter_extract_entries(zf, dest_dir, skip_non_video):
+            yield item
+    finally:
+        zf.close()
+
+
 async def _iter_extract_rar(
     archive_path: str, dest_dir: str, skip_non_video: bool = False
-) -> AsyncIterator[Dict[str, object]]:
+) -> AsyncIterator[ExtractedMedia]:
     loop = asyncio.get_running_loop()
-    entries = await loop.run_in_executor(
-        None, _list_rar_media_entries, archive_path, skip_non_video
-    )
-    seen_names: Dict[str, int] = {}
-    for entry_name in entries:
-        basename = os.path.basename(entry_name)
+    rf = await loop.run_in_executor(_ARCHIVE_POOL, _rarfile().RarFile, archive_path, "r")
+    try:
+        async for item in _iter_extract_entries(rf, dest_dir, skip_non_video):
+            yield item
+    finally:
+        rf.close()
+
+
+async def _iter_extract_entries(
+    archive, dest_dir: str, skip_non_video: bool = False
+) -> AsyncIterator[ExtractedMedia]:
+    """Extract media entries of an open ZipFile/RarFile one by one."""
+    entries = _list_media_entries(archive, skip_non_video)
+    async for item in _extract_listed_entries(archive, entries, dest_dir):
+        yield item
+
+
+class ArchiveMedia:
+    """
+    Async iterator over already-listed entries of an open ZipFile/RarFile
+    that owns the archive: it is closed when iteration ends or on
+    ``aclose()``, which, unlike an async generator's, also works before the
+    first item.
+    """
+
+    def __init__(self, archive, entries: list, dest_dir: str) -> None:
+        self._archive = archive
+        self._items = _extract_listed_entries(archive, entries, dest_dir)
+
+    def __aiter__(self) -> "ArchiveMedia":
+        return self
+
+    async def __anext__(self) -> ExtractedMedia:
+        try:
+            return await self._items.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self) -> None:
+        try:
+            await self._items.aclose()
+        finally:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+
+
+async def _extract_listed_entries(
+    archive, entries: list, dest_dir: str
+) -> AsyncIterator[ExtractedMedia]:
+    """Extract already-listed *entries* of an open ZipFile/RarFile one by one."""
+    loop = asyncio.get_running_loop()
+    seen_names: Dict[str, Tuple[int, str, str]] = {}
+    for basename, info in entries:
         safe_name = _unique_name(basename, seen_names)
         out_path = os.path.join(dest_dir, safe_name)
-        await loop.run_in_executor(
-            None, _extract_single_rar_entry, archive_path, entry_name, out_path
+        # Extract just this one file
+        extraction = loop.run_in_executor(
+            _ARCHIVE_POOL, _extract_single_entry, archive, info, out_path
         )
-        file_size = os.path.getsize(out_path)
-        yield {
-            "name": safe_name,
-            "size": file_size,
-            "path": out_path,
-            "kind": classify(safe_name),
-        }
-
-
-def _list_rar_media_entries(archive_path: str, skip_non_video: bool = False) -> List[str]:
-    """Return entry names of media files inside a RAR (no extraction)."""
-    entries = []
+        try:
+            file_size = await asyncio.shield(extraction)
+        except asyncio.CancelledError:
+            # The worker thread can't be interrupted: let it finish before
+            # the caller closes the archive or removes dest_dir, then drop
+            # the file it wrote
+            await asyncio.wait([extraction])
+            try:
+                os.remove(out_path)
+            except OSError:
+                pass
+            raise
+        yield ExtractedMedia(safe_name, file_size, out_path, classify(safe_name))
+
+
+def _iter_media_infos(archive, skip_non_video: bool = False):
+    """Yield ``(basename, info)`` for media files of an open ZipFile/RarFile, in archive order."""
     filter_exts = VIDEO_EXTS if skip_non_video else MEDIA_EXTS
-    with rarfile.RarFile(archive_path, "r") as rf:
-        for info in rf.infolist():
-            if info.is_dir():
-                continue
-            basename = os.path.basename(info.filename)
-            if basename and ext(basename) in filter_exts:
-                entries.append(info.filename)
-    
+    _basename = os.path.basename
+    for info in archive.infolist():
+        filename = info.filename
+        # macOS resource forks (__MACOSX/._photo.jpg) carry media extensions but aren't media
+        if filename.startswith("__MACOSX/") or info.is_dir():
+            continue
+        basename = _basename(filename)
+        # Inline ext(): no splitext call per entry. i > 0 keeps splitext's
+        # rule that a leading dot (".mp4") is a hidden name, not an extension.
+        i = basename.rfind(".")
+        if i > 0 and basename[i:].lower() in filter_exts:
+            yield basename, info
+
+
+def _list_media_entries(archive, skip_non_video: bool = False) -> list:
+    """Return ``(basename, info)`` for media files of an open ZipFile/RarFile (no extraction)."""
+    entries = list(_iter_media_infos(archive, skip_non_video))
     # Sort files naturally by their name (e.g. 2_before_10)
-    entries.sort(key=lambda x: _natural_sort_key(os.path.basename(x)))
+    entries.sort(key=lambda entry: _natural_sort_key(entry[0]))
     return entries
 
 
-def _extract_single_rar_entry(
-    archive_path: str, entry_name: str, out_path: str
-) -> None:
-    """Extract a single entry from a RAR to out_path, streaming in chunks."""
-    with rarfile.RarFile(archive_path, "r") as rf:
-        with rf.open(entry_name) as src, open(out_path, "wb") as dst:
-            while True:
-                chunk = src.read(2 * 1024 * 1024)
-                if not chunk:
-                    break
-                dst.write(chunk)
-
-
-# ---------------------------------------------------------------------------
-# ZIP batch extraction (legacy — kept for compatibility)
-# ---------------------------------------------------------------------------
-
+# Below this, reserving space up front costs more than it saves
+_PREALLOCATE_MIN = 1 << 20
 
-async def _extract_zip(archive_path: str, dest_dir: str) -> List[Dict[str, object]]:
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _sync_extract_zip, archive_path, dest_dir)
 
+# libdeflate inflates a member in one call, so the whole member (compressed
+# and inflated) is held in memory. Capped low for small VPS instances; most
+# members above this are already-compressed videos stored without DEFLATE.
+_LIBDEFLATE_MAX = 16 << 20
 
-def _sync_extract_zip(archive_path: str, dest_dir: str) -> List[Dict[str, object]]:
-    results: List[Dict[str, object]] = []
-    seen_names: Dict[str, int] = {}
+# PK\x03\x04 local file header: 30 fixed bytes, name/extra lengths at 26
+_ZIP_LOCAL_HEADER_SIZE = 30
 
-    with zipfile.ZipFile(archive_path, "r") as zf:
-        # Sort in-memory list naturally by basename
-        infolist = sorted(zf.infolist(), key=lambda info: _natural_sort_key(os.path.basename(info.filename)))
-        for info in infolist:
-            # Skip directories
-            if info.is_dir():
-                continue
 
-            # Only extract media files
-            basename = os.path.basename(info.filename)
-            if not basename or ext(basename) not in MEDIA_EXTS:
-                continue
+def _zip_data_offset(fp, info: zipfile.ZipInfo):
+    """Return where *info*'s compressed bytes start in *fp*, or None if the local header is bad."""
+    fp.seek(info.header_offset)
+    header = fp.read(_ZIP_LOCAL_HEADER_SIZE)
+    if len(header) != _ZIP_LOCAL_HEADER_SIZE or header[:4] != b"PK\x03\x04":
+        return None
+    name_len, extra_len = struct.unpack_from("<HH", header, 26)
+    return info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_len + extra_len
 
-            # Handle duplicate names
-            safe_name = _unique_name(basename, seen_names)
-            out_path = os.path.join(dest_dir, safe_name)
 
-            # Extract the single member
-            with zf.open(info) as src, open(out_path, "wb") as dst:
-                while True:
-                    chunk = src.read(2 * 1024 * 1024)
-                    if not chunk:
-                        break
-                    dst.write(chunk)
+def _inflate_zip_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo):
+    """
+    Inflate a small DEFLATE member with libdeflate. Returns the data, or
+    None when the fast path doesn't apply and ``zf.open`` should be used.
 
-            file_size = os.path.getsize(out_path)
-            results.append({
-                "name": safe_name,
-                "size": file_size,
-                "path": out_path,
-                "kind": classify(safe_name),
-            })
+    Reads ``zf.fp`` directly, so *zf* must not be in use by another thread
+    (each extraction worker here opens its own ZipFile).
+    """
+    deflate = _deflate()
+    if (
+        deflate is None
+        or info.compress_type != zipfile.ZIP_DEFLATED
+        or info.flag_bits & 0x1  # encrypted
+        or info.file_size > _LIBDEFLATE_MAX
+    ):
+        return None
+    fp = zf.fp
+    offset = _zip_data_offset(fp, info)
+    if offset is None:
+        return None
+    fp.seek(offset)
+    raw = fp.read(info.compress_size)
+    try:
+        data = deflate.deflate_decompress(raw, info.file_size)
+    except deflate.DeflateError:
+        return None
+    # zf.open() checks the CRC; keep that guarantee
+    if zlib.crc32(data) != info.CRC:
+        raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+    return data
+
+
+# Members at least this large may be inflated by rapidgzip, which splits one
+# DEFLATE stream across all cores. Opt-in (PARALLEL_DEFLATE) since it runs a
+# decoder thread per core on top of the archive pool.
+_PARALLEL_DEFLATE_MIN = 512 << 20
+
+
+class _ZipMemberRaw(io.RawIOBase):
+    """Seekable read-only view of one ZIP member's compressed bytes."""
+
+    def __init__(self, path: str, start: int, length: int) -> None:
+        super().__init__()
+        self._f = open(path, "rb", buffering=0)
+        self._start = start
+        self._length = length
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = min(len(b), self._length - self._pos)
+        if n <= 0:
+            return 0
+        self._f.seek(self._start + self._pos)
+        n = self._f.readinto(memoryview(b)[:n])
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        self._f.close()
+        super().close()
+
+
+def _inflate_zip_member_parallel(zf: zipfile.ZipFile, info: zipfile.ZipInfo, out_path: str):
+    """
+    Inflate a giant DEFLATE member to *out_path* with rapidgzip. Returns the
+    number of bytes written, or None when the path doesn't apply.
+    """
+    rapidgzip = _rapidgzip() if PARALLEL_DEFLATE else None
+    if (
+        rapidgzip is None
+        or info.compress_type != zipfile.ZIP_DEFLATED
+        or info.flag_bits & 0x1  # encrypted
+        or info.file_size < _PARALLEL_DEFLATE_MIN
+        or not zf.filename
+    ):
+        return None
+    # Own file handles, so rapidgzip's reader threads never touch zf.fp
+    with open(zf.filename, "rb") as fp:
+        offset = _zip_data_offset(fp, info)
+    if offset is None:
+        return None
+
+    crc = 0
+    view = memoryview(bytearray(_COPY_CHUNK))
+    with _ZipMemberRaw(zf.filename, offset, info.compress_size) as raw, \
+            rapidgzip.RapidgzipFile(raw, parallelization=os.cpu_count() or 1) as src, \
+            open(out_path, "wb") as dst:
+        while True:
+            n = src.readinto(view)
+            if not n:
+                break
+            crc = zlib.crc32(view[:n], crc)
+            dst.write(view[:n])
+        written = dst.tell()
+    if crc != info.CRC:
+        raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+    return written
+
+
+def _copy_stored_zip_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo, out_path: str):
+    """
+    Copy a STORED (uncompressed) member to *out_path* with ``os.sendfile``,
+    so the bytes never pass through Python. Returns the number of bytes
+    written, or None when the path doesn't apply.
 
-    return results
+    The CRC isn't checked here: doing so would mean reading the data back
+    into user space, which is the copy this path exists to avoid.
+    """
+    if (
+        not hasattr(os, "sendfile")
+        or info.compress_type != zipfile.ZIP_STORED
+        or info.flag_bits & 0x1  # encrypted
+        or not zf.filename
+    ):
+        return None
+    with open(zf.filename, "rb", buffering=0) as src:
+        offset = _zip_data_offset(src, info)
+        if offset is None:
+            return None
+        with open(out_path, "wb") as dst:
+            in_fd, out_fd = src.fileno(), dst.fileno()
+            written, remaining = 0, info.file_size
+            while remaining:
+                n = os.sendfile(out_fd, in_fd, offset + written, remaining)
+                if not n:
+                    raise zipfile.BadZipFile(f"Truncated file {info.filename!r}")
+                written += n
+                remaining -= n
+    return written
+
+
+def _extract_single_entry(archive, info, out_path: str) -> int:
+    """
+    Extract a single entry of an open ZipFile/RarFile to out_path, streaming
+    in chunks. Returns the number of bytes written.
+    """
+    if isinstance(archive, zipfile.ZipFile):
+        written = _copy_stored_zip_member(archive, info, out_path)
+        if written is not None:
+            return written
+        data = _inflate_zip_member(archive, info)
+        if data is not None:
+            with open(out_path, "wb") as dst:
+                return dst.write(data)
+        written = _inflate_zip_member_parallel(archive, info, out_path)
+        if written is not None:
+            return written
+
+    with archive.open(info) as src, open(out_path, "wb") as dst:
+        size = getattr(info, "file_size", 0) or 0
+        if size > _PREALLOCATE_MIN and hasattr(os, "posix_fallocate"):
+            # Reserve the extents in one go instead of growing per chunk
+            try:
+                os.posix_fallocate(dst.fileno(), 0, size)
+            except OSError:
+                pass
+        _copy_stream(src, dst)
+        # Drop any reserved tail if the entry was shorter than declared
+        return dst.truncate()
 
 
 # ---------------------------------------------------------------------------
-# RAR extraction
+# Helpers
 # ---------------------------------------------------------------------------
 
 
-async def _extract_rar(archive_path: str, dest_dir: str) -> List[Dict[str, object]]:
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _sync_extract_rar, archive_path, dest_dir)
-
-
-def _sync_extract_rar(archive_path: str, dest_dir: str) -> List[Dict[str, object]]:
-    results: List[Dict[str, object]] = []
-    seen_names: Dict[str, int] = {}
-
-    with rarfile.RarFile(archive_path, "r") as rf:
-        # Sort in-memory list naturally by basename
-        infolist = sorted(rf.infolist(), key=lambda info: _natural_sort_key(os.path.basename(info.filename)))
-        for info in infolist:
-            if info.is_dir():
-                continue
-
-            basename = os.path.basename(info.filename)
-            if not basename or ext(basename) not in MEDIA_EXTS:
-                continue
-
-            safe_name = _unique_name(basename, seen_names)
-            out_path = os.path.join(dest_dir, safe_name)
+# Copy buffer, one per executor thread so concurrent extractions don't share it
+_COPY_CHUNK = 2 * 1024 * 1024
+_copy_buffers = threading.local()
 
-            with rf.open(info) as src, open(out_path, "wb") as dst:
-                while True:
-                    chunk = src.read(2 * 1024 * 1024)
-                    if not chunk:
-                        break
-                    dst.write(chunk)
 
-            file_size = os.path.getsize(out_path)
-            results.append({
-                "name": safe_name,
-                "size": file_size,
-                "path": out_path,
-                "kind": classify(safe_name),
-            })
-
-    return results
-
-
-# ---------------------------------------------------------------------------
-# Helpers
-# ---------------------------------------------------------------------------
+def _copy_stream(src, dst) -> None:
+    """Copy *src* to *dst* through a reused per-thread buffer."""
+    view = getattr(_copy_buffers, "view", None)
+    if view is None:
+        view = _copy_buffers.view = memoryview(bytearray(_COPY_CHUNK))
+    while True:
+        n = src.readinto(view)
+        if not n:
+            break
+        dst.write(view[:n])
 
 
-def _unique_name(name: str, seen: Dict[str, int]) -> str:
+def _unique_name(name: str, seen: Dict[str, Tuple[int, str, str]]) -> str:
     """
     Return *name* if not seen before, otherwise append a counter
-    (e.g. ``photo_2.jpg``).
+    (e.g. ``photo_2.jpg``). Generated names are recorded too, so a later
+    entry really called ``photo_2.jpg`` doesn't overwrite the renamed one.
     """
-    if name not in seen:
-        seen[name] = 1
+    entry = seen.get(name)
+    if entry is None:
+        # Fast path: the split is only needed once the name collides
+        seen[name] = (1, "", "")
         return name
 
-    seen[name] += 1
-    base, extension = os.path.splitext(name)
-    return f"{base}_{seen[name]}{extension}"
+    count, base, extension = entry
+    if count == 1:
+        base, extension = os.path.splitext(name)
+    while True:
+        count += 1
+        candidate = f"{base}_{count}{extension}"
+        if candidate not in seen:
+            break
+    seen[name] = (count, base, extension)
+    seen[candidate] = (1, "", "")
+    return candidate
@@ -10,8 +10,13 @@ Reference: https://github.com/Locon213/gopeed-extension-mediafire
 """
 from __future__ import annotations
 
+import asyncio
+import codecs
+import os
 import re
-from typing import AsyncGenerator, Dict, Optional
+import time
+from typing import AsyncGenerator, Callable, Dict, Optional
+from urllib.parse import unquote, urlparse
 
 import aiohttp
 
@@ -28,8 +33,12 @@ _USER_AGENT = (
 # Primary regex: matches the CDN direct-download URL on the page
 _DIRECT_URL_RE = re.compile(r'https://download\d+\.mediafire\.com/[^"\'<>\s]+')
 
-# Fallback: look for any href containing "download"
-_FALLBACK_URL_RE = re.compile(r'href="([^"]*download[^"]*)"', re.IGNORECASE)
+# Primary and fallback (any href containing "download") fused, so a page
+# without a CDN URL is scanned once instead of twice
+_PAGE_URL_RE = re.compile(
+    r'(?P<direct>https://download\d+\.mediafire\.com/[^"\'<>\s]+)'
+    r'|(?i:href="(?P<fallback>[^"]*download[^"]*)")'
+)
 
 # Title extraction (filename is in <title>TEXT | MediaFire</title>)
 _TITLE_RE = re.compile(r"<title>([^<]+)</title>", re.IGNORECASE)
@@ -40,6 +49,44 @@ _TIMEOUT = aiohttp.ClientTimeout(total=30)
 # Timeout for streaming download (generous — large files)
 _STREAM_TIMEOUT = aiohttp.ClientTimeout(total=0, sock_connect=30, sock_read=120)
 
+# Adaptive chunking for single-stream downloads: start at _ADAPTIVE_START,
+# double while chunks arrive faster than _ADAPTIVE_FAST seconds, halve when
+# one takes longer than _ADAPTIVE_SLOW
+_ADAPTIVE_MIN = 64 * 1024
+_ADAPTIVE_START = 256 * 1024
+_ADAPTIVE_MAX = 8 * 1024 * 1024
+_ADAPTIVE_FAST = 0.05
+_ADAPTIVE_SLOW = 0.5
+
+# Files at least this large are fetched as parallel Range requests; the CDN
+# caps per-connection bandwidth, and below this the extra requests don't pay
+_PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+_PARALLEL_PARTS = 4
+
+
+def _reserve(fd: int, size: int) -> None:
+    """Allocate *size* bytes for *fd* up front (contiguous extents where supported)."""
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+
+class _RangeNotSupported(Exception):
+    """The server answered a Range request with the whole body."""
+
+
+def _make_resolver() -> aiohttp.abc.AbstractResolver:
+    """c-ares resolver when aiodns is installed, else getaddrinfo in a thread."""
+    try:
+        return aiohttp.AsyncResolver()
+    except RuntimeError:
+        # aiodns not installed
+        return aiohttp.ThreadedResolver()
+
 
 # ---------------------------------------------------------------------------
 # MediaFireClient
@@ -56,8 +103,20 @@ class MediaFireClient:
 
     async def _get_session(self) -> aiohttp.ClientSession:
         if self._session is None or self._session.closed:
+            # One keep-alive pool for the page fetch, HEAD/Range probe and
+            # download, with cached DNS for the CDN host. Shared by every
+            # handler through get_mf_client(), so it has room for several
+            # parallel-range downloads per host.
+            connector = aiohttp.TCPConnector(
+                resolver=_make_resolver(),
+                limit=32,
+                limit_per_host=16,
+                ttl_dns_cache=300,
+                keepalive_timeout=75,
+            )
             self._session = aiohttp.ClientSession(
                 headers={"User-Agent": _USER_AGENT},
+                connector=connector,
             )
         return self._session
 
@@ -90,7 +149,7 @@ class MediaFireClient:
                 raise ValueError(
                     f"MediaFire page returned HTTP {resp.status}"
                 )
-            html = await resp.text()
+            html = await self._read_page(resp)
 
         # 2. Extract direct download URL
         direct_url = self._extract_direct_url(html)
@@ -101,44 +160,27 @@ class MediaFireClient:
 
         # 3. Extract filename — prefer the original share URL (has extension),
         #    then <title>, then the CDN direct-download URL.
-        filename = (
-            self._filename_from_share_url(url)
-            or self._extract_filename(html)
-            or self._filename_from_url(direct_url)
-        )
+        share_name = self._filename_from_share_url(url)
+        direct_name = None
+        filename = share_name or self._extract_filename(html)
+        if not filename:
+            direct_name = filename = self._filename_from_url(direct_url)
 
         # If the title-derived name lacks an extension but the URL-derived
         # name has one, merge them: use the title as the base name + URL ext.
+        # (share_name always has an extension, so here it is None.)
         if filename and "." not in filename:
-            url_name = self._filename_from_share_url(url) or self._filename_from_url(direct_url)
+            url_name = direct_name or self._filename_from_url(direct_url)
             if url_name and "." in url_name:
-                from os.path import splitext
-                _, ext = splitext(url_name)
+                _, ext = os.path.splitext(url_name)
                 filename = filename + ext
 
-        # 4. GET file size via Content-Length header (follow redirects)
+        # 4. GET file size via Content-Length header (follow redirects).
+        #    Needed up front: the handler checks size limits and upload_stream
+        #    plans its parts before the download starts.
         size = 0
         try:
-            async with session.head(
-                direct_url, timeout=_TIMEOUT, allow_redirects=True
-            ) as head_resp:
-                cl = head_resp.headers.get("Content-Length")
-                if cl:
-                    size = int(cl)
-                    
-                # If HEAD doesn't return Content-Length, try a range GET
-                if size == 0:
-                    async with session.get(
-                        direct_url, timeout=_TIMEOUT, allow_redirects=True,
-                        headers={"Range": "bytes=0-0"}
-                    ) as range_resp:
-                        cr = range_resp.headers.get("Content-Range", "")
-                        # Content-Range: bytes 0-0/12345678
-                        if "/" in cr:
-                            try:
-                                size = int(cr.split("/")[-1])
-                            except (ValueError, IndexError):
-                                pass
+            size = await self._probe_size(session, direct_url)
         except Exception as e:
             print(f"[MediaFire] HEAD/size check error: {e}")
 
@@ -154,9 +196,15 @@ class MediaFireClient:
         self,
         direct_url: str,
         chunk_size: int = 1024 * 1024,
+        adaptive: bool = False,
     ) -> AsyncGenerator[bytes, None]:
         """
-        Async generator that yields *chunk_size* byte chunks from *direct_url*.
+        Async generator that yields chunks of at most *chunk_size* bytes
+        from *direct_url*.
+
+        With *adaptive*, *chunk_size* is ignored: chunks are filled to a size
+        that grows on fast links and shrinks on slow ones (64 KiB – 8 MiB),
+        keeping the number of chunks per second roughly constant.
 
         The caller is responsible for consuming all chunks; the underlying
         HTTP response is closed automatically when the generator is exhausted
@@ -168,22 +216,214 @@ class MediaFireClient:
         ) as resp:
             if resp.status not in (200, 206):
                 raise ValueError(f"MediaFire download returned HTTP {resp.status}")
+            if not adaptive:
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    if chunk:
+                        yield chunk
+                return
+
+            size = _ADAPTIVE_START
+            last = time.monotonic()
+            while True:
+                try:
+                    chunk = await resp.content.readexactly(size)
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        yield e.partial
+                    return
+                yield chunk
+                # Timed across the consumer too, so slow writes shrink chunks
+                now = time.monotonic()
+                elapsed, last = now - last, now
+                if elapsed < _ADAPTIVE_FAST:
+                    size = min(size * 2, _ADAPTIVE_MAX)
+                elif elapsed > _ADAPTIVE_SLOW:
+                    size = max(size // 2, _ADAPTIVE_MIN)
+
+    # -------------------------------------------------------- download_to_file
+
+    async def download_to_file(
+        self,
+        direct_url: str,
+        path: str,
+        on_chunk: Optional[Callable[[int], None]] = None,
+        size: int = 0,
+    ) -> int:
+        """
+        Download *direct_url* into *path*, keeping the file open for the
+        whole transfer. Writes run in the default executor. Returns the
+        number of bytes written; *on_chunk* is called with each chunk's size.
+        Chunks are sized adaptively (see ``download_stream``).
+
+        When *size* is known and large, the file is fetched in parallel
+        ranges (see ``download_parallel``), falling back to one stream if
+        the server ignores Range.
+        """
+        if size >= _PARALLEL_MIN_SIZE:
+            try:
+                return await self.download_parallel(
+                    direct_url, path, size, on_chunk=on_chunk
+                )
+            except _RangeNotSupported:
+                print("[MediaFire] Range not honoured, falling back to a single stream")
+
+        loop = asyncio.get_running_loop()
+        written = 0
+        f = await loop.run_in_executor(None, open, path, "wb")
+        try:
+            if size:
+                await loop.run_in_executor(None, _reserve, f.fileno(), size)
+            async for chunk in self.download_stream(direct_url, adaptive=True):
+                await loop.run_in_executor(None, f.write, chunk)
+                written += len(chunk)
+                if on_chunk:
+                    on_chunk(len(chunk))
+            if size:
+                # The reserved length may not match what was actually sent
+                await loop.run_in_executor(None, f.truncate, written)
+        finally:
+            await loop.run_in_executor(None, f.close)
+        return written
+
+    # ------------------------------------------------------- download_parallel
+
+    async def download_parallel(
+        self,
+        direct_url: str,
+        path: str,
+        size: int,
+        parts: int = _PARALLEL_PARTS,
+        chunk_size: int = 1024 * 1024,
+        on_chunk: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        """
+        Download *direct_url* (*size* bytes) into *path* as *parts*
+        concurrent Range requests over disjoint intervals, each written at
+        its own offset with ``os.pwrite``. Returns *size*.
+
+        Raises ``_RangeNotSupported`` if the server returns the full body.
+        """
+        loop = asyncio.get_running_loop()
+        session = await self._get_session()
+        fd = await loop.run_in_executor(
+            None, os.open, path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644
+        )
+        try:
+            await loop.run_in_executor(None, _reserve, fd, size)
+            step = -(-size // parts)
+            tasks = [
+                asyncio.create_task(self._fetch_range(
+                    session, direct_url, fd, start, min(start + step, size) - 1,
+                    chunk_size, on_chunk,
+                ))
+                for start in range(0, size, step)
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        finally:
+            await loop.run_in_executor(None, os.close, fd)
+        return size
+
+    @staticmethod
+    async def _fetch_range(
+        session: aiohttp.ClientSession,
+        direct_url: str,
+        fd: int,
+        start: int,
+        end: int,
+        chunk_size: int,
+        on_chunk: Optional[Callable[[int], None]],
+    ) -> None:
+        """Fetch bytes *start*..*end* (inclusive) and pwrite them into *fd*."""
+        loop = asyncio.get_running_loop()
+        offset = start
+        async with session.get(
+            direct_url, timeout=_STREAM_TIMEOUT, allow_redirects=True,
+            headers={"Range": f"bytes={start}-{end}"}
+        ) as resp:
+            if resp.status == 200:
+                raise _RangeNotSupported()
+            if resp.status != 206:
+                raise ValueError(f"MediaFire download returned HTTP {resp.status}")
             async for chunk in resp.content.iter_chunked(chunk_size):
-                if chunk:
-                    yield chunk
+                await loop.run_in_executor(None, os.pwrite, fd, chunk, offset)
+                offset += len(chunk)
+                if on_chunk:
+                    on_chunk(len(chunk))
+        if offset != end + 1:
+            raise ValueError(
+                f"MediaFire range {start}-{end} ended early at byte {offset}"
+            )
 
     # -------------------------------------------------------- private helpers
 
+    @staticmethod
+    async def _probe_size(session: aiohttp.ClientSession, direct_url: str) -> int:
+        """Return the file size from HEAD, falling back to a 1-byte range GET."""
+        async with session.head(
+            direct_url, timeout=_TIMEOUT, allow_redirects=True
+        ) as head_resp:
+            cl = head_resp.headers.get("Content-Length")
+            if cl:
+                return int(cl)
+
+        # Only after the HEAD response is released, so the range GET can
+        # reuse its kept-alive connection instead of opening a second one
+        async with session.get(
+            direct_url, timeout=_TIMEOUT, allow_redirects=True,
+            headers={"Range": "bytes=0-0"}
+        ) as range_resp:
+            cr = range_resp.headers.get("Content-Range", "")
+            # Content-Range: bytes 0-0/12345678
+            if "/" in cr:
+                try:
+                    return int(cr.split("/")[-1])
+                except (ValueError, IndexError):
+                    pass
+        return 0
+
+    @staticmethod
+    async def _read_page(resp: aiohttp.ClientResponse) -> str:
+        """
+        Read the page body, stopping as soon as a complete CDN URL has been
+        received. The URL sits well before the end of the page, after the
+        <title>, so the rest of the HTML is never downloaded or decoded.
+        """
+        try:
+            decoder = codecs.getincrementaldecoder(resp.charset or "utf-8")(errors="replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        html = ""
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            scan_from = max(0, len(html) - 256)  # a URL may straddle chunks
+            html += decoder.decode(chunk)
+            m = _DIRECT_URL_RE.search(html, scan_from)
+            # A match running into the end of the buffer may still be cut short
+            if m and m.end() < len(html):
+                return html
+        return html + decoder.decode(b"", final=True)
+
     @staticmethod
     def _extract_direct_url(html: str) -> Optional[str]:
-        """Try primary then fallback regex to find the direct download URL."""
-        m = _DIRECT_URL_RE.search(html)
-        if m:
-            return m.group(0)
-        m = _FALLBACK_URL_RE.search(html)
-        if m:
-            return m.group(1)
-        return None
+        """Find the CDN download URL, else the first href containing "download"."""
+        fallback = None
+        for m in _PAGE_URL_RE.finditer(html):
+            if m.group("direct"):
+                return m.group("direct")
+            href = m.group("fallback")
+            # The CDN URL usually sits inside such an href, which the fallback
+            # branch consumes before the direct branch can see it
+            direct = _DIRECT_URL_RE.search(href)
+            if direct:
+                return direct.group(0)
+            if fallback is None:
+                fallback = href
+        return fallback
 
     @staticmethod
     def _extract_filename(html: str) -> Optional[str]:
@@ -208,7 +448,6 @@ class MediaFireClient:
         The filename segment (with extension) is the second-to-last part.
         """
         try:
-            from urllib.parse import urlparse, unquote
             parts = [p for p in urlparse(url).path.split("/") if p]
             # e.g. ['file', 'k7x4ekou4owf26e', 'CWL_Liya_Punk.zip', 'file']
             if len(parts) >= 3 and parts[0] == "file":
@@ -223,7 +462,6 @@ class MediaFireClient:
     def _filename_from_url(url: str) -> str:
         """Fallback: derive a filename from the URL path."""
         try:
-            from urllib.parse import urlparse, unquote
             path = urlparse(url).path
             name = unquote(path.split("/")[-1])
             if name:
@@ -231,3 +469,28 @@ class MediaFireClient:
         except Exception:
             pass
         return "mediafire_download"
+
+
+# ---------------------------------------------------------------------------
+# Shared instance
+# ---------------------------------------------------------------------------
+
+_shared_client: Optional[MediaFireClient] = None
+
+
+def get_mf_client() -> MediaFireClient:
+    """
+    Return the process-wide MediaFireClient, so resolves and downloads from
+    every request reuse one keep-alive pool (no TLS handshake or DNS lookup
+    per link). Callers must not close it; see ``close_mf_client``.
+    """
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = MediaFireClient()
+    return _shared_client
+
+
+async def close_mf_client() -> None:
+    """Close the shared client's session (at shutdown)."""
+    if _shared_client is not None:
+        await _shared_client.close()
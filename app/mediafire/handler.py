@@ -17,18 +17,20 @@ Flow
 from __future__ import annotations
 
 import asyncio
+import logging
 import gc
 import os
-import random
 import re
 import shutil
 import tempfile
-from typing import Any, Dict, List, Optional, Tuple
+from contextlib import aclosing
+from typing import Dict, List, Optional, Tuple
 
 from pyrogram import Client
 from pyrogram.errors import FloodWait
 
 from app.utils.message import safe_edit
+from app.utils.ratelimit import rate_limiter, flood_wait_seconds
 from pyrogram.raw.functions.messages import SendMedia
 from pyrogram.raw.functions.upload import SaveFilePart
 from pyrogram.raw.types import (
@@ -49,19 +51,22 @@ from pyrogram.types import (
     InputMediaDocument,
 )
 
-from app.config import BACKUP_GROUP_ID
-from app.database.db import log_forward, get_user_session, get_user_profile
-from app.utils.streamer import upload_stream
+from app.config import BACKUP_GROUP_ID, BACKUP_CHANNEL_ID_STR
+from app.database.db import log_forward, get_cached_user_session, get_cached_user_profile
+from app.utils.streamer import upload_stream, rand63
 from app.utils.media import (
+    probe_and_thumb,
     PHOTO_EXTS, VIDEO_EXTS, MAX_FILE_SIZE, MAX_FILE_SIZE_PREMIUM,
     ext as _ext, classify as _classify, mime as _mime,
     is_media, is_archive,
 )
-from app.mediafire.client import MediaFireClient
+from app.mediafire.client import MediaFireClient, get_mf_client
 from app.mediafire.streamer import MediaFireStreamer, FileStreamer
-from app.mediafire.archive import extract_media_from_archive, iter_extract_media, count_media_in_archive
+from app.mediafire.archive import ExtractedMedia, prefetch_media, scan_and_extract
 from app.terabox.progress import ProgressTracker
 
+logger = logging.getLogger(__name__)
+
 # ---------------------------------------------------------------------------
 # Link pattern — single-file links only
 # ---------------------------------------------------------------------------
@@ -88,101 +93,16 @@ def _format_size(b: int) -> str:
 
 
 # ---------------------------------------------------------------------------
-# Video thumbnail & metadata helpers (ffmpeg / ffprobe)
+# Video thumbnail upload
 # ---------------------------------------------------------------------------
 
 
-async def _generate_video_thumb(video_path: str) -> Optional[bytes]:
-    """
-    Use ffmpeg to extract a JPEG thumbnail from the video at ~1 second.
-    Returns raw JPEG bytes or None on failure.
-    """
-    try:
-        thumb_path = video_path + ".thumb.jpg"
-        proc = await asyncio.create_subprocess_exec(
-            "ffmpeg", "-y",
-            "-ss", "1",          # seek to 1 second
-            "-i", video_path,
-            "-frames:v", "1",    # single frame
-            "-q:v", "5",         # JPEG quality (lower = better, 2-31)
-            "-vf", "scale='min(320,iw)':-2",  # max 320px wide, keep ratio
-            thumb_path,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL,
-        )
-        await proc.wait()
-
-        if proc.returncode == 0 and os.path.exists(thumb_path):
-            with open(thumb_path, "rb") as f:
-                data = f.read()
-            os.remove(thumb_path)
-            if len(data) > 100:  # sanity check
-                return data
-        # Clean up on failure
-        if os.path.exists(thumb_path):
-            os.remove(thumb_path)
-    except Exception as e:
-        print(f"[MediaFire] _generate_video_thumb error: {e}")
-    return None
-
-
-async def _get_video_metadata(video_path: str) -> Dict[str, int]:
-    """
-    Use ffprobe to get duration, width, height of a video file.
-    Returns {"duration": int, "width": int, "height": int}.
-    """
-    meta = {"duration": 0, "width": 0, "height": 0}
-    try:
-        proc = await asyncio.create_subprocess_exec(
-            "ffprobe",
-            "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=width,height,duration",
-            "-show_entries", "format=duration",
-            "-of", "csv=p=0:s=,",
-            video_path,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.DEVNULL,
-        )
-        stdout, _ = await proc.communicate()
-        if proc.returncode == 0 and stdout:
-            # Output lines: stream line (w,h,dur) then format line (dur)
-            lines = stdout.decode().strip().splitlines()
-            if lines:
-                # Parse stream line: "1920,1080,123.456" or "1920,1080,N/A"
-                parts = lines[0].split(",")
-                if len(parts) >= 2:
-                    try:
-                        meta["width"] = int(parts[0])
-                    except (ValueError, TypeError):
-                        pass
-                    try:
-                        meta["height"] = int(parts[1])
-                    except (ValueError, TypeError):
-                        pass
-                    # Duration from stream
-                    if len(parts) >= 3:
-                        try:
-                            meta["duration"] = int(float(parts[2]))
-                        except (ValueError, TypeError):
-                            pass
-                # If stream duration missing, try format duration (second line)
-                if meta["duration"] == 0 and len(lines) > 1:
-                    try:
-                        meta["duration"] = int(float(lines[1].strip().rstrip(",")))
-                    except (ValueError, TypeError):
-                        pass
-    except Exception as e:
-        print(f"[MediaFire] _get_video_metadata error: {e}")
-    return meta
-
-
 async def _upload_thumb_to_telegram(
     bot: Client, thumb_raw: bytes
 ) -> Optional[InputFile]:
     """Upload thumbnail bytes via SaveFilePart and return an InputFile."""
     try:
-        thumb_file_id = random.randint(0, 2 ** 63 - 1)
+        thumb_file_id = rand63()
         await bot.invoke(
             SaveFilePart(
                 file_id=thumb_file_id,
@@ -197,7 +117,7 @@ async def _upload_thumb_to_telegram(
             md5_checksum="",
         )
     except Exception as e:
-        print(f"[MediaFire] _upload_thumb_to_telegram error: {e}")
+        logger.warning(f"[MediaFire] _upload_thumb_to_telegram error: {e}")
     return None
 
 
@@ -243,7 +163,7 @@ async def _upload_file_to_backup(
             if thumb_raw:
                 thumb_input_file = await _upload_thumb_to_telegram(bot, thumb_raw)
                 if thumb_input_file:
-                    print(f"[MediaFire] Thumbnail uploaded for {file_name} ({len(thumb_raw)} bytes)")
+                    logger.info(f"[MediaFire] Thumbnail uploaded for {file_name} ({len(thumb_raw)} bytes)")
 
             media = InputMediaUploadedDocument(
                 file=input_file,
@@ -265,24 +185,25 @@ async def _upload_file_to_backup(
             )
 
         # SendMedia with FloodWait handling — send directly to backup group via bot
+        limiter = rate_limiter(bot)
         for _send_attempt in range(1, 4):
             try:
+                await limiter.wait(chat_id=BACKUP_GROUP_ID)
                 updates = await bot.invoke(
                     SendMedia(
                         peer=backup_peer,
                         media=media,
                         message="",
-                        random_id=random.randint(0, 2 ** 63 - 1),
+                        random_id=rand63(),
                     )
                 )
                 break
             except FloodWait as fw:
-                wait = fw.value if hasattr(fw, "value") else getattr(fw, "x", 10)
-                print(f"[MediaFire] SendMedia FloodWait {wait}s (attempt {_send_attempt}/3)")
-                await asyncio.sleep(wait + 1)
-        else:
-            print(f"[MediaFire] SendMedia failed after 3 FloodWait retries for {file_name}")
-            return None
+                wait = flood_wait_seconds(fw)
+                logger.warning(f"[MediaFire] SendMedia FloodWait {wait}s (attempt {_send_attempt}/3)")
+                if not limiter.backoff(fw, retry=_send_attempt < 3):
+                    logger.warning(f"[MediaFire] SendMedia gave up on FloodWait for {file_name}")
+                    return None
 
         # Extract message_id from various Telegram response types
         msg_id = _extract_msg_id(updates)
@@ -291,7 +212,7 @@ async def _upload_file_to_backup(
             return msg_id
 
         # Fallback — scan recent messages in the backup group
-        print(
+        logger.warning(
             f"[MediaFire] WARNING: Could not extract msg_id from SendMedia "
             f"response type={type(updates).__name__} for {file_name}"
         )
@@ -307,13 +228,11 @@ async def _upload_file_to_backup(
                     if fname == file_name:
                         return msg.id
         except Exception as fb_err:
-            print(f"[MediaFire] Fallback search failed: {fb_err}")
+            logger.warning(f"[MediaFire] Fallback search failed: {fb_err}")
 
         return None
-    except Exception as e:
-        print(f"[MediaFire] _upload_file_to_backup error ({file_name}): {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("[MediaFire] _upload_file_to_backup error (%s)", file_name)
         return None
 
 
@@ -337,17 +256,23 @@ def _extract_msg_id(updates) -> Optional[int]:
 # ---------------------------------------------------------------------------
 
 
-async def _safe_send(coro_factory, retries: int = 3):
-    """Call *coro_factory()* up to *retries* times, handling FloodWait."""
+async def _safe_send(bot: Client, coro_factory, retries: int = 3):
+    """
+    Call *coro_factory()* (a request on *bot*) up to *retries* times, paced
+    by the bot's rate limiter and handling FloodWait.
+    """
+    limiter = rate_limiter(bot)
     for attempt in range(1, retries + 1):
         try:
+            await limiter.wait()
             return await coro_factory()
         except FloodWait as fw:
-            wait = fw.value if hasattr(fw, "value") else getattr(fw, "x", 10)
-            print(f"[MediaFire] FloodWait {wait}s (attempt {attempt}/{retries})")
-            await asyncio.sleep(wait + 1)
+            wait = flood_wait_seconds(fw)
+            logger.warning(f"[MediaFire] FloodWait {wait}s (attempt {attempt}/{retries})")
+            if not limiter.backoff(fw, retry=attempt < retries):
+                return None
         except Exception as e:
-            print(f"[MediaFire] _safe_send error (attempt {attempt}/{retries}): {e}")
+            logger.warning(f"[MediaFire] _safe_send error (attempt {attempt}/{retries}): {e}")
             if attempt < retries:
                 await asyncio.sleep(2)
     return None
@@ -376,6 +301,7 @@ async def _send_album_to_user(
 
     async def _send_single(mid: int) -> bool:
         r = await _safe_send(
+            bot,
             lambda _mid=mid: bot.copy_message(
                 chat_id=user_id,
                 from_chat_id=BACKUP_GROUP_ID,
@@ -392,6 +318,7 @@ async def _send_album_to_user(
         chunk_mids = [mid for mid, *_ in chunk]
 
         backup_msgs = await _safe_send(
+            bot,
             lambda _ids=chunk_mids: bot.get_messages(BACKUP_GROUP_ID, _ids)
         )
         if backup_msgs is None:
@@ -429,6 +356,7 @@ async def _send_album_to_user(
         else:
             # Try sending as album (preserves grouping)
             r = await _safe_send(
+                bot,
                 lambda _ml=media_list: bot.send_media_group(user_id, _ml)
             )
             if r:
@@ -470,6 +398,7 @@ async def _deliver_to_user(
 
     async def _send_single(mid: int) -> bool:
         r = await _safe_send(
+            bot,
             lambda _mid=mid: bot.copy_message(
                 chat_id=user_id,
                 from_chat_id=BACKUP_GROUP_ID,
@@ -497,19 +426,26 @@ async def _deliver_to_user(
         await _send_single(mid)
         await asyncio.sleep(0.5)
 
-    # Safety net — resend anything not confirmed delivered
-    all_mids = {mid for mid, k, n, s in uploaded}
-    missing_mids = all_mids - delivered_mids
+    # Safety net — resend anything not confirmed delivered, in upload order.
+    # Photos/videos go back through the album path (one get_messages and
+    # one send_media_group per chunk); only the rest is copied one by one.
+    missing = [item for item in uploaded if item[0] not in delivered_mids]
 
-    if missing_mids:
+    if missing:
         print(
-            f"[MediaFire] Safety net: {len(missing_mids)} file(s) not "
-            "confirmed delivered, resending individually"
+            f"[MediaFire] Safety net: {len(missing)} file(s) not "
+            "confirmed delivered, resending"
         )
         await asyncio.sleep(2)
-        for mid in missing_mids:
-            await _send_single(mid)
-            await asyncio.sleep(1)
+        await _send_album_to_user(
+            bot, user_id,
+            [item for item in missing if item[1] in ("photo", "video")],
+            delivered_mids,
+        )
+        for mid, k, n, s in missing:
+            if k not in ("photo", "video") and mid not in delivered_mids:
+                await _send_single(mid)
+                await asyncio.sleep(1)
 
     total_to_send = len(uploaded)
     sent_count = len(delivered_mids)
@@ -546,27 +482,14 @@ async def _download_archive_to_temp(
     Returns the path to the downloaded archive file.
     """
     archive_path = os.path.join(dest_dir, filename)
-    downloaded = 0
-
-    async for chunk in mf_client.download_stream(direct_url):
-        # Write chunk to file (run in executor to avoid blocking)
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(
-            None, _append_bytes, archive_path, chunk
-        )
-        downloaded += len(chunk)
-        if tracker:
-            tracker.add_downloaded(len(chunk))
-
+    await mf_client.download_to_file(
+        direct_url, archive_path,
+        on_chunk=tracker.add_downloaded if tracker else None,
+        size=file_size,
+    )
     return archive_path
 
 
-def _append_bytes(path: str, data: bytes) -> None:
-    """Append *data* to *path* (blocking — call via executor)."""
-    with open(path, "ab") as f:
-        f.write(data)
-
-
 # ---------------------------------------------------------------------------
 # Main handler
 # ---------------------------------------------------------------------------
@@ -586,15 +509,15 @@ async def mediafire_link_handler(bot: Client, message: Message) -> None:
         )
         return
 
-    user_session = await get_user_session(user_id)
+    user_session = await get_cached_user_session(user_id)
     if not user_session:
         await message.reply_text("❌ Belum login. Sila /start untuk login.")
         return
 
-    user_profile = await get_user_profile(user_id)
+    user_profile = await get_cached_user_profile(user_id)
     if not user_profile:
         from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        from app.bot.states import user_profile_states, ProfileStep
+        from app.bot.states import begin_profile_setup
 
         await message.reply_text(
             "⚠️ **Profile belum lengkap!**\n\nSila set profile anda terlebih dahulu.\n\n"
@@ -613,12 +536,16 @@ async def mediafire_link_handler(bot: Client, message: Message) -> None:
                 ]
             ),
         )
-        user_profile_states[user_id] = {"step": ProfileStep.ASK_GENDER, "data": {}}
+        begin_profile_setup(user_id)
         return
 
     # ---------------------------------------------------------------- Parse link
     skip_non_videos = "/skip" in message.text.lower()
-    match = MEDIAFIRE_LINK_PATTERN.search(message.text)
+    # The regex filter that routed this message already matched the link
+    match = (
+        message.matches[0] if message.matches
+        else MEDIAFIRE_LINK_PATTERN.search(message.text)
+    )
     if not match:
         return
 
@@ -631,7 +558,7 @@ async def mediafire_link_handler(bot: Client, message: Message) -> None:
     status_msg = await message.reply_text("🔍 Menyelesaikan link MediaFire…")
 
     temp_dir: Optional[str] = None
-    mf_client = MediaFireClient()
+    mf_client = get_mf_client()
 
     try:
         # 1. Resolve the direct download URL
@@ -718,16 +645,13 @@ async def mediafire_link_handler(bot: Client, message: Message) -> None:
     except asyncio.CancelledError:
         print(f"[MediaFire] Handler cancelled for user {user_id}")
     except Exception as e:
-        print(f"[MediaFire] Handler error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[MediaFire] Handler error")
         try:
             await safe_edit(status_msg, f"❌ Ralat tidak dijangka: {e}")
         except Exception:
             pass
 
     finally:
-        await mf_client.close()
         active_user_processes.pop(user_id, None)
         reset_cancel(user_id)
 
@@ -789,8 +713,7 @@ async def _handle_direct_media(
         kind = _classify(filename)
 
         # Log the upload
-        channel_id_str = str(BACKUP_GROUP_ID).replace("-100", "")
-        link = f"https://t.me/c/{channel_id_str}/{bmid}"
+        link = f"https://t.me/c/{BACKUP_CHANNEL_ID_STR}/{bmid}"
         await log_forward(
             message.from_user.username, bmid, file_size,
             f"MediaFire/{filename}", link
@@ -800,7 +723,7 @@ async def _handle_direct_media(
         uploaded = [(bmid, kind, filename, file_size)]
         await _deliver_to_user(bot, user_id, uploaded, status_msg)
 
-    except Exception as e:
+    except Exception:
         await tracker.stop()
         raise
 
@@ -832,8 +755,6 @@ async def _handle_archive(
     4. Delete the archive after all files are processed.
     5. Send albums to user.
     """
-    import gc
-
     temp_dir = tempfile.mkdtemp(prefix="mf_archive_")
     size_limit = MAX_FILE_SIZE_PREMIUM if is_premium else MAX_FILE_SIZE
 
@@ -866,272 +787,271 @@ async def _handle_archive(
             await safe_edit(status_msg, "🚫 **Proses dibatalkan!**\n\n💾 Folder sementara sedang dibersihkan...")
             return
 
-        # Close the MediaFire HTTP session early to free resources
-        await mf_client.close()
-
         # ----- Phase 2: Count media files (metadata only, no extraction) -----
         await safe_edit(status_msg, "📂 Mengimbas fail media dalam arkib…")
 
-        loop = asyncio.get_running_loop()
-        total_files = await loop.run_in_executor(
-            None, count_media_in_archive, archive_path, skip_non_videos
-        )
-
-        if total_files == 0:
-            msg = "❌ Tiada fail video dijumpai dalam arkib." if skip_non_videos else "❌ Tiada fail media (foto/video) dijumpai dalam arkib."
-            await safe_edit(status_msg, msg)
-            return
-
         extract_dir = os.path.join(temp_dir, "extracted")
-        os.makedirs(extract_dir, exist_ok=True)
-
-        await safe_edit(status_msg, 
-            f"📤 Memuat naik {total_files} fail media ke Telegram…"
+        # One directory scan serves both the count and the extraction below
+        total_files, media_files = await scan_and_extract(
+            archive_path, extract_dir, skip_non_videos
         )
 
-        # ----- Phase 3: Extract & upload (photos parallel, videos sequential) -----
-        uploaded: List[Tuple[int, str, str, int]] = []
-        MAX_RETRIES = 3
-        idx = 0
-
-        # Batch settings for concurrent photo uploads
-        _PHOTO_BATCH = 5
-        _PHOTO_WORKERS = 3
-        _photo_batch: List[Dict[str, Any]] = []
-
-        import time as _time
-        from app.terabox.progress import _human_bytes, _human_speed, _bar, _eta
-        _batch_state = {
-            "done": 0, "downloaded": 0, "uploaded": 0,
-            "_dl_samples": [], "_ul_samples": [],
-            "batch_total_size": 0, "batch_count": 0,
-        }
-        _batch_stopped = {"v": False}
-        _batch_start = _time.monotonic()
-
-        def _batch_add_dl(n: int):
-            now = _time.monotonic()
-            _batch_state["downloaded"] += n
-            _batch_state["_dl_samples"].append((now, _batch_state["downloaded"]))
-            if len(_batch_state["_dl_samples"]) > 60:
-                _batch_state["_dl_samples"] = _batch_state["_dl_samples"][-60:]
-
-        def _batch_add_ul(n: int):
-            now = _time.monotonic()
-            _batch_state["uploaded"] += n
-            _batch_state["_ul_samples"].append((now, _batch_state["uploaded"]))
-            if len(_batch_state["_ul_samples"]) > 60:
-                _batch_state["_ul_samples"] = _batch_state["_ul_samples"][-60:]
-
-        def _rolling_speed(samples, window=8.0):
-            if len(samples) < 2:
-                return 0.0
-            now = samples[-1][0]
-            cutoff = now - window
-            for i, (t, _) in enumerate(samples):
-                if t >= cutoff:
-                    t0, b0 = samples[i]
-                    t1, b1 = samples[-1]
-                    dt = t1 - t0
-                    return (b1 - b0) / dt if dt > 0 else 0.0
-            return 0.0
-
-        async def _batch_updater_loop():
-            while not _batch_stopped["v"]:
-                await asyncio.sleep(2.5)
-                if _batch_stopped["v"]:
-                    break
-                try:
-                    ts = _batch_state["batch_total_size"]
-                    if ts <= 0:
-                        continue
-                    dl_frac = _batch_state["downloaded"] / ts
-                    ul_frac = _batch_state["uploaded"] / ts
-                    dl_speed = _rolling_speed(_batch_state["_dl_samples"])
-                    ul_speed = _rolling_speed(_batch_state["_ul_samples"])
-                    dl_rem = max(0, ts - _batch_state["downloaded"])
-                    ul_rem = max(0, ts - _batch_state["uploaded"])
-                    elapsed = _time.monotonic() - _batch_start
-                    mins, secs = divmod(int(elapsed), 60)
-                    text = (
-                        f"\U0001f5bc\ufe0f **Foto {_batch_state['done']}/{_batch_state['batch_count']}** "
-                        f"(\U0001f4ca {total_files} jumlah fail)\n"
-                        f"\U0001f4e6 {_human_bytes(ts)}\n\n"
-                        f"\u2b07\ufe0f Muat Turun  {_bar(dl_frac)}  {dl_frac*100:.0f}%\n"
-                        f"    {_human_bytes(_batch_state['downloaded'])} \u2022 {_human_speed(dl_speed)} \u2022 ETA {_eta(dl_rem, dl_speed)}\n\n"
-                        f"\u2b06\ufe0f Muat Naik   {_bar(ul_frac)}  {ul_frac*100:.0f}%\n"
-                        f"    {_human_bytes(_batch_state['uploaded'])} \u2022 {_human_speed(ul_speed)} \u2022 ETA {_eta(ul_rem, ul_speed)}\n\n"
-                        f"\u23f1 Masa: {mins}m {secs}s"
-                    )
-                    await safe_edit(status_msg, text)
-                except Exception:
-                    pass
-
-        _batch_updater_task = asyncio.create_task(_batch_updater_loop())
-
-        async def _flush_photo_batch():
-            """Upload accumulated photos concurrently then clean up."""
-            if not _photo_batch:
+        async with aclosing(media_files):
+            if total_files == 0:
+                msg = "❌ Tiada fail video dijumpai dalam arkib." if skip_non_videos else "❌ Tiada fail media (foto/video) dijumpai dalam arkib."
+                await safe_edit(status_msg, msg)
                 return
-            batch = list(_photo_batch)
-            _photo_batch.clear()
-
-            # Update batch state for progress tracking
-            _batch_state["batch_total_size"] += sum(e["size"] for e in batch)
-            _batch_state["batch_count"] += len(batch)
-
-            _sem = asyncio.Semaphore(_PHOTO_WORKERS)
 
-            # Proxy for upload tracking only (download tracked via FileStreamer callback)
-            _ul_proxy = type("_Proxy", (), {
-                "add_downloaded": staticmethod(lambda n: None),
-                "add_uploaded": staticmethod(_batch_add_ul),
-            })()
-
-            async def _upload_one_photo(mf_entry):
-                async with _sem:
-                    if is_cancelled(user_id):
-                        return None
+            os.makedirs(extract_dir, exist_ok=True)
 
-                    if mf_entry["size"] > size_limit:
-                        print(f"[MediaFire] Skipping oversized photo: {mf_entry['name']} ({_format_size(mf_entry['size'])})")
-                        return None
+            await safe_edit(status_msg, 
+                f"📤 Memuat naik {total_files} fail media ke Telegram…"
+            )
 
-                    _bmid = None
-                    for _att in range(1, MAX_RETRIES + 1):
-                        streamer = FileStreamer(
-                            mf_entry["path"], mf_entry["name"],
-                            on_download_chunk=_batch_add_dl,
-                        )
-                        _bmid = await _upload_file_to_backup(
-                            bot, backup_peer, streamer,
-                            mf_entry["name"], mf_entry["size"],
-                            tracker=_ul_proxy,
-                        )
-                        if _bmid:
-                            break
-                        print(f"[MediaFire] Photo upload failed for {mf_entry['name']} (attempt {_att}/{MAX_RETRIES})")
-                        if _att < MAX_RETRIES:
-                            await asyncio.sleep(1)
+            # ----- Phase 3: Extract & upload (photos parallel, videos sequential) -----
+            uploaded: List[Tuple[int, str, str, int]] = []
+            MAX_RETRIES = 3
+            idx = 0
+
+            # Batch settings for concurrent photo uploads
+            _PHOTO_BATCH = 5
+            _PHOTO_WORKERS = 3
+            _photo_batch: List[ExtractedMedia] = []
+
+            import time as _time
+            from app.terabox.progress import _human_bytes, _human_speed, _bar, _eta
+            _batch_state = {
+                "done": 0, "downloaded": 0, "uploaded": 0,
+                "_dl_samples": [], "_ul_samples": [],
+                "batch_total_size": 0, "batch_count": 0,
+            }
+            _batch_stopped = {"v": False}
+            _batch_start = _time.monotonic()
+
+            def _batch_add_dl(n: int):
+                now = _time.monotonic()
+                _batch_state["downloaded"] += n
+                _batch_state["_dl_samples"].append((now, _batch_state["downloaded"]))
+                if len(_batch_state["_dl_samples"]) > 60:
+                    _batch_state["_dl_samples"] = _batch_state["_dl_samples"][-60:]
+
+            def _batch_add_ul(n: int):
+                now = _time.monotonic()
+                _batch_state["uploaded"] += n
+                _batch_state["_ul_samples"].append((now, _batch_state["uploaded"]))
+                if len(_batch_state["_ul_samples"]) > 60:
+                    _batch_state["_ul_samples"] = _batch_state["_ul_samples"][-60:]
+
+            def _rolling_speed(samples, window=8.0):
+                if len(samples) < 2:
+                    return 0.0
+                now = samples[-1][0]
+                cutoff = now - window
+                for i, (t, _) in enumerate(samples):
+                    if t >= cutoff:
+                        t0, b0 = samples[i]
+                        t1, b1 = samples[-1]
+                        dt = t1 - t0
+                        return (b1 - b0) / dt if dt > 0 else 0.0
+                return 0.0
 
-                    # Delete extracted file immediately
+            async def _batch_updater_loop():
+                while not _batch_stopped["v"]:
+                    await asyncio.sleep(2.5)
+                    if _batch_stopped["v"]:
+                        break
                     try:
-                        os.remove(mf_entry["path"])
-                    except OSError:
+                        ts = _batch_state["batch_total_size"]
+                        if ts <= 0:
+                            continue
+                        dl_frac = _batch_state["downloaded"] / ts
+                        ul_frac = _batch_state["uploaded"] / ts
+                        dl_speed = _rolling_speed(_batch_state["_dl_samples"])
+                        ul_speed = _rolling_speed(_batch_state["_ul_samples"])
+                        dl_rem = max(0, ts - _batch_state["downloaded"])
+                        ul_rem = max(0, ts - _batch_state["uploaded"])
+                        elapsed = _time.monotonic() - _batch_start
+                        mins, secs = divmod(int(elapsed), 60)
+                        text = (
+                            f"\U0001f5bc\ufe0f **Foto {_batch_state['done']}/{_batch_state['batch_count']}** "
+                            f"(\U0001f4ca {total_files} jumlah fail)\n"
+                            f"\U0001f4e6 {_human_bytes(ts)}\n\n"
+                            f"\u2b07\ufe0f Muat Turun  {_bar(dl_frac)}  {dl_frac*100:.0f}%\n"
+                            f"    {_human_bytes(_batch_state['downloaded'])} \u2022 {_human_speed(dl_speed)} \u2022 ETA {_eta(dl_rem, dl_speed)}\n\n"
+                            f"\u2b06\ufe0f Muat Naik   {_bar(ul_frac)}  {ul_frac*100:.0f}%\n"
+                            f"    {_human_bytes(_batch_state['uploaded'])} \u2022 {_human_speed(ul_speed)} \u2022 ETA {_eta(ul_rem, ul_speed)}\n\n"
+                            f"\u23f1 Masa: {mins}m {secs}s"
+                        )
+                        await safe_edit(status_msg, text)
+                    except Exception:
                         pass
 
-                    _batch_state["done"] += 1
-                    await asyncio.sleep(0.3)
-                    if _bmid:
-                        return (_bmid, mf_entry["kind"], mf_entry["name"], mf_entry["size"])
-                    return None
+            _batch_updater_task = asyncio.create_task(_batch_updater_loop())
+
+            async def _flush_photo_batch():
+                """Upload accumulated photos concurrently then clean up."""
+                if not _photo_batch:
+                    return
+                batch = list(_photo_batch)
+                _photo_batch.clear()
+
+                # Update batch state for progress tracking
+                _batch_state["batch_total_size"] += sum(e.size for e in batch)
+                _batch_state["batch_count"] += len(batch)
+
+                _sem = asyncio.Semaphore(_PHOTO_WORKERS)
+
+                # Proxy for upload tracking only (download tracked via FileStreamer callback)
+                _ul_proxy = type("_Proxy", (), {
+                    "add_downloaded": staticmethod(lambda n: None),
+                    "add_uploaded": staticmethod(_batch_add_ul),
+                })()
+
+                async def _upload_one_photo(mf_entry):
+                    async with _sem:
+                        if is_cancelled(user_id):
+                            return None
+
+                        if mf_entry.size > size_limit:
+                            logger.warning(f"[MediaFire] Skipping oversized photo: {mf_entry.name} ({_format_size(mf_entry.size)})")
+                            return None
+
+                        _bmid = None
+                        for _att in range(1, MAX_RETRIES + 1):
+                            streamer = FileStreamer(
+                                mf_entry.path, mf_entry.name,
+                                on_download_chunk=_batch_add_dl,
+                            )
+                            _bmid = await _upload_file_to_backup(
+                                bot, backup_peer, streamer,
+                                mf_entry.name, mf_entry.size,
+                                tracker=_ul_proxy,
+                            )
+                            if _bmid:
+                                break
+                            logger.warning(f"[MediaFire] Photo upload failed for {mf_entry.name} (attempt {_att}/{MAX_RETRIES})")
+                            if _att < MAX_RETRIES:
+                                await asyncio.sleep(1)
+
+                        # Delete extracted file immediately
+                        try:
+                            os.remove(mf_entry.path)
+                        except OSError:
+                            pass
 
-            results = await asyncio.gather(
-                *[_upload_one_photo(mf_e) for mf_e in batch],
-                return_exceptions=True,
-            )
-            for r in results:
-                if isinstance(r, Exception):
-                    print(f"[MediaFire] Photo batch exception: {r}")
-                    import traceback; traceback.print_exc()
-                    continue
-                if r:
-                    uploaded.append(r)
-                    _b, _k, _n, _s = r
-                    _cid = str(BACKUP_GROUP_ID).replace("-100", "")
-                    _lnk = f"https://t.me/c/{_cid}/{_b}"
-                    await log_forward(
-                        message.from_user.username, _b, _s,
-                        f"MediaFire/{filename}/{_n}", _lnk
-                    )
-            gc.collect()
+                        _batch_state["done"] += 1
+                        await asyncio.sleep(0.3)
+                        if _bmid:
+                            return (_bmid, mf_entry.kind, mf_entry.name, mf_entry.size)
+                        return None
 
-        async for mf in iter_extract_media(archive_path, extract_dir, skip_non_videos):
-            idx += 1
+                results = await asyncio.gather(
+                    *[_upload_one_photo(mf_e) for mf_e in batch],
+                    return_exceptions=True,
+                )
+                for r in results:
+                    if isinstance(r, Exception):
+                        logger.error("[MediaFire] Photo batch exception: %s", r, exc_info=r)
+                        continue
+                    if r:
+                        uploaded.append(r)
+                        _b, _k, _n, _s = r
+                        _lnk = f"https://t.me/c/{BACKUP_CHANNEL_ID_STR}/{_b}"
+                        await log_forward(
+                            message.from_user.username, _b, _s,
+                            f"MediaFire/{filename}/{_n}", _lnk
+                        )
 
-            if is_cancelled(user_id):
-                await safe_edit(status_msg, "\U0001f6ab **Proses dibatalkan!**\n\n\U0001f4be Folder sementara sedang dibersihkan...")
-                return
+            def _start_probe(mf: ExtractedMedia):
+                # Probe upcoming videos while the current file uploads
+                if mf.kind == "video" and mf.size <= size_limit:
+                    return probe_and_thumb(mf.path)
+                return None
 
-            if mf["kind"] == "photo":
-                # Collect photos for batch concurrent upload
-                _photo_batch.append(mf)
-                if len(_photo_batch) >= _PHOTO_BATCH:
-                    await _flush_photo_batch()
-            else:
-                # Flush pending photos before processing a non-photo file
-                await _flush_photo_batch()
+            async with aclosing(prefetch_media(media_files, _start_probe)) as items:
+                async for mf, probe in items:
+                    idx += 1
 
-                # --- Process video/document sequentially with full progress ---
-                if mf["size"] > size_limit:
-                    print(f"[MediaFire] Skipping oversized file: {mf['name']} ({_format_size(mf['size'])})")
-                    try:
-                        os.remove(mf["path"])
-                    except OSError:
-                        pass
-                    continue
-
-                thumb_raw = None
-                video_meta = None
-                if mf["kind"] == "video":
-                    thumb_raw = await _generate_video_thumb(mf["path"])
-                    video_meta = await _get_video_metadata(mf["path"])
-
-                tracker = ProgressTracker(
-                    status_msg=status_msg,
-                    file_name=mf["name"],
-                    file_size=mf["size"],
-                    file_index=idx,
-                    file_total=total_files,
-                )
-                tracker.start()
+                    if is_cancelled(user_id):
+                        await safe_edit(status_msg, "\U0001f6ab **Proses dibatalkan!**\n\n\U0001f4be Folder sementara sedang dibersihkan...")
+                        return
+
+                    if mf.kind == "photo":
+                        # Collect photos for batch concurrent upload
+                        _photo_batch.append(mf)
+                        if len(_photo_batch) >= _PHOTO_BATCH:
+                            await _flush_photo_batch()
+                    else:
+                        # Flush pending photos before processing a non-photo file
+                        await _flush_photo_batch()
+
+                        # --- Process video/document sequentially with full progress ---
+                        if mf.size > size_limit:
+                            logger.warning(f"[MediaFire] Skipping oversized file: {mf.name} ({_format_size(mf.size)})")
+                            try:
+                                os.remove(mf.path)
+                            except OSError:
+                                pass
+                            continue
+
+                        thumb_raw = None
+                        video_meta = None
+                        if probe is not None:
+                            thumb_raw, video_meta = await probe
+
+                        tracker = ProgressTracker(
+                            status_msg=status_msg,
+                            file_name=mf.name,
+                            file_size=mf.size,
+                            file_index=idx,
+                            file_total=total_files,
+                        )
+                        tracker.start()
+
+                        bmid = None
+                        for attempt in range(1, MAX_RETRIES + 1):
+                            streamer = FileStreamer(
+                                mf.path, mf.name,
+                                on_download_chunk=tracker.add_downloaded,
+                            )
+                            bmid = await _upload_file_to_backup(
+                                bot, backup_peer, streamer,
+                                mf.name, mf.size,
+                                tracker=tracker,
+                                thumb_raw=thumb_raw,
+                                video_meta=video_meta,
+                            )
+                            if bmid:
+                                break
+                            logger.warning(f"[MediaFire] Upload failed for {mf.name} (attempt {attempt}/{MAX_RETRIES})")
+                            if attempt < MAX_RETRIES:
+                                tracker.downloaded = 0
+                                tracker.uploaded = 0
+                                tracker._dl_samples.clear()
+                                tracker._ul_samples.clear()
+                                await asyncio.sleep(3)
+
+                        await tracker.stop()
+
+                        if bmid:
+                            uploaded.append((bmid, mf.kind, mf.name, mf.size))
+                            link = f"https://t.me/c/{BACKUP_CHANNEL_ID_STR}/{bmid}"
+                            await log_forward(
+                                message.from_user.username, bmid, mf.size,
+                                f"MediaFire/{filename}/{mf.name}", link
+                            )
+                        else:
+                            logger.warning(f"[MediaFire] Skipping {mf.name} \u2014 upload failed after {MAX_RETRIES} attempts.")
 
-                bmid = None
-                for attempt in range(1, MAX_RETRIES + 1):
-                    streamer = FileStreamer(
-                        mf["path"], mf["name"],
-                        on_download_chunk=tracker.add_downloaded,
-                    )
-                    bmid = await _upload_file_to_backup(
-                        bot, backup_peer, streamer,
-                        mf["name"], mf["size"],
-                        tracker=tracker,
-                        thumb_raw=thumb_raw,
-                        video_meta=video_meta,
-                    )
-                    if bmid:
-                        break
-                    print(f"[MediaFire] Upload failed for {mf['name']} (attempt {attempt}/{MAX_RETRIES})")
-                    if attempt < MAX_RETRIES:
-                        tracker.downloaded = 0
-                        tracker.uploaded = 0
-                        tracker._dl_samples.clear()
-                        tracker._ul_samples.clear()
-                        await asyncio.sleep(3)
-
-                await tracker.stop()
-
-                if bmid:
-                    uploaded.append((bmid, mf["kind"], mf["name"], mf["size"]))
-                    channel_id_str = str(BACKUP_GROUP_ID).replace("-100", "")
-                    link = f"https://t.me/c/{channel_id_str}/{bmid}"
-                    await log_forward(
-                        message.from_user.username, bmid, mf["size"],
-                        f"MediaFire/{filename}/{mf['name']}", link
-                    )
-                else:
-                    print(f"[MediaFire] Skipping {mf['name']} \u2014 upload failed after {MAX_RETRIES} attempts.")
-
-                try:
-                    os.remove(mf["path"])
-                except OSError:
-                    pass
-                thumb_raw = None
-                video_meta = None
-                gc.collect()
-
-                if idx < total_files:
-                    await asyncio.sleep(2)
+                        try:
+                            os.remove(mf.path)
+                        except OSError:
+                            pass
+                        thumb_raw = None
+                        video_meta = None
+
+                        if idx < total_files:
+                            await asyncio.sleep(2)
 
         # Flush any remaining photos in the last batch
         await _flush_photo_batch()
@@ -119,6 +119,17 @@ class MediaFireStreamer:
 # FileStreamer  (local file → Telegram upload)
 # ---------------------------------------------------------------------------
 
+def _open_sequential(path: str) -> int:
+    """Open *path* read-only and hint the kernel to read ahead aggressively."""
+    fd = os.open(path, os.O_RDONLY)
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+    return fd
+
+
 class FileStreamer:
     """
     Reads a local file through an ``asyncio.Queue`` so that
@@ -171,22 +182,23 @@ class FileStreamer:
         """
         loop = asyncio.get_running_loop()
         try:
-            # Open file handle once, read chunks one at a time
-            fh = await loop.run_in_executor(
-                None, lambda: open(self.file_path, "rb")
-            )
+            # Open the fd once and pread at explicit offsets: no buffered
+            # file object in between, and no shared seek position
+            fd = await loop.run_in_executor(None, _open_sequential, self.file_path)
             try:
+                offset = 0
                 while True:
                     data = await loop.run_in_executor(
-                        None, fh.read, self.CHUNK_SIZE
+                        None, os.pread, fd, self.CHUNK_SIZE, offset
                     )
                     if not data:
                         break
+                    offset += len(data)
                     await self.queue.put(data)
                     if self.on_download_chunk:
                         self.on_download_chunk(len(data))
             finally:
-                await loop.run_in_executor(None, fh.close)
+                await loop.run_in_executor(None, os.close, fd)
         except Exception as e:
             print(f"[FileStreamer] Read error: {e}")
         finally:
@@ -16,8 +16,8 @@ Flow
 from __future__ import annotations
 
 import asyncio
+import logging
 import os
-import random
 import re
 import uuid
 from typing import Any, Dict, List, Optional, Tuple
@@ -28,6 +28,7 @@ from pyrogram import Client
 from pyrogram.errors import FloodWait
 
 from app.utils.message import safe_edit
+from app.utils.ratelimit import rate_limiter, flood_wait_seconds
 from pyrogram.raw.functions.messages import SendMedia
 from pyrogram.raw.functions.upload import SaveFilePart
 from pyrogram.raw.types import (
@@ -45,12 +46,14 @@ from pyrogram.raw.types import (
 )
 from pyrogram.types import Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 
-from app.config import BACKUP_GROUP_ID
-from app.database.db import log_forward, get_user_session, get_user_profile
-from app.utils.streamer import upload_stream
+from app.config import BACKUP_GROUP_ID, BACKUP_CHANNEL_ID_STR
+from app.database.db import log_forward, get_cached_user_session, get_cached_user_profile
+from app.utils.streamer import upload_stream, rand63
 from app.terabox.streamer import TeraBoxMediaStreamer
 from app.terabox.progress import ProgressTracker
 
+logger = logging.getLogger(__name__)
+
 # ---------------------------------------------------------------------------
 # Multi-domain regex for TeraBox share links
 # ---------------------------------------------------------------------------
@@ -205,7 +208,7 @@ async def _download_thumb_bytes(thumb_url: str, cookie_str: str) -> Optional[byt
 async def _upload_thumb_to_telegram(bot: Client, thumb_raw: bytes) -> Optional[InputFile]:
     """Upload thumbnail bytes via SaveFilePart and return an InputFile."""
     try:
-        thumb_file_id = random.randint(0, 2 ** 63 - 1)
+        thumb_file_id = rand63()
         await bot.invoke(
             SaveFilePart(
                 file_id=thumb_file_id,
@@ -220,7 +223,7 @@ async def _upload_thumb_to_telegram(bot: Client, thumb_raw: bytes) -> Optional[I
             md5_checksum="",
         )
     except Exception as e:
-        print(f"[TeraBox] _upload_thumb_to_telegram error: {e}")
+        logger.warning(f"[TeraBox] _upload_thumb_to_telegram error: {e}")
     return None
 
 
@@ -264,7 +267,7 @@ async def _upload_terabox_file_to_backup(
                 if thumb_raw:
                     thumb_input_file = await _upload_thumb_to_telegram(bot, thumb_raw)
                     if thumb_input_file:
-                        print(f"[TeraBox] Thumbnail uploaded for {file_name} ({len(thumb_raw)} bytes)")
+                        logger.info(f"[TeraBox] Thumbnail uploaded for {file_name} ({len(thumb_raw)} bytes)")
 
             media = InputMediaUploadedDocument(
                 file=input_file,
@@ -294,23 +297,23 @@ async def _upload_terabox_file_to_backup(
         # Send directly to backup group using bot session
         SEND_RETRIES = 5
         updates = None
+        limiter = rate_limiter(bot)
         for send_attempt in range(1, SEND_RETRIES + 1):
             try:
+                await limiter.wait(chat_id=BACKUP_GROUP_ID)
                 updates = await bot.invoke(
                     SendMedia(
                         peer=backup_peer,
                         media=media,
                         message="",
-                        random_id=random.randint(0, 2 ** 63 - 1),
+                        random_id=rand63(),
                     )
                 )
                 break  # success
             except FloodWait as fw:
-                wait = fw.value if hasattr(fw, "value") else getattr(fw, "x", 15)
-                print(f"[TeraBox] FloodWait {wait}s on SendMedia for {file_name} (attempt {send_attempt}/{SEND_RETRIES})")
-                if send_attempt < SEND_RETRIES:
-                    await asyncio.sleep(wait + 2)
-                else:
+                wait = flood_wait_seconds(fw)
+                logger.warning(f"[TeraBox] FloodWait {wait}s on SendMedia for {file_name} (attempt {send_attempt}/{SEND_RETRIES})")
+                if not limiter.backoff(fw, retry=send_attempt < SEND_RETRIES):
                     return None
 
         if updates is None:
@@ -340,8 +343,8 @@ async def _upload_terabox_file_to_backup(
             return msg_id
 
         # Fallback: scan recent messages in the backup group
-        print(f"[TeraBox] WARNING: Could not extract msg_id from SendMedia response type={type(updates).__name__} for {file_name}")
-        print(f"[TeraBox] Response: {updates}")
+        logger.warning(f"[TeraBox] Could not extract msg_id from SendMedia response type={type(updates).__name__} for {file_name}")
+        logger.debug(f"[TeraBox] Response: {updates}")
 
         try:
             recent = await bot.get_messages(
@@ -359,16 +362,15 @@ async def _upload_terabox_file_to_backup(
                     elif msg.audio:
                         fname = msg.audio.file_name
                     if fname == file_name:
-                        print(f"[TeraBox] Fallback: found msg_id={msg.id} for {file_name}")
+                        logger.info(f"[TeraBox] Fallback: found msg_id={msg.id} for {file_name}")
                         return msg.id
         except Exception as fb_err:
-            print(f"[TeraBox] Fallback search failed: {fb_err}")
+            logger.warning(f"[TeraBox] Fallback search failed: {fb_err}")
 
         return None
 
-    except Exception as e:
-        print(f"[TeraBox] _upload_terabox_file_to_backup error ({file_name}): {e}")
-        import traceback; traceback.print_exc()
+    except Exception:
+        logger.exception("[TeraBox] _upload_terabox_file_to_backup error (%s)", file_name)
         return None
 
 
@@ -580,15 +582,15 @@ async def terabox_link_handler(bot: Client, message: Message) -> None:
         )
         return
 
-    user_session = await get_user_session(user_id)
+    user_session = await get_cached_user_session(user_id)
     if not user_session:
         await message.reply_text("❌ Belum login. Sila /start untuk login.")
         return
 
-    user_profile = await get_user_profile(user_id)
+    user_profile = await get_cached_user_profile(user_id)
     if not user_profile:
         from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        from app.bot.states import user_profile_states, ProfileStep
+        from app.bot.states import begin_profile_setup
         await message.reply_text(
             "⚠️ **Profile belum lengkap!**\n\nSila set profile anda terlebih dahulu.\n\n"
             "👇 **Pilih jantina anda:**",
@@ -597,7 +599,7 @@ async def terabox_link_handler(bot: Client, message: Message) -> None:
                 InlineKeyboardButton("👩 Perempuan", callback_data="profile_gender_perempuan"),
             ]]),
         )
-        user_profile_states[user_id] = {"step": ProfileStep.ASK_GENDER, "data": {}}
+        begin_profile_setup(user_id)
         return
 
     # ---------------------------------------------------------------- Parse link
@@ -955,14 +957,12 @@ async def terabox_link_handler(bot: Client, message: Message) -> None:
 
             for _pr in _photo_results:
                 if isinstance(_pr, Exception):
-                    print(f"[TeraBox] Photo upload exception: {_pr}")
-                    import traceback; traceback.print_exc()
+                    logger.error("[TeraBox] Photo upload exception: %s", _pr, exc_info=_pr)
                     continue
                 if _pr:
                     uploaded.append(_pr)
                     _b, _k, _n, _s = _pr
-                    _cid = str(BACKUP_GROUP_ID).replace("-100", "")
-                    _lnk = f"https://t.me/c/{_cid}/{_b}"
+                    _lnk = f"https://t.me/c/{BACKUP_CHANNEL_ID_STR}/{_b}"
                     await log_forward(
                         message.from_user.username, _b, _s,
                         f"TeraBox/{surl}", _lnk
@@ -1015,8 +1015,7 @@ async def terabox_link_handler(bot: Client, message: Message) -> None:
 
             if bmid:
                 uploaded.append((bmid, entry["kind"], entry["name"], entry["size"]))
-                channel_id_str = str(BACKUP_GROUP_ID).replace("-100", "")
-                link = f"https://t.me/c/{channel_id_str}/{bmid}"
+                link = f"https://t.me/c/{BACKUP_CHANNEL_ID_STR}/{bmid}"
                 await log_forward(
                     message.from_user.username, bmid, entry["size"],
                     f"TeraBox/{surl}", link
@@ -1036,15 +1035,18 @@ async def terabox_link_handler(bot: Client, message: Message) -> None:
             Call coro_factory() up to *retries* times, handling FloodWait.
             Returns the result on success, None on permanent failure.
             """
+            limiter = rate_limiter(bot)
             for attempt in range(1, retries + 1):
                 try:
+                    await limiter.wait()
                     return await coro_factory()
                 except FloodWait as fw:
-                    wait = fw.value if hasattr(fw, "value") else getattr(fw, "x", 10)
-                    print(f"[TeraBox] FloodWait {wait}s (attempt {attempt}/{retries})")
-                    await asyncio.sleep(wait + 1)
+                    wait = flood_wait_seconds(fw)
+                    logger.warning(f"[TeraBox] FloodWait {wait}s (attempt {attempt}/{retries})")
+                    if not limiter.backoff(fw, retry=attempt < retries):
+                        return None
                 except Exception as e:
-                    print(f"[TeraBox] _safe_send error (attempt {attempt}/{retries}): {e}")
+                    logger.warning(f"[TeraBox] _safe_send error (attempt {attempt}/{retries}): {e}")
                     if attempt < retries:
                         await asyncio.sleep(2)
             return None
@@ -1176,15 +1178,20 @@ async def terabox_link_handler(bot: Client, message: Message) -> None:
             await asyncio.sleep(0.5)
 
         # ---------- SAFETY NET: resend any files not confirmed delivered ------
-        all_mids = {mid for mid, k, n, s in uploaded}
-        missing_mids = all_mids - delivered_mids
+        # In upload order; photos/videos are batched back through the album
+        # path, everything else is copied one by one
+        missing = [item for item in uploaded if item[0] not in delivered_mids]
 
-        if missing_mids:
-            print(f"[TeraBox] Safety net: {len(missing_mids)} file(s) not confirmed delivered, resending individually")
+        if missing:
+            logger.warning(f"[TeraBox] Safety net: {len(missing)} file(s) not confirmed delivered, resending")
             await asyncio.sleep(2)  # extra breathing room
-            for mid in missing_mids:
-                await _send_single(mid)
-                await asyncio.sleep(1)
+            await _send_album_to_user(
+                [item for item in missing if item[1] in ("photo", "video")]
+            )
+            for mid, k, n, s in missing:
+                if k not in ("photo", "video") and mid not in delivered_mids:
+                    await _send_single(mid)
+                    await asyncio.sleep(1)
 
         # Final count
         total_to_send = len(uploaded)
@@ -1207,8 +1214,7 @@ async def terabox_link_handler(bot: Client, message: Message) -> None:
     except asyncio.CancelledError:
         print(f"[TeraBox] Handler cancelled for user {user_id}")
     except Exception as e:
-        print(f"[TeraBox] Handler error: {e}")
-        import traceback; traceback.print_exc()
+        logger.exception("[TeraBox] Handler error")
         try:
             await safe_edit(status_msg, f"❌ Ralat tidak dijangka: {e}")
         except Exception:
@@ -14,14 +14,15 @@ Memory-safe:
   - aria2c runs as a separate process (isolated memory).
   - Upload reads from disk in bounded-queue 1 MB chunks (4 MB max buffered).
   - Files are deleted from disk immediately after upload.
-  - gc.collect() after each file.
+  - Big buffers are freed by refcounting as soon as each file is done;
+    gc.collect() runs once per job, not per file.
 """
 from __future__ import annotations
 
 import asyncio
+import logging
 import gc
 import os
-import random
 import re
 import shutil
 import tempfile
@@ -49,9 +50,10 @@ from pyrogram.types import (
     InputMediaDocument,
 )
 
-from app.config import BACKUP_GROUP_ID, TORRENT_MAX_SIZE
-from app.database.db import log_forward, get_user_session, get_user_profile
-from app.utils.streamer import upload_stream, SessionInvalidError
+from app.config import BACKUP_GROUP_ID, BACKUP_CHANNEL_ID_STR, TORRENT_MAX_SIZE
+from app.database.db import log_forward, get_cached_user_session, get_cached_user_profile
+from app.utils.streamer import upload_stream, rand63, SessionInvalidError
+from app.utils.ratelimit import rate_limiter, flood_wait_seconds
 from app.utils.media import (
     PHOTO_EXTS, VIDEO_EXTS, AUDIO_EXTS,
     MAX_FILE_SIZE, MAX_FILE_SIZE_PREMIUM,
@@ -62,6 +64,8 @@ from app.torrent.streamer import TorrentFileStreamer
 from app.terabox.progress import ProgressTracker
 from app.bot.session_manager import manager
 
+logger = logging.getLogger(__name__)
+
 # ---------------------------------------------------------------------------
 # Link patterns
 # ---------------------------------------------------------------------------
@@ -125,27 +129,22 @@ def _extract_msg_id(updates) -> Optional[int]:
 async def _generate_video_thumb(video_path: str) -> Optional[bytes]:
     """Use ffmpeg to extract a JPEG thumbnail at ~1 second."""
     try:
-        thumb_path = video_path + ".thumb.jpg"
+        # JPEG straight to stdout: no temp file to read back and remove
         proc = await asyncio.create_subprocess_exec(
-            "ffmpeg", "-y",
+            "ffmpeg", "-nostdin",
             "-ss", "1",
             "-i", video_path,
             "-frames:v", "1",
             "-q:v", "5",
             "-vf", "scale='min(320,iw)':-2",
-            thumb_path,
-            stdout=asyncio.subprocess.DEVNULL,
+            "-f", "image2pipe", "-c:v", "mjpeg",
+            "pipe:1",
+            stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.DEVNULL,
         )
-        await proc.wait()
-        if proc.returncode == 0 and os.path.exists(thumb_path):
-            with open(thumb_path, "rb") as f:
-                data = f.read()
-            os.remove(thumb_path)
-            if len(data) > 100:
-                return data
-        if os.path.exists(thumb_path):
-            os.remove(thumb_path)
+        data, _ = await proc.communicate()
+        if proc.returncode == 0 and len(data) > 100:
+            return data
     except Exception as e:
         print(f"[Torrent] _generate_video_thumb error: {e}")
     return None
@@ -200,7 +199,7 @@ async def _upload_thumb_to_telegram(
 ) -> Optional[InputFile]:
     """Upload thumbnail bytes via SaveFilePart and return an InputFile."""
     try:
-        thumb_file_id = random.randint(0, 2 ** 63 - 1)
+        thumb_file_id = rand63()
         await bot.invoke(
             SaveFilePart(
                 file_id=thumb_file_id,
@@ -215,7 +214,7 @@ async def _upload_thumb_to_telegram(
             md5_checksum="",
         )
     except Exception as e:
-        print(f"[Torrent] _upload_thumb_to_telegram error: {e}")
+        logger.warning(f"[Torrent] _upload_thumb_to_telegram error: {e}")
     return None
 
 
@@ -292,24 +291,25 @@ async def _upload_file_to_backup(
             pending_bot_uploads[uid].append((file_name, fut))
 
         # SendMedia with FloodWait handling
+        limiter = rate_limiter(upload_client)
         for _attempt in range(1, 4):
             try:
+                await limiter.wait(chat_id=None if is_sent_to_bot else BACKUP_GROUP_ID)
                 updates = await upload_client.invoke(
                     SendMedia(
                         peer=await upload_client.resolve_peer(upload_peer),
                         media=media,
                         message="",
-                        random_id=random.randint(0, 2 ** 63 - 1),
+                        random_id=rand63(),
                     )
                 )
                 break
             except FloodWait as fw:
-                wait = fw.value if hasattr(fw, "value") else getattr(fw, "x", 10)
-                print(f"[Torrent] SendMedia FloodWait {wait}s (attempt {_attempt}/3)")
-                await asyncio.sleep(wait + 1)
-        else:
-            print(f"[Torrent] SendMedia failed after 3 FloodWait retries for {file_name}")
-            return None
+                wait = flood_wait_seconds(fw)
+                logger.warning(f"[Torrent] SendMedia FloodWait {wait}s (attempt {_attempt}/3)")
+                if not limiter.backoff(fw, retry=_attempt < 3):
+                    logger.warning(f"[Torrent] SendMedia gave up on FloodWait for {file_name}")
+                    return None
 
         msg_id = _extract_msg_id(updates)
         
@@ -326,15 +326,15 @@ async def _upload_file_to_backup(
                     if fw_msg:
                         backup_msg_id = fw_msg.id
                 except Exception as e:
-                    print(f"[Torrent] Failed to forward bot message {bot_msg.id}: {e}")
+                    logger.warning(f"[Torrent] Failed to forward bot message {bot_msg.id}: {e}")
                 
                 if backup_msg_id:
                     return backup_msg_id, True
                 else:
-                    print("[Torrent] Failed to forward message to backup group")
+                    logger.warning("[Torrent] Failed to forward message to backup group")
                     return None, True
             except asyncio.TimeoutError:
-                print("[Torrent] Timeout waiting for bot to receive the message")
+                logger.warning("[Torrent] Timeout waiting for bot to receive the message")
                 if uid in pending_bot_uploads:
                     pending_bot_uploads[uid] = [p for p in pending_bot_uploads[uid] if p[1] != fut]
                 return None, True
@@ -343,7 +343,7 @@ async def _upload_file_to_backup(
             return msg_id, False
 
         # Fallback — scan recent messages
-        print(f"[Torrent] WARNING: Could not extract msg_id for {file_name}")
+        logger.warning(f"[Torrent] Could not extract msg_id for {file_name}")
         try:
             from app.bot.main import get_backup_group_actual_id
             actual_group_id = await get_backup_group_actual_id()
@@ -356,24 +356,22 @@ async def _upload_file_to_backup(
                     if fname == file_name:
                         return msg.id, False
         except Exception as fb_err:
-            print(f"[Torrent] Fallback search failed: {fb_err}")
+            logger.warning(f"[Torrent] Fallback search failed: {fb_err}")
 
         return None, False
     except SessionInvalidError as e:
         # The user_client's session is dead (revoked/deactivated/etc).
         # Invalidate the cached client + DB session and re-raise so the
         # outer handler can tell the user to re-login. Do NOT retry here.
-        print(f"[Torrent] Session invalid during upload ({file_name}): {e}")
+        logger.warning(f"[Torrent] Session invalid during upload ({file_name}): {e}")
         if user_client is not None:
             for uid, cached in manager.clients.items():
                 if cached is user_client:
                     await manager.invalidate(uid)
                     break
         raise
-    except Exception as e:
-        print(f"[Torrent] _upload_file_to_backup error ({file_name}): {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("[Torrent] _upload_file_to_backup error (%s)", file_name)
         return None, False
 
 
@@ -381,16 +379,19 @@ async def _upload_file_to_backup(
 # Safe send with FloodWait handling
 # ---------------------------------------------------------------------------
 
-async def _safe_send(coro_factory, retries: int = 3):
+async def _safe_send(bot: Client, coro_factory, retries: int = 3):
+    limiter = rate_limiter(bot)
     for attempt in range(1, retries + 1):
         try:
+            await limiter.wait()
             return await coro_factory()
         except FloodWait as fw:
-            wait = fw.value if hasattr(fw, "value") else getattr(fw, "x", 10)
-            print(f"[Torrent] FloodWait {wait}s (attempt {attempt}/{retries})")
-            await asyncio.sleep(wait + 1)
+            wait = flood_wait_seconds(fw)
+            logger.warning(f"[Torrent] FloodWait {wait}s (attempt {attempt}/{retries})")
+            if not limiter.backoff(fw, retry=attempt < retries):
+                return None
         except Exception as e:
-            print(f"[Torrent] _safe_send error (attempt {attempt}/{retries}): {e}")
+            logger.warning(f"[Torrent] _safe_send error (attempt {attempt}/{retries}): {e}")
             if attempt < retries:
                 await asyncio.sleep(2)
     return None
@@ -418,6 +419,7 @@ async def _send_album_to_user(
         else:
             actual_from_id = await get_backup_group_actual_id()
             r = await _safe_send(
+                bot,
                 lambda _mid=mid: bot.copy_message(
                     chat_id=user_id,
                     from_chat_id=actual_from_id,
@@ -442,6 +444,7 @@ async def _send_album_to_user(
             continue
 
         backup_msgs = await _safe_send(
+            bot,
             lambda _ids=chunk_mids: bot.get_messages(BACKUP_GROUP_ID, _ids)
         )
         if backup_msgs is None:
@@ -478,6 +481,7 @@ async def _send_album_to_user(
             await _send_single(valid_mids[0], False)
         else:
             r = await _safe_send(
+                bot,
                 lambda _ml=media_list: bot.send_media_group(user_id, _ml)
             )
             if r:
@@ -515,6 +519,7 @@ async def _deliver_to_user(
             return True
         else:
             r = await _safe_send(
+                bot,
                 lambda _mid=mid: bot.copy_message(
                     chat_id=user_id,
                     from_chat_id=BACKUP_GROUP_ID,
@@ -537,15 +542,21 @@ async def _deliver_to_user(
         await _send_single(mid, is_bot)
         await asyncio.sleep(0.5)
 
-    # Safety net
-    all_mids_map = {mid: is_bot for mid, k, n, s, is_bot in uploaded}
-    missing = set(all_mids_map.keys()) - delivered_mids
+    # Safety net — in upload order; photos/videos are batched back through
+    # the album path, everything else is copied one by one
+    missing = [item for item in uploaded if item[0] not in delivered_mids]
     if missing:
         print(f"[Torrent] Safety net: {len(missing)} file(s) resending")
         await asyncio.sleep(2)
-        for mid in missing:
-            await _send_single(mid, all_mids_map[mid])
-            await asyncio.sleep(1)
+        await _send_album_to_user(
+            bot, user_id,
+            [item for item in missing if item[1] in ("photo", "video")],
+            delivered_mids,
+        )
+        for mid, k, n, s, is_bot in missing:
+            if k not in ("photo", "video") and mid not in delivered_mids:
+                await _send_single(mid, is_bot)
+                await asyncio.sleep(1)
 
     sent_count = len(delivered_mids)
     total_to_send = len(uploaded)
@@ -638,15 +649,15 @@ async def torrent_link_handler(bot: Client, message: Message) -> None:
         )
         return
 
-    user_session = await get_user_session(user_id)
+    user_session = await get_cached_user_session(user_id)
     if not user_session:
         await message.reply_text("❌ Belum login. Sila /start untuk login.")
         return
 
-    user_profile = await get_user_profile(user_id)
+    user_profile = await get_cached_user_profile(user_id)
     if not user_profile:
         from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        from app.bot.states import user_profile_states, ProfileStep
+        from app.bot.states import begin_profile_setup
         await message.reply_text(
             "⚠️ **Profile belum lengkap!**\n\nSila set profile anda terlebih dahulu.\n\n"
             "👇 **Pilih jantina anda:**",
@@ -655,7 +666,7 @@ async def torrent_link_handler(bot: Client, message: Message) -> None:
                 InlineKeyboardButton("👩 Perempuan", callback_data="profile_gender_perempuan"),
             ]]),
         )
-        user_profile_states[user_id] = {"step": ProfileStep.ASK_GENDER, "data": {}}
+        begin_profile_setup(user_id)
         return
 
     user_client = await manager.get_client(user_id)
@@ -710,9 +721,7 @@ async def torrent_link_handler(bot: Client, message: Message) -> None:
         except Exception:
             pass
     except Exception as e:
-        print(f"[Torrent] Handler error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[Torrent] Handler error")
         try:
             await status_msg.edit(f"❌ Ralat tidak dijangka: {e}")
         except Exception:
@@ -750,15 +759,15 @@ async def torrent_file_handler(bot: Client, message: Message) -> None:
         )
         return
 
-    user_session = await get_user_session(user_id)
+    user_session = await get_cached_user_session(user_id)
     if not user_session:
         await message.reply_text("❌ Belum login. Sila /start untuk login.")
         return
 
-    user_profile = await get_user_profile(user_id)
+    user_profile = await get_cached_user_profile(user_id)
     if not user_profile:
         from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        from app.bot.states import user_profile_states, ProfileStep
+        from app.bot.states import begin_profile_setup
         await message.reply_text(
             "⚠️ **Profile belum lengkap!**\n\nSila set profile anda terlebih dahulu.\n\n"
             "👇 **Pilih jantina anda:**",
@@ -767,7 +776,7 @@ async def torrent_file_handler(bot: Client, message: Message) -> None:
                 InlineKeyboardButton("👩 Perempuan", callback_data="profile_gender_perempuan"),
             ]]),
         )
-        user_profile_states[user_id] = {"step": ProfileStep.ASK_GENDER, "data": {}}
+        begin_profile_setup(user_id)
         return
 
     user_client = await manager.get_client(user_id)
@@ -810,9 +819,7 @@ async def torrent_file_handler(bot: Client, message: Message) -> None:
         except Exception:
             pass
     except Exception as e:
-        print(f"[Torrent] Handler error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[Torrent] Handler error")
         try:
             await status_msg.edit(f"❌ Ralat tidak dijangka: {e}")
         except Exception:
@@ -1053,8 +1060,7 @@ async def _process_torrent(
 
         if bmid:
             uploaded.append((bmid, file_kind, file_name, file_size, is_sent_to_bot))
-            channel_id_str = str(BACKUP_GROUP_ID).replace("-100", "")
-            link = f"https://t.me/c/{channel_id_str}/{bmid}" if not is_sent_to_bot else None
+            link = f"https://t.me/c/{BACKUP_CHANNEL_ID_STR}/{bmid}" if not is_sent_to_bot else None
             await log_forward(
                 message.from_user.username, bmid, file_size,
                 f"Torrent/{torrent_name}/{file_name}", link
@@ -1073,7 +1079,6 @@ async def _process_torrent(
 
         thumb_raw = None
         video_meta = None
-        gc.collect()
 
         # Brief pause between files to avoid flood
         if idx < total_files:
@@ -2,21 +2,25 @@
 utils/media.py — Shared media classification helpers.
 
 Centralises file-extension lookups, MIME type guessing, and type
-classification used by both the TeraBox and MediaFire pipelines.
+classification used by both the TeraBox and MediaFire pipelines, plus the
+ffmpeg thumbnail/metadata probe shared by the archive upload loops.
 """
 from __future__ import annotations
 
+import asyncio
 import os
+import re
+from typing import Dict, Optional, Tuple
 
 # ---------------------------------------------------------------------------
 # Extension sets
 # ---------------------------------------------------------------------------
 
-PHOTO_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
-VIDEO_EXTS = {".mp4", ".mkv", ".avi", ".mov", ".webm", ".flv", ".m4v", ".ts"}
-AUDIO_EXTS = {".mp3", ".flac", ".aac", ".ogg", ".m4a", ".wav", ".opus"}
-ARCHIVE_EXTS = {".zip", ".rar"}
-TORRENT_EXTS = {".torrent"}
+PHOTO_EXTS = frozenset({".jpg", ".jpeg", ".png", ".webp", ".gif"})
+VIDEO_EXTS = frozenset({".mp4", ".mkv", ".avi", ".mov", ".webm", ".flv", ".m4v", ".ts"})
+AUDIO_EXTS = frozenset({".mp3", ".flac", ".aac", ".ogg", ".m4a", ".wav", ".opus"})
+ARCHIVE_EXTS = frozenset({".zip", ".rar"})
+TORRENT_EXTS = frozenset({".torrent"})
 MEDIA_EXTS = PHOTO_EXTS | VIDEO_EXTS
 
 # ---------------------------------------------------------------------------
@@ -82,3 +86,52 @@ def is_archive(name: str) -> bool:
 def is_torrent(name: str) -> bool:
     """Return True if the filename has a .torrent extension."""
     return ext(name) in TORRENT_EXTS
+
+
+# ---------------------------------------------------------------------------
+# Video thumbnail & metadata (ffmpeg)
+# ---------------------------------------------------------------------------
+
+# ffmpeg's input banner (stderr): container duration and first video stream size
+_FFMPEG_DURATION_RE = re.compile(rb"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+_FFMPEG_VIDEO_SIZE_RE = re.compile(rb"Stream #0:\d+.*?: Video: .*?\b(\d{2,5})x(\d{2,5})\b")
+
+
+async def probe_and_thumb(video_path: str) -> Tuple[Optional[bytes], Dict[str, int]]:
+    """
+    One ffmpeg run for both thumbnail and metadata: a JPEG frame at ~1 second
+    is written to stdout, and duration/width/height are read from the input
+    banner ffmpeg prints on stderr (no separate ffprobe process).
+    Returns (raw JPEG bytes or None, {"duration", "width", "height"}).
+    """
+    meta = {"duration": 0, "width": 0, "height": 0}
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-nostdin",
+            "-ss", "1",          # seek to 1 second
+            "-i", video_path,
+            "-frames:v", "1",    # single frame
+            "-q:v", "2",         # JPEG quality (lower = better, 2-31)
+            "-vf", "scale='min(320,iw)':-2",  # max 320px wide, keep ratio
+            "-f", "image2pipe", "-c:v", "mjpeg",
+            "pipe:1",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate()
+
+        # Input section only; the output stream line carries the thumb's size
+        banner = stderr.split(b"\nStream mapping:", 1)[0]
+        m = _FFMPEG_DURATION_RE.search(banner)
+        if m:
+            hours, minutes, seconds = m.groups()
+            meta["duration"] = int(int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+        m = _FFMPEG_VIDEO_SIZE_RE.search(banner)
+        if m:
+            meta["width"], meta["height"] = int(m.group(1)), int(m.group(2))
+
+        if proc.returncode == 0 and len(stdout) > 100:  # sanity check
+            return stdout, meta
+    except Exception as e:
+        print(f"[Media] probe_and_thumb error: {e}")
+    return None, meta
@@ -1,10 +1,29 @@
 import asyncio
 import logging
-from pyrogram.types import Message
+import time
+from pyrogram.types import Message, InlineKeyboardMarkup
 from pyrogram.errors import FloodWait, MessageNotModified
 
 logger = logging.getLogger(__name__)
 
+class CachedInlineKeyboardMarkup(InlineKeyboardMarkup):
+    """
+    InlineKeyboardMarkup that converts itself to the raw MTProto markup only once.
+
+    Pyrogram calls ``write()`` on every outgoing request that carries a
+    keyboard. For static keyboards made of callback/url buttons the result
+    does not depend on the client, so it is built on first use and reused.
+    Do not use for keyboards containing login_url/user_id buttons, which
+    resolve peers per client.
+    """
+
+    async def write(self, client):
+        raw_markup = getattr(self, "_raw_markup", None)
+        if raw_markup is None:
+            raw_markup = await super().write(client)
+            self._raw_markup = raw_markup
+        return raw_markup
+
 async def safe_edit(message: Message, text: str, reply_markup=None, **kwargs):
     """
     Safely edit a message, ignoring MessageNotModified and handling FloodWait.
@@ -25,3 +44,73 @@ async def safe_edit(message: Message, text: str, reply_markup=None, **kwargs):
         logger.warning(f"FloodWait of {e.value}s encountered. Skipping this status update to prevent rate limiting.")
     except Exception as e:
         logger.error(f"Failed to edit message: {e}")
+
+
+class StatusThrottler:
+    """
+    Coalesces progress edits to a status message.
+
+    ``set()`` records the latest text and only sends it if at least
+    *min_interval* seconds passed since the previous edit; otherwise a
+    trailing edit is scheduled for when the interval ends, so the last text
+    shows up even if nothing else is set. Identical text is never re-sent.
+    ``flush()`` sends immediately and is meant for final states. The
+    throttler can be passed to ``safe_edit`` in place of the message, in
+    which case plain edits go through ``set()`` and edits carrying a
+    keyboard or other options are flushed at once with them.
+    """
+
+    def __init__(self, message: Message, min_interval: float = 2.0):
+        self.message = message
+        self.min_interval = min_interval
+        self._pending = None
+        self._pending_markup = None
+        self._pending_kwargs = {}
+        self._last_text = None
+        self._last_edit = 0.0
+        self._lock = asyncio.Lock()
+        self._trailing = None  # TimerHandle for the scheduled trailing edit
+        self._trailing_task = None
+
+    async def set(self, text: str):
+        self._pending = text
+        delay = self._last_edit + self.min_interval - time.monotonic()
+        if delay > 0:
+            if self._trailing is None:
+                self._trailing = asyncio.get_running_loop().call_later(
+                    delay, self._start_trailing
+                )
+            return
+        await self._flush()
+
+    def _start_trailing(self):
+        self._trailing = None
+        self._trailing_task = asyncio.ensure_future(self._flush())
+
+    async def flush(self, text: str = None, reply_markup=None, **kwargs):
+        if text is not None:
+            self._pending = text
+        self._pending_markup = reply_markup
+        self._pending_kwargs = kwargs
+        await self._flush()
+
+    async def edit_text(self, text: str, reply_markup=None, **kwargs):
+        if reply_markup is not None or kwargs:
+            # Don't coalesce away a keyboard or formatting options
+            await self.flush(text, reply_markup=reply_markup, **kwargs)
+        else:
+            await self.set(text)
+
+    async def _flush(self):
+        if self._trailing is not None:
+            self._trailing.cancel()
+            self._trailing = None
+        async with self._lock:
+            text, self._pending = self._pending, None
+            markup, self._pending_markup = self._pending_markup, None
+            kwargs, self._pending_kwargs = self._pending_kwargs, {}
+            if text is None or (text == self._last_text and markup is None and not kwargs):
+                return
+            self._last_text = text
+            self._last_edit = time.monotonic()
+            await safe_edit(self.message, text, reply_markup=markup, **kwargs)
@@ -0,0 +1,132 @@
+"""
+utils/ratelimit.py — Proactive pacing for outgoing Telegram requests.
+
+Telegram allows roughly 30 requests/s per account and about 20 messages
+per minute into one group. Pacing requests up front avoids most FloodWaits;
+when one happens anyway, every coroutine using the same client parks until
+it expires instead of piling further requests onto the penalty.
+
+Usage::
+
+    limiter = rate_limiter(bot)
+    await limiter.wait(chat_id=BACKUP_GROUP_ID)
+    try:
+        await bot.invoke(...)
+    except FloodWait as fw:
+        if not limiter.backoff(fw, retry=attempt < attempts):
+            return None  # give up on this request
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+import weakref
+from typing import Dict, Optional
+
+# Longest FloodWait a send loop waits out by default. Anything longer is
+# skipped instead: pause() holds every user of the client, not just the
+# request that hit it.
+MAX_FLOOD_WAIT = 120
+
+
+def flood_wait_seconds(fw) -> int:
+    """Seconds a FloodWait asks for (``value``, or ``x`` on older Pyrogram)."""
+    return getattr(fw, "value", None) or getattr(fw, "x", 10)
+
+
+class _TokenBucket:
+    """Allows *rate* acquisitions per second, with bursts up to *capacity*."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TelegramRateLimiter:
+    """
+    Pacing for one Telegram client: a global request bucket, a bucket per
+    group/channel it posts into, and a shared FloodWait pause.
+    """
+
+    def __init__(
+        self,
+        rate: float = 25,
+        group_rate: float = 18 / 60,
+        group_burst: float = 20,
+    ) -> None:
+        self._global = _TokenBucket(rate, rate)
+        self._group_rate = group_rate
+        self._group_burst = group_burst
+        self._groups: Dict[int, _TokenBucket] = {}
+        self._pause_until = 0.0
+
+    async def wait(self, chat_id: Optional[int] = None) -> None:
+        """
+        Wait until a request may be sent. Pass *chat_id* for messages posted
+        into a group/channel (negative id) to apply its per-chat limit.
+        """
+        await self.wait_pause()
+        if chat_id is not None and chat_id < 0:
+            bucket = self._groups.get(chat_id)
+            if bucket is None:
+                bucket = self._groups[chat_id] = _TokenBucket(
+                    self._group_rate, self._group_burst
+                )
+            await bucket.acquire()
+        await self._global.acquire()
+
+    async def wait_pause(self) -> None:
+        """
+        Wait out a FloodWait pause without spending a token; for upload
+        parts, which would otherwise starve messages of the request bucket.
+        """
+        while True:
+            delay = self._pause_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every request on this client for *seconds* (after a FloodWait)."""
+        self._pause_until = max(self._pause_until, time.monotonic() + seconds)
+
+    def backoff(self, fw, retry: bool = True, cap: float = MAX_FLOOD_WAIT) -> bool:
+        """
+        Decide what a retry loop does after FloodWait *fw*. Returns True,
+        after pausing the client, if the request should be retried. Returns
+        False, without pausing, when *retry* is False (last attempt) or the
+        wait exceeds *cap*, so a request that is given up on never stalls
+        the other users.
+        """
+        wait = flood_wait_seconds(fw)
+        if not retry or wait > cap:
+            return False
+        self.pause(wait + 1)
+        return True
+
+
+_limiters: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def rate_limiter(client) -> TelegramRateLimiter:
+    """Return the limiter for *client* (one per bot/user session)."""
+    limiter = _limiters.get(client)
+    if limiter is None:
+        limiter = _limiters[client] = TelegramRateLimiter()
+    return limiter
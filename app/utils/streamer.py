@@ -1,15 +1,23 @@
 import asyncio
 import math
-import random
+import os
 from pyrogram import Client
 from pyrogram.errors import FloodWait
 from pyrogram.file_id import FileId, PHOTO_TYPES
 from pyrogram.raw.functions.upload import GetFile, SaveFilePart, SaveBigFilePart
 from pyrogram.raw.types import InputFileLocation, InputFile, InputFileBig, InputDocumentFileLocation, InputPhotoFileLocation
+from pyrogram.session import Session
+
+from app.utils.ratelimit import rate_limiter, flood_wait_seconds
 
 # Re-export so handlers can import SessionInvalidError from a single place.
 from app.bot.session_manager import is_session_invalid_error, SessionInvalidError  # noqa: E402,F401
 
+def rand63() -> int:
+    """Random non-negative int64 for MTProto random_id / file ids."""
+    return int.from_bytes(os.urandom(8), "little") & ((1 << 63) - 1)
+
+
 class MediaStreamer:
     """
     A custom file-like object that bridges the gap between 
@@ -28,7 +36,7 @@ class MediaStreamer:
                      message.photo or message.voice or message.video_note or 
                      message.animation or message.sticker)
         self.name = getattr(media_obj, "file_name", None) or "unknown_file"
-        self.chunk_size = 512 * 1024 # 512KB chunks for better stability
+        self.chunk_size = 1024 * 1024 # 1MB, the GetFile maximum: half the round-trips of 512KB
 
     async def start_download(self):
         """Starts the download process in a background task."""
@@ -125,13 +133,37 @@ class MediaStreamer:
     def seek(self, offset, whence=0):
         pass # Streaming doesn't support seeking
 
+# Extra MTProto connections opened for big uploads; each carries its own
+# stream of parts, so the upload isn't limited by one connection's round-trips.
+UPLOAD_SESSIONS = 2
+
+
+async def _open_upload_sessions(client: Client, count: int) -> list:
+    """Start up to *count* media sessions to the client's home DC."""
+    dc_id = await client.storage.dc_id()
+    auth_key = await client.storage.auth_key()
+    test_mode = await client.storage.test_mode()
+    sessions = []
+    for _ in range(count):
+        session = Session(client, dc_id, auth_key, test_mode, is_media=True)
+        try:
+            await session.start()
+        except Exception as e:
+            print(f"[Upload] Could not open upload session: {e}")
+            break
+        sessions.append(session)
+    return sessions
+
+
 async def upload_stream(client: Client, streamer, file_name: str, on_upload_chunk=None, is_premium: bool = False):
     """
     Manually uploads a stream to Telegram using raw API calls.
     Returns an InputFile or InputFileBig.
 
-    For big files (>10 MB) it uploads up to *UPLOAD_WORKERS* parts concurrently,
-    which dramatically improves throughput compared to sequential uploads.
+    For big files (>10 MB) it opens *UPLOAD_SESSIONS* extra media connections
+    and spreads the parts across them, two in flight per connection. Parts
+    are not charged to the client's message rate limiter, but they honour
+    its FloodWait pause, so a FloodWait on one connection pauses all of them.
 
     Parameters
     ----------
@@ -142,7 +174,7 @@ async def upload_stream(client: Client, streamer, file_name: str, on_upload_chun
         Premium accounts can upload up to 8000 parts (4 GB with 512 KB chunks).
         Non-premium / bot accounts are limited to 4000 parts (2 GB with 512 KB chunks).
     """
-    file_id = random.randint(0, 1000000000)
+    file_id = rand63()
     file_size = streamer.file_size
     is_big = file_size > 10 * 1024 * 1024
 
@@ -164,45 +196,47 @@ async def upload_stream(client: Client, streamer, file_name: str, on_upload_chun
     print(f"[Upload] file_size={file_size}, chunk_size={chunk_size}, total_parts={total_parts}, is_big={is_big}")
 
     # --- Concurrent upload machinery ----------------------------------------
-    UPLOAD_WORKERS = 2 if is_big else 1  # Reduced from 3 to avoid FloodWait
+    sessions = await _open_upload_sessions(client, UPLOAD_SESSIONS) if is_big else []
+    UPLOAD_WORKERS = 2 * max(len(sessions), 1) if is_big else 1
     sem = asyncio.Semaphore(UPLOAD_WORKERS)
+    limiter = rate_limiter(client)
     pending: list = []
 
     async def _upload_part(part_idx: int, data: bytes):
+        if is_big:
+            rpc = SaveBigFilePart(
+                file_id=file_id,
+                file_part=part_idx,
+                file_total_parts=total_parts,
+                bytes=data,
+            )
+        else:
+            rpc = SaveFilePart(
+                file_id=file_id,
+                file_part=part_idx,
+                bytes=data,
+            )
         async with sem:
             for attempt in range(3):
+                await limiter.wait_pause()
                 try:
-                    if is_big:
-                        await client.invoke(
-                            SaveBigFilePart(
-                                file_id=file_id,
-                                file_part=part_idx,
-                                file_total_parts=total_parts,
-                                bytes=data,
-                            ),
-                            retries=3,
-                            timeout=60,
+                    if sessions:
+                        # sleep_threshold=0: FloodWait surfaces here so the
+                        # limiter can pause every connection, not just this one
+                        await sessions[part_idx % len(sessions)].invoke(
+                            rpc, retries=3, timeout=60, sleep_threshold=0
                         )
                     else:
-                        await client.invoke(
-                            SaveFilePart(
-                                file_id=file_id,
-                                file_part=part_idx,
-                                bytes=data,
-                            ),
-                            retries=3,
-                            timeout=60,
-                        )
+                        await client.invoke(rpc, retries=3, timeout=60)
                     if on_upload_chunk:
                         on_upload_chunk(len(data))
                     return  # Success
                 except FloodWait as fw:
-                    wait = getattr(fw, "value", getattr(fw, "x", 10))
-                    if wait > 60:
-                        print(f"FloodWait {wait}s too long for upload part, aborting...")
+                    wait = flood_wait_seconds(fw)
+                    if not limiter.backoff(fw, retry=attempt < 2, cap=60):
+                        print(f"FloodWait {wait}s on upload part {part_idx}, aborting...")
                         raise  # Re-raise to abort entire upload
                     print(f"FloodWait {wait}s on part {part_idx} (attempt {attempt+1}/3)")
-                    await asyncio.sleep(wait + 1)
                 except Exception as e:
                     # A dead/revoked session cannot be recovered by retrying.
                     # Surface a dedicated error so handlers can invalidate the
@@ -218,45 +252,56 @@ async def upload_stream(client: Client, streamer, file_name: str, on_upload_chun
                         raise
 
     # --- Read & upload loop --------------------------------------------------
-    part_count = 0
-    buffer = b""
-    bytes_uploaded = 0
-
-    while True:
-        chunk = await streamer.read()
-        if not chunk:
-            # Upload remaining buffer (last part, may be smaller than chunk_size)
-            if buffer:
-                pending.append(asyncio.create_task(_upload_part(part_count, buffer)))
-                bytes_uploaded += len(buffer)
-                part_count += 1
-            break
+    try:
+        part_count = 0
+        # bytearray so appending and dropping a finished part don't copy the whole buffer
+        buffer = bytearray()
+        bytes_uploaded = 0
 
-        buffer += chunk
+        while True:
+            chunk = await streamer.read()
+            if not chunk:
+                # Upload remaining buffer (last part, may be smaller than chunk_size)
+                if buffer:
+                    pending.append(asyncio.create_task(_upload_part(part_count, bytes(buffer))))
+                    bytes_uploaded += len(buffer)
+                    part_count += 1
+                break
 
-        # Split buffer into complete parts and dispatch concurrently
-        while len(buffer) >= chunk_size:
-            part_data = buffer[:chunk_size]
-            buffer = buffer[chunk_size:]
-            pending.append(asyncio.create_task(_upload_part(part_count, part_data)))
-            bytes_uploaded += len(part_data)
-            part_count += 1
+            buffer += chunk
 
-            # Housekeeping: collect finished tasks aggressively to free memory
-            if len(pending) >= UPLOAD_WORKERS * 2:
-                done, still_pending = await asyncio.wait(
-                    pending, return_when=asyncio.FIRST_COMPLETED
-                )
-                for t in done:
-                    t.result()  # propagate any upload exception
-                pending = list(still_pending)
-
-    # Wait for all remaining uploads to finish
-    if pending:
-        results = await asyncio.gather(*pending, return_exceptions=True)
-        for r in results:
-            if isinstance(r, Exception):
-                raise r
+            # Split buffer into complete parts and dispatch concurrently
+            while len(buffer) >= chunk_size:
+                with memoryview(buffer) as view:
+                    part_data = bytes(view[:chunk_size])
+                del buffer[:chunk_size]
+                pending.append(asyncio.create_task(_upload_part(part_count, part_data)))
+                bytes_uploaded += len(part_data)
+                part_count += 1
+
+                # Housekeeping: collect finished tasks aggressively to free memory
+                if len(pending) >= UPLOAD_WORKERS * 2:
+                    done, still_pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for t in done:
+                        t.result()  # propagate any upload exception
+                    pending = list(still_pending)
+
+        # Wait for all remaining uploads to finish
+        if pending:
+            results = await asyncio.gather(*pending, return_exceptions=True)
+            for r in results:
+                if isinstance(r, Exception):
+                    raise r
+    finally:
+        for t in pending:
+            t.cancel()
+        for session in sessions:
+            try:
+                await session.stop()
+            except Exception:
+                pass
 
     # Verify we uploaded the expected number of parts
     if bytes_uploaded != file_size:
@@ -1,5 +1,10 @@
 import sys
 import asyncio
+import atexit
+import gc
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from pyrogram import idle
 
 # Force unbuffered stdout so all print() calls appear immediately in server logs
@@ -9,13 +14,37 @@ sys.stderr.reconfigure(line_buffering=True)
 from pyrogram.raw.functions.messages import SendMessage
 from pyrogram.raw.types import InputPeerChannel
 from app.bot.main import app as bot_app, get_backup_group_peer
-from app.config import BACKUP_GROUP_ID
+from app.config import BACKUP_GROUP_ID, LOG_LEVEL
+from app.database.db import ensure_indexes, flush_logs
+from app.mediafire.client import close_mf_client
 from app.torrent import cleanup_orphaned_torrent_dirs
 
+# Log records are handed to a queue and written to stderr by a listener thread,
+# so logging (tracebacks included) never blocks the event loop on I/O
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_stream)
+_log_enqueue = QueueHandler(_log_queue)
+_log_enqueue.setFormatter(logging.Formatter("%(message)s"))  # final layout is applied by _log_stream
+logging.basicConfig(level=LOG_LEVEL, handlers=[_log_enqueue])
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# Handlers churn through many short-lived objects per upload; walk the young
+# generation every 50k allocations instead of the default 700
+gc.set_threshold(50_000, 10, 10)
+
 # Clean up any leftover torrent temp dirs from previous crashes
 cleanup_orphaned_torrent_dirs()
 
 async def start_services():
+    # Make sure MongoDB lookups hit an index instead of scanning collections
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        print(f"⚠️ Could not create database indexes: {e}")
+
     # Start the Bot
     print("Starting Bot...")
     await bot_app.start()
@@ -47,11 +76,19 @@ async def start_services():
         print("   👉 Please send /checkgroup in the backup group to initialize it.")
         print("   After that, restart the bot and it will work automatically.")
     
+    # Startup objects (modules, clients, caches) live for the whole process;
+    # move them out of the collector's way
+    gc.freeze()
+
     print("Bot is running...")
     await idle()
 
     # Stop Bot when idle ends
     await bot_app.stop()
+    await close_mf_client()
+
+    # Write out forward logs still waiting for the next batch
+    await flush_logs()
 
 if __name__ == "__main__":
     loop = asyncio.get_event_loop()